@@ -1,18 +1,19 @@
-import os
-
-import yaml
-from munch import munchify
 import logging
-
-try:
-    from yaml import CSafeLoader as SafeLoader
-except ImportError:
-    from yaml import SafeLoader as SafeLoader
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
 
 def get_config(name):
+    import yaml
+    from munch import munchify
+
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader as SafeLoader
+
     default_filenames = [
         # DEV
         "%s/etc/%s/%s.yaml" % (os.path.dirname(os.path.dirname(__file__)), name, name),
@@ -37,4 +38,35 @@ def get_config(name):
     raise Exception(message)
 
 
-CONF = get_config('linkypy')
+class LazyConfig(object):
+    """
+    Configuration only loaded from file on first use.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._conf = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._conf is None:
+            with self._lock:
+                if self._conf is None:
+                    self._conf = get_config(self._name)
+        return self._conf
+
+    @property
+    def loaded(self):
+        return self._conf is not None
+
+    def __getattr__(self, key):
+        return getattr(self.load(), key)
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __contains__(self, key):
+        return key in self.load()
+
+
+CONF = LazyConfig('linkypy')
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import datetime
+import random
+
+HISTORIC = 'historic'
+STANDARD = 'standard'
+MODES = (HISTORIC, STANDARD)
+
+STX = b'\x02'
+ETX = b'\x03'
+
+
+def checksum(data):
+    return bytes(((sum(data) & 0x3F) + 0x20,))
+
+
+def historic_line(label, value):
+    """
+    Historic mode line: separator before checksum is not part of the sum.
+    """
+    data = b"%s %s" % (label.encode('ascii'), value.encode('ascii'))
+    return b"\n" + data + b" " + checksum(data) + b"\r"
+
+
+def standard_line(label, value, date=None):
+    """
+    Standard mode line, with an optional timestamp field: separator before checksum is part of the sum.
+    """
+    fields = [label, date, value] if date is not None else [label, value]
+    data = "\t".join(fields).encode('ascii') + b"\t"
+    return b"\n" + data + checksum(data) + b"\r"
+
+
+class FrameGenerator(object):
+    """
+    Synthetic TIC frames with valid checksums, for historic (1200 bps) or standard (9600 bps) mode.
+
+    Indexes increase and power varies from frame to frame, as they would on a real meter.
+    """
+
+    def __init__(self, mode=HISTORIC, meter='012345678901', seed=0, start=None, interval=None):
+
+        if mode not in MODES:
+            raise ValueError("Unknown TIC mode '%s' (expected one of %s)" % (mode, ', '.join(MODES)))
+
+        self.mode = mode
+        self.meter = meter
+        self.random = random.Random(seed)
+        self.time = start or datetime.datetime(2020, 11, 21, 12, 0, 0)
+        self.interval = datetime.timedelta(seconds=interval or (1.5 if mode == HISTORIC else 1.0))
+        self.hchc = 835358
+        self.hchp = 1262798
+
+    def lines(self):
+        power = self.random.randint(100, 9000)
+        peak = 8 <= self.time.hour < 22
+        if peak:
+            self.hchp += power // 2400
+        else:
+            self.hchc += power // 2400
+        self.time += self.interval
+
+        if self.mode == HISTORIC:
+            return [
+                historic_line("ADCO", self.meter),
+                historic_line("OPTARIF", "HC.."),
+                historic_line("ISOUSC", "45"),
+                historic_line("HCHC", "%09d" % self.hchc),
+                historic_line("HCHP", "%09d" % self.hchp),
+                historic_line("PTEC", "HP.." if peak else "HC.."),
+                historic_line("IINST", "%03d" % (power // 230)),
+                historic_line("IMAX", "090"),
+                historic_line("PAPP", "%05d" % power),
+                historic_line("HHPHC", "A"),
+                historic_line("MOTDETAT", "000000"),
+            ]
+
+        date = "E" + self.time.strftime("%y%m%d%H%M%S")
+        return [
+            standard_line("ADSC", self.meter),
+            standard_line("VTIC", "02"),
+            standard_line("DATE", "", date),
+            standard_line("NGTF", "      H PLEINE/CREUSE"),
+            standard_line("LTARF", "    HEURE  PLEINE" if peak else "    HEURE  CREUSE"),
+            standard_line("EAST", "%09d" % (self.hchc + self.hchp)),
+            standard_line("EASF01", "%09d" % self.hchc),
+            standard_line("EASF02", "%09d" % self.hchp),
+            standard_line("IRMS1", "%03d" % (power // 230)),
+            standard_line("URMS1", "%03d" % self.random.randint(225, 240)),
+            standard_line("PREF", "09"),
+            standard_line("PCOUP", "09"),
+            standard_line("SINSTS", "%05d" % power),
+            standard_line("SMAXSN", "%05d" % 9000, date),
+            standard_line("CCASN", "%05d" % power, date),
+            standard_line("UMOY1", "%03d" % 231, date),
+            standard_line("STGE", "003A0001"),
+            standard_line("MSG1", "PAS DE          MESSAGE         "),
+            standard_line("NTARF", "02" if peak else "01"),
+            standard_line("NJOURF", "00"),
+            standard_line("NJOURF+1", "00"),
+            standard_line("PJOURF+1", "00008001 NONUTILE NONUTILE NONUTILE NONUTILE NONUTILE NONUTILE NONUTILE NONUTILE NONUTILE NONUTILE"),
+            standard_line("RELAIS", "001"),
+        ]
+
+    def frame(self, timestamp=False):
+        """
+        Next frame, from STX to ETX, optionally preceded by its timestamp as in replayed captures.
+        """
+        frame = STX + b"".join(self.lines()) + ETX
+        if timestamp:
+            frame = b"@" + self.time.isoformat().encode('ascii') + frame
+        return frame
+
+    def frames(self, count, timestamp=False):
+        for _ in range(count):
+            yield self.frame(timestamp)
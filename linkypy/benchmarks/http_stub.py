@@ -0,0 +1,75 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class HTTPStubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def handle_request(self):
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        stub.requests.append((self.command, self.path, dict(self.headers), body))
+        status, headers, content = stub.respond(self)
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = handle_request
+
+
+class HTTPStub(object):
+    """
+    Local HTTP server stand-in, answering every request with ``status``.
+    """
+
+    def __init__(self, status=204):
+        self.status = status
+        self.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), HTTPStubHandler)
+        self.server.stub = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def respond(self, handler):
+        return self.status, {}, b''
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class InfluxDBStub(HTTPStub):
+    """
+    Local InfluxDB stand-in: answers pings, queries (with empty results) and writes.
+    """
+
+    def respond(self, handler):
+        if self.status >= 400:
+            return self.status, {}, b'{"error": "stub error"}'
+        if handler.path.startswith('/ping'):
+            return 204, {'X-Influxdb-Version': 'stub'}, b''
+        if handler.path.startswith('/query'):
+            return 200, {'Content-Type': 'application/json'}, b'{"results": [{"statement_id": 0}]}'
+        return 204, {}, b''
+
+    def queries(self):
+        from urllib.parse import parse_qs, urlparse
+        return [parse_qs(urlparse(path).query).get('q', [parse_qs(body.decode()).get('q', [''])[0]])[0]
+                for method, path, _, body in self.requests if path.startswith('/query')]
+
+    def writes(self):
+        return [body for method, path, _, body in self.requests if path.startswith('/write')]
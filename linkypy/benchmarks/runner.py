@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+from linkypy.benchmarks.frames import HISTORIC, MODES, STX, FrameGenerator
+from linkypy.reader.packet_reader import LinkyPyPacketReader, open_serial
+
+logger = logging.getLogger(__name__)
+
+BAUDRATES = {'historic': 1200, 'standard': 9600}
+
+# Baseline shipped with LinkyPy, record one on target hardware with 'linkypy benchmark --save'.
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def percentile(samples, q):
+    """
+    Percentile ``q`` (0-100) of sorted samples, nearest rank.
+    """
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(round(q / 100. * len(samples))) - 1))]
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of the process, in KiB: benchmarks are run in their own process to report their own peak.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Latency(object):
+    """
+    Latency samples of a pipeline stage, reported in milliseconds.
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def report(self):
+        samples = sorted(self.samples)
+        report = dict(('p%d' % q, percentile(samples, q)) for q in (50, 95, 99))
+        report['max'] = samples[-1] if samples else None
+        return dict((key, round(value * 1000., 3) if value is not None else None) for key, value in report.items())
+
+
+class BenchmarkReader(LinkyPyPacketReader):
+    """
+    Packet reader with given callbacks, timing parse stage and signaling when ``count`` packets were handled.
+    """
+
+    def __init__(self, callbacks, count, stages):
+        super(BenchmarkReader, self).__init__()
+        self.benchmark_callbacks = callbacks
+        self.count = count
+        self.stages = stages
+        self.handled = 0
+        self.done = threading.Event()
+
+    def load_callbacks(self):
+        return self.benchmark_callbacks
+
+    def dispatch_options(self):
+        # Frames are never dropped, so that throughput accounts for every one of them.
+        return {'queue_size': 256, 'overflow': 'block'}
+
+    def handle_packet(self, packet, start=0, end=None, timestamp=None):
+        begin = time.perf_counter()
+        data = super(BenchmarkReader, self).handle_packet(packet, start, end, timestamp)
+        self.stages['parse'].add(time.perf_counter() - begin)
+        self.handled += 1
+        if self.handled >= self.count:
+            self.done.set()
+        return data
+
+
+class TimedCallback(object):
+    """
+    Wraps a callback, timing the delay between packet reception and computation, and computation itself.
+    """
+
+    def __init__(self, callback, stages):
+        self.callback = callback
+        self.stages = stages
+        # Same labels as wrapped callback, so that frames are projected and skipped alike.
+        self.LABELS = getattr(callback, 'LABELS', None)
+        self.OPTIONAL_LABELS = getattr(callback, 'OPTIONAL_LABELS', None)
+
+    def warm_up(self):
+        if hasattr(self.callback, 'warm_up'):
+            self.callback.warm_up()
+
+    def compute(self, data, timestamp, meter=None):
+        received = datetime.datetime.fromisoformat(timestamp).replace(tzinfo=datetime.timezone.utc).timestamp()
+        self.stages['dispatch'].add(time.time() - received)
+        begin = time.perf_counter()
+        self.callback.compute(data, timestamp, meter=meter)
+        self.stages['compute'].add(time.perf_counter() - begin)
+
+
+def bench_compute_line(count, mode=HISTORIC):
+    """
+    Checksum and decoding of single lines, through :meth:`LinkyPyPacketReader.compute_line`.
+    """
+    generator = FrameGenerator(mode)
+    lines = [line.strip(b"\n\r") for line in generator.lines()]
+    reader = LinkyPyPacketReader()
+
+    begin = time.perf_counter()
+    for i in range(count):
+        reader.compute_line(lines[i % len(lines)])
+    elapsed = time.perf_counter() - begin
+
+    return {'lines_per_s': round(count / elapsed), 'peak_rss_kb': peak_rss_kb()}
+
+
+def bench_handle_packet(count, mode=HISTORIC):
+    """
+    Parsing of whole frames, through :meth:`LinkyPyPacketReader.handle_packet`.
+    """
+    frames = [bytearray(frame) for frame in FrameGenerator(mode).frames(min(count, 100))]
+    reader = LinkyPyPacketReader()
+    parse = Latency()
+
+    begin = time.perf_counter()
+    for i in range(count):
+        frame = frames[i % len(frames)]
+        start = time.perf_counter()
+        reader.handle_packet(frame, 1, len(frame) - 1)
+        parse.add(time.perf_counter() - start)
+    elapsed = time.perf_counter() - begin
+
+    return {'frames_per_s': round(count / elapsed), 'latency_ms': {'parse': parse.report()}, 'peak_rss_kb': peak_rss_kb()}
+
+
+def bench_end_to_end(count, mode=HISTORIC, timeout=600):
+    """
+    Frames written to a ``loop://`` serial port, read by the reader thread, computed by the InfluxDB
+    callback and written to a local InfluxDB stand-in.
+    """
+    import serial.threaded
+    from linkypy import sinks
+    from linkypy.callbacks.influxdb_callback import InfluxDBCallback
+    from linkypy.sinks.influxdb_sink import InfluxDBSink
+    from linkypy.benchmarks.http_stub import InfluxDBStub
+
+    stages = dict((name, Latency()) for name in ('parse', 'dispatch', 'compute'))
+    frames = list(FrameGenerator(mode).frames(count))
+    # Next STX completes last frame.
+    frames.append(STX)
+
+    with InfluxDBStub() as stub:
+        sink = InfluxDBSink('127.0.0.1', stub.port, 'linky', 'admin', 'password', writer={'batch_size': 500, 'flush_interval': 1})
+        with sinks._sinks_lock:
+            previous = sinks._sinks.get('influxdb')
+            sinks._sinks['influxdb'] = sink
+        try:
+            callback = TimedCallback(InfluxDBCallback(), stages)
+            port = open_serial('loop://', BAUDRATES[mode])
+            reader = BenchmarkReader([callback], count, stages)
+
+            begin = time.perf_counter()
+            with serial.threaded.ReaderThread(port, lambda: reader):
+                # Loopback buffer is bounded: frames are written while reader thread consumes them.
+                writer = threading.Thread(target=lambda: [port.write(frame) for frame in frames], daemon=True)
+                writer.start()
+                if not reader.done.wait(timeout):
+                    raise RuntimeError("Only %d of %d frames were handled in %ds" % (reader.handled, count, timeout))
+                reader.dispatcher.join()
+                computed = time.perf_counter()
+                sink.close()
+            elapsed = time.perf_counter() - begin
+        finally:
+            with sinks._sinks_lock:
+                if previous is None:
+                    sinks._sinks.pop('influxdb', None)
+                else:
+                    sinks._sinks['influxdb'] = previous
+
+        points = sum(len(body.splitlines()) for body in stub.writes())
+
+    latency = dict((name, stage.report()) for name, stage in stages.items())
+    latency['flush'] = {'max': round((elapsed - (computed - begin)) * 1000., 3)}
+    return {
+        'frames_per_s': round(count / elapsed),
+        'points': points,
+        'write_requests': len(stub.writes()),
+        'latency_ms': latency,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+BENCHMARKS = (
+    ('compute_line', bench_compute_line, 20),
+    ('handle_packet', bench_handle_packet, 1),
+    ('end_to_end', bench_end_to_end, 1),
+)
+
+
+def run_benchmarks(frames=2000, modes=MODES, isolated=True, timeout=3600):
+    """
+    Run every benchmark for every TIC mode, ``frames`` frames each (lines benchmark computes 20x more lines).
+
+    Each benchmark is run in a fresh child process when ``isolated``, otherwise peak RSS of a benchmark
+    would be the one of the heaviest benchmark run before it.
+    """
+    from linkypy.prices_extractors.isolation import run_isolated
+
+    results = {}
+    for mode in modes:
+        for name, benchmark, factor in BENCHMARKS:
+            key = "%s.%s" % (name, mode)
+            logger.info("Running benchmark %s" % key)
+            if isolated:
+                results[key] = run_isolated(benchmark, (frames * factor, mode), timeout=timeout)
+            else:
+                results[key] = benchmark(frames * factor, mode)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Return regressions of ``results`` against ``baseline``: throughputs (``*_per_s``) lower, or peak RSS
+    higher, than baseline by more than ``tolerance`` (ratio).
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric, value in sorted(result.items()):
+            expected = reference.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(expected, (int, float)) or not expected:
+                continue
+            if metric.endswith('_per_s') and value < expected * (1. - tolerance):
+                regressions.append("%s %s: %s < %s (-%d%%)" % (key, metric, value, expected, round(100. * (1. - float(value) / expected))))
+            elif metric == 'peak_rss_kb' and value > expected * (1. + tolerance):
+                regressions.append("%s %s: %s > %s (+%d%%)" % (key, metric, value, expected, round(100. * (float(value) / expected - 1.))))
+    return regressions
+
+
+def load_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def format_results(results):
+    lines = []
+    for key, result in sorted(results.items()):
+        throughput = ", ".join("%s=%s" % (metric, value) for metric, value in sorted(result.items()) if metric.endswith('_per_s'))
+        lines.append("%-24s %s, peak RSS %.1f MiB" % (key, throughput, result['peak_rss_kb'] / 1024.))
+        for stage, report in sorted(result.get('latency_ms', {}).items()):
+            lines.append("%24s %-8s %s" % ('', stage, " ".join("%s=%sms" % item for item in sorted(report.items()))))
+    return "\n".join(lines)
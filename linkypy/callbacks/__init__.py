@@ -6,6 +6,17 @@ from linkypy import CONF
 logger = logging.getLogger(__name__)
 
 
+def callback_labels(callback):
+    """
+    Labels a callback reads: required ``LABELS`` and ``OPTIONAL_LABELS``, None when it declares none (every label).
+    """
+    labels = getattr(callback, 'LABELS', None)
+    optional_labels = getattr(callback, 'OPTIONAL_LABELS', None)
+    if labels is None and optional_labels is None:
+        return None
+    return tuple(labels or ()) + tuple(optional_labels or ())
+
+
 def get_callbacks():
 
     callbacks = []
@@ -1,64 +1,106 @@
 # -*- coding: utf-8 -*-
-import datetime
 import logging
 import os
 
-from influxdb import InfluxDBClient
+import pytz
+from linkypy import CONF
+from linkypy.callbacks.month_start import local_time
+from linkypy.callbacks.rollups import Rollup, packet_seconds
+from linkypy.sinks import get_sink
 
 logger = logging.getLogger(__name__)
 
 
 class InfluxDBCallback(object):
 
-    def __init__(self):
+    SINK = 'influxdb'
+
+    # Any of these labels is stored. Unchanged packets are still computed, as they count in rollups.
+    LABELS = ()
+    OPTIONAL_LABELS = ('HCHC', 'HCHP', 'PAPP')
+    SKIP_UNCHANGED = False
 
-        influxdb_service_host = os.getenv('INFLUXDB_SERVICE_HOST', 'influxdb.local')
-        influxdb_service_port = int(os.getenv('INFLUXDB_SERVICE_PORT', 8086))
-        influxdb_database = os.getenv('INFLUXDB_DATABASE', 'linky')
-        influxdb_username = os.getenv('INFLUXDB_USERNAME', 'admin')
-        influxdb_password = os.getenv('INFLUXDB_PASSWORD', 'password')
+    # Rollups (first/last values, late packets) expect packets in order: a single worker computes them.
+    THREAD_SAFE = False
 
-        logger.info("Connecting to InfluxDB %s:%s ..." % (influxdb_service_host, influxdb_service_port))
+    ROLLUP = (
+        ('PAPP', 'mean', 'PAPP'),
+        ('PAPP_MAX', 'max', 'PAPP'),
+        ('HCHC_FIRST', 'first', 'HCHC'),
+        ('HCHC', 'last', 'HCHC'),
+        ('HCHP_FIRST', 'first', 'HCHP'),
+        ('HCHP', 'last', 'HCHP'),
+    )
 
-        self.influx_client = InfluxDBClient(influxdb_service_host, influxdb_service_port,
-                                            influxdb_username, influxdb_password,
-                                            influxdb_database, retries=0, gzip=True)
-        self.influx_client.create_database(influxdb_database)
+    def __init__(self):
 
-        # Retention policy
-        self.influx_client.create_retention_policy('linky_rp', '1w', 1, database=influxdb_database, default=False)
+        self.sink = get_sink(self.SINK)
+        self.tz = pytz.timezone(os.getenv("TZ", "Europe/Paris"))
+        state_dir = CONF.linkypy.get('state_dir', '/var/lib/linkypy')
+        self.rollup = Rollup('linky_mean', self.ROLLUP, tags=('meter',), timezone=self.tz.zone, path=os.path.join(state_dir, 'rollup-linky_mean.json'))
 
-        # Continuous query
-        self.influx_client.drop_continuous_query('linky_mean_cq', influxdb_database)
-        select_clause = 'SELECT mean("PAPP") as PAPP, last("HCHC") AS HCHC, last("HCHP") AS HCHP INTO "linky_mean" FROM linky_rp.linky GROUP BY time(1h)'
-        self.influx_client.create_continuous_query('linky_mean_cq', select_clause, influxdb_database, 'EVERY 1m FOR 1h')
+    def warm_up(self):
+        """
+        Connects to InfluxDB and creates database schema, in the background.
+        """
+        self.sink.warm_up()
 
-        logger.info("Successfully connected to InfluxDB: " + self.influx_client.ping())
+        # Hourly means are rolled up by LinkyPy itself, continuous query of previous versions would overwrite them.
+        self.sink.schema.drop_continuous_query('linky_mean_cq')
 
-    def compute(self, data, timestamp):
+    def close(self):
         """
-        Stores data into InfluxDB.
+        Writes buckets in progress, called once packets are all computed.
         """
-        keep_data = {}
+        points = self.rollup.flush()
+        if points:
+            self.sink.write(points)
 
-        for key, value in data.items():
-            if key not in ['HCHC', 'HCHP', 'PAPP']:
+    def compute(self, data, timestamp, meter=None):
+        """
+        Stores data (changed fields only, when known) into InfluxDB, tagged with meter identifier, and closed rollups.
+        """
+        values = {}
+        for key in self.OPTIONAL_LABELS:
+            value = data.get(key)
+            if value is None:
                 continue
+            # Frames values are already decoded, plain dictionaries may still hold strings.
             try:
-                keep_data[key] = int(value)
-                logger.info("Keeping Linky data: %12s = %-12s" % (key, value))
+                values[key] = value if isinstance(value, int) else int(value)
             except Exception as e:
                 logger.error(e)
 
+        # Only fields that changed are written when reader detects changes.
+        changes = getattr(data, 'changes', None)
+        if changes is None:
+            keep_data = values
+        else:
+            keep_data = dict((key, value) for key, value in values.items() if key in changes)
+        for key, value in keep_data.items():
+            logger.info("Keeping Linky data: %12s = %-12s" % (key, value))
+
+        tags = {"meter": meter} if meter else {}
+        points = self.rollup.add(packet_seconds(timestamp), values, tags)
+        if points:
+            self.sink.write(points)
+
+        # Points without any field are rejected by InfluxDB (standard mode packets have none of these).
+        if not keep_data:
+            return
+
         # JSON body to send to influxdb.
         # Add month tag for InfluxDB 'GROUP BY'
+        now = local_time(timestamp, self.tz)
+        tags.update({
+            "month_number": now.month,
+            "year_number": now.year,
+            "month_name": now.strftime("%B").title()
+        })
+
         json_body = [{
             "measurement": "linky",
-            "tags": {
-                "month_number": datetime.datetime.now().month,
-                "year_number": datetime.datetime.now().year,
-                "month_name": datetime.datetime.now().strftime("%B").title()
-            },
+            "tags": tags,
             "time": timestamp,
             "fields": keep_data
         }]
@@ -66,5 +108,4 @@ class InfluxDBCallback(object):
         self.save(json_body)
 
     def save(self, json_body):
-        logger.info("Writing InfluxDB points")
-        self.influx_client.write_points(json_body, time_precision='s', retention_policy='linky_rp')
+        self.sink.write(json_body, retention_policy='linky_rp')
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import logging
+import os
+
+import pytz
+from dateutil.relativedelta import relativedelta
+
+logger = logging.getLogger(__name__)
+
+
+def local_time(timestamp, tz):
+    """
+    Time of a packet in ``tz``, from its ``timestamp`` (naive UTC ISO string), current time when missing.
+
+    Replayed packets keep their original time, so that they are tagged with their own month.
+    """
+    if not isinstance(timestamp, str):
+        return datetime.datetime.now(tz)
+    return pytz.utc.localize(datetime.datetime.fromisoformat(timestamp)).astimezone(tz)
+
+
+class MonthWindow(object):
+    """
+    Boundaries of the current month in local timezone, only computed again when month changes.
+    """
+
+    def __init__(self, timezone):
+
+        self.tz = pytz.timezone(timezone)
+        self.start = None
+        self.end = None
+        self.key = None
+        self.start_utc = None
+
+    def update(self, now):
+        """
+        Move window to the month of ``now`` (timezone aware) if needed.
+        """
+        if self.start is not None and self.start <= now < self.end:
+            return
+
+        local = now.astimezone(self.tz).replace(tzinfo=None)
+        first_of_month = local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+        self.start = self.tz.localize(first_of_month)
+        self.end = self.tz.localize(first_of_month + relativedelta(months=1))
+        self.key = first_of_month.strftime("%Y-%m")
+        self.start_utc = self.start.astimezone(pytz.utc).isoformat()
+
+    def elapsed_seconds(self, now):
+        return (now - self.start).total_seconds()
+
+    def remaining_seconds(self, now):
+        return (self.end - now).total_seconds()
+
+
+class MonthStartIndex(object):
+    """
+    First HP/HC indexes of the current month, tracked from Linky packets.
+
+    Indexes are persisted in a small JSON state file, ``legacy_path`` is read when it does not exist yet.
+    ``fallback`` (called with the UTC ISO start of month) is only used on a cold start, when state file
+    does not cover the current month.
+    """
+
+    def __init__(self, path, fallback=None, legacy_path=None):
+
+        self.path = path
+        self.legacy_path = legacy_path
+        self.fallback = fallback
+        self.month = None
+        self.first_hp = None
+        self.first_hc = None
+        self.live = False
+
+    def get(self, window, last_hp, last_hc):
+        """
+        Return first HP/HC indexes of window month, given indexes of current packet.
+        """
+        if self.month != window.key:
+            if self.live:
+                # Month changed while running: current packet is the first of the month.
+                first = (last_hp, last_hc)
+            else:
+                first = self.load(window) or self.query(window) or (last_hp, last_hc)
+
+            self.month = window.key
+            self.first_hp, self.first_hc = first
+            self.live = True
+            self.save()
+
+            logger.info("First HP/HC of the month %s: %s / %s" % (self.month, self.first_hp, self.first_hc))
+
+        return self.first_hp, self.first_hc
+
+    def load(self, window):
+        path = self.path
+        if self.legacy_path and not os.path.exists(path):
+            path = self.legacy_path
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if state.get('month') != window.key:
+            return None
+        return state['first_hp'], state['first_hc']
+
+    def query(self, window):
+        if self.fallback is None:
+            return None
+        try:
+            first_hp, first_hc = self.fallback(window.start_utc)
+            if first_hp is None or first_hc is None:
+                return None
+            return first_hp, first_hc
+        except Exception:
+            logger.error("An error occured while getting first HP/HC of the month.", exc_info=True)
+            return None
+
+    def save(self):
+        state = {
+            'month': self.month,
+            'first_hp': self.first_hp,
+            'first_hc': self.first_hc,
+            'updated': datetime.datetime.utcnow().isoformat(),
+        }
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError):
+            logger.error("Cannot save month start indexes to %s" % self.path, exc_info=True)
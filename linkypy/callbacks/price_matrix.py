@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION = 0
+HP_KWH_PRICE = 1
+HC_KWH_PRICE = 2
+
+
+class PriceMatrix(object):
+    """
+    Prices of every offer of every extractor, as an offers x (subscription, HP €/kWh, HC €/kWh) matrix.
+
+    HC price of BASE offers is their HP price, so costs of every offer come from a single expression.
+    """
+
+    def __init__(self, offers, prices):
+        import numpy as np
+
+        self.offers = offers
+        self.prices = np.asarray(prices, dtype=np.float64).reshape(len(offers), 3)
+
+    @classmethod
+    def build(cls, price_extractors, power):
+
+        offers = []
+        prices = []
+        for price_extractor in price_extractors:
+            for offer_name in price_extractor.get_available_offers_names():
+                for offer_type in price_extractor.get_available_offers_types():
+                    try:
+                        offer_prices = price_extractor.get_prices(offer_name, offer_type, power)
+                        subscription = float(offer_prices['MONTHLY_SUBSCRIPTION_PRICE'])
+                        hp_kwh_price = float(offer_prices['HP_KWH_PRICE'])
+                        hc_kwh_price = hp_kwh_price if offer_type == "BASE" else float(offer_prices['HC_KWH_PRICE'])
+                    except Exception as e:
+                        logger.error("Cannot get %s prices [%s / %s]: %s" % (price_extractor.provider_name, offer_name, offer_type, e))
+                        continue
+
+                    offers.append({
+                        "provider": price_extractor.provider_name,
+                        "offer_name": offer_name,
+                        "offer_type": offer_type,
+                        "power": power,
+                        "subscription_price": subscription,
+                        "hp_kwh_price": hp_kwh_price,
+                        "hc_kwh_price": hc_kwh_price,
+                    })
+                    prices.append((subscription, hp_kwh_price, hc_kwh_price))
+
+        logger.info("Loaded prices of %d offers" % len(offers))
+        return cls(offers, prices)
+
+    def __len__(self):
+        return len(self.offers)
+
+    def costs(self, consumed_kwh_hp, consumed_kwh_hc, elapsed_seconds, remaining_seconds):
+        """
+        Return current and estimated monthly costs of every offer.
+        """
+        import numpy as np
+
+        subscription = self.prices[:, SUBSCRIPTION]
+        price_today = self.prices[:, HP_KWH_PRICE] * consumed_kwh_hp + self.prices[:, HC_KWH_PRICE] * consumed_kwh_hc
+
+        # Price since beginning of month + estimate from average price per second + monthly subscription
+        current = np.round(price_today + subscription, 2)
+        if elapsed_seconds <= 0:
+            # Month just started: no consumption to extrapolate from yet.
+            estimated = np.round(subscription, 2)
+        else:
+            estimated = np.round(price_today * (1. + remaining_seconds / elapsed_seconds) + subscription, 2)
+
+        return current, estimated
@@ -1,203 +1,181 @@
 # -*- coding: utf-8 -*-
-import datetime
+import functools
 import logging
 import os
-from multiprocessing.dummy import Pool as ThreadPool
 
-import pytz
-from cachetools import TTLCache, cached
-from dateutil.relativedelta import relativedelta
-from influxdb import InfluxDBClient
+from linkypy import CONF
+from linkypy.callbacks.month_start import MonthStartIndex, MonthWindow, local_time
+from linkypy.callbacks.price_matrix import PriceMatrix
+from linkypy.callbacks.rollups import Rollup, packet_seconds
 from linkypy.prices_extractors import get_price_extractors
+from linkypy.prices_extractors.registry import get_price_registry
+from linkypy.sinks import get_sink
 
 logger = logging.getLogger(__name__)
 
-ttl = 60
-cache = TTLCache(maxsize=128, ttl=ttl)
-
 
 class PricesCallback(object):
 
-    def __init__(self):
+    SINK = 'influxdb'
+
+    # Prices are only computed again when indexes changed.
+    LABELS = ('HCHC', 'HCHP')
 
-        self.prices_extractors = get_price_extractors()
+    # Packet being computed is kept on instance: a single worker computes packets.
+    THREAD_SAFE = False
 
-        influxdb_service_host = os.getenv('INFLUXDB_SERVICE_HOST', 'influxdb.local')
-        influxdb_service_port = int(os.getenv('INFLUXDB_SERVICE_PORT', 8086))
-        influxdb_database = os.getenv('INFLUXDB_DATABASE', 'linky')
-        influxdb_username = os.getenv('INFLUXDB_USERNAME', 'admin')
-        influxdb_password = os.getenv('INFLUXDB_PASSWORD', 'password')
+    # Month and prices change within an offer series: they are rolled up as fields, not tags.
+    ROLLUP = (
+        ('CURRENT_COST', 'last', 'CURRENT_COST'),
+        ('ESTIMATED_COST', 'last', 'ESTIMATED_COST'),
+        ('subscription_price', 'last', 'subscription_price'),
+        ('hp_kwh_price', 'last', 'hp_kwh_price'),
+        ('hc_kwh_price', 'last', 'hc_kwh_price'),
+        ('month_number', 'last', 'month_number'),
+        ('year_number', 'last', 'year_number'),
+        ('month_name', 'last', 'month_name'),
+    )
+    ROLLUP_TAGS = ('meter', 'provider', 'offer_name', 'offer_type', 'power')
 
-        logger.info("Connecting to InfluxDB %s:%s ..." % (influxdb_service_host, influxdb_service_port))
-        self.influx_client = InfluxDBClient(influxdb_service_host, influxdb_service_port,
-                                            influxdb_username, influxdb_password,
-                                            influxdb_database, retries=0, gzip=True)
-        self.influx_client.create_database(influxdb_database)
-        logger.info("Successfully connected to InfluxDB: " + self.influx_client.ping())
+    def __init__(self):
 
-        # Retention policy
-        self.influx_client.create_retention_policy('linky_rp', '1w', 1, database=influxdb_database, default=False)
+        self.prices_extractors = []
+        self.prices_registry = get_price_registry()
 
-        # Continuous query
-        self.influx_client.drop_continuous_query('prices_mean_cq', influxdb_database)
-        select_clause = 'SELECT last("CURRENT_COST") as CURRENT_COST, last("ESTIMATED_COST") AS ESTIMATED_COST INTO prices_mean FROM linky_rp.prices GROUP BY time(1h), provider, offer_name, offer_type, month_name, month_number, year_number'
-        self.influx_client.create_continuous_query('prices_mean_cq', select_clause, influxdb_database, 'EVERY 1m FOR 1h')
+        self.sink = get_sink(self.SINK)
 
         self.power = int(os.getenv('CURRENT_POWER', 9))
 
-    def compute(self, data, timestamp):
-        """
-        Stores data into InfluxDB.
-        """
-        if 'HCHP' not in data.keys() or 'HCHC' not in data.keys():
-            logger.info("Incomplete Linky packet. Passing...")
-            return
+        # Prices of every offer, compiled again when prices tables change.
+        self.prices_version = None
+        self.prices = None
 
-        self.data = data
-        self.timestamp = timestamp
+        # First indexes of month are tracked from packets of each meter, InfluxDB is only queried on cold start.
+        self.window = MonthWindow(os.getenv("TZ", "Europe/Paris"))
+        self.state_dir = CONF.linkypy.get('state_dir', '/var/lib/linkypy')
+        self.month_starts = {}
 
-        # Make the Pool of workers
-        pool = ThreadPool()
-        _ = pool.map(self.calculate_prices, self.prices_extractors)
-        pool.close()
-        pool.join()
-
-    def calculate_prices(self, price_extractor):
-
-        for offer_name in price_extractor.get_available_offers_names():
-            for offer_type in price_extractor.get_available_offers_types():
-                try:
-                    prices = price_extractor.get_prices(offer_name, offer_type, self.power)
-                    costs = {}
-                    if offer_type == "BASE":
-                        costs = self.get_base_prices(int(self.data['HCHP']) + int(self.data['HCHC']), prices['HP_KWH_PRICE'],
-                                                     prices['MONTHLY_SUBSCRIPTION_PRICE'])
-                    elif offer_type == "HPHC":
-                        costs = self.get_hphc_prices(int(self.data['HCHP']), int(self.data['HCHC']), prices['HP_KWH_PRICE'],
-                                                     prices['HC_KWH_PRICE'], prices['MONTHLY_SUBSCRIPTION_PRICE'])
-
-                    logger.info("%24s [%14s / %s]: %s" % (price_extractor.provider_name, offer_name, offer_type.lower(), costs))
-
-                    # JSON body to send to influxdb.
-                    # Add month tag for InfluxDB 'GROUP BY'
-                    json_body = [{
-                        "measurement": "prices",
-                        "tags": {
-                            "provider": price_extractor.provider_name,
-                            "offer_name": offer_name,
-                            "offer_type": offer_type,
-                            "power": self.power,
-                            "subscription_price": prices['MONTHLY_SUBSCRIPTION_PRICE'],
-                            "hp_kwh_price": prices['HP_KWH_PRICE'],
-                            "hc_kwh_price": prices['HC_KWH_PRICE'],
-                            "month_number": datetime.datetime.now().month,
-                            "year_number": datetime.datetime.now().year,
-                            "month_name": datetime.datetime.now().strftime("%B").title()
-                        },
-                        "time": self.timestamp,
-                        "fields": costs
-                    }]
-
-                    self.influx_client.write_points(json_body, time_precision='s', retention_policy='linky_rp')
-
-                except Exception as e:
-                    logger.error(e)
-                    continue
-
-    def get_hphc_prices(self, last_hp, last_hc, hp_price, hc_price, subscription_price):
-
-        try:
-            # Get first day of month
-            first_of_month = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            tz = pytz.timezone(os.getenv("TZ", "Europe/Paris"))
-            first_of_month = first_of_month.replace(tzinfo=tz)
-
-            first_hp, first_hc = self.get_first_hphc(first_of_month.astimezone(pytz.utc).isoformat())
-
-            consumed_kwh_hp = (last_hp - first_hp) / 1000.
-            consumed_kwh_hc = (last_hc - first_hc) / 1000.
-
-            # Get consumed price
-            price_today = (consumed_kwh_hp * hp_price) + (consumed_kwh_hc * hc_price)
-
-            # Get beginning of next month
-            first_of_next_of_month = first_of_month + relativedelta(months=1)
-
-            now = datetime.datetime.now()
-            tz = pytz.timezone(os.getenv("TZ", "Europe/Paris"))
-            now = now.replace(tzinfo=tz)
-
-            # Get elapsed seconds since beginning of month
-            elapsed_seconds = (now - first_of_month).total_seconds()
-
-            # Get remaining seconds to beginning of next month
-            remaining_seconds = (first_of_next_of_month - now).total_seconds()
-
-            # Get remaining price from average price per second
-            price_remaining = remaining_seconds * (price_today / elapsed_seconds)
-
-            # Add everything, price since beginning of month + estimate + monthly subscription
-            estimate_monthly = price_today + price_remaining + subscription_price
-
-            return {
-                'CURRENT_COST': round(price_today + subscription_price, 2),
-                'ESTIMATED_COST': round(estimate_monthly, 2),
-            }
+        self.rollup = Rollup('prices_mean', self.ROLLUP, tags=self.ROLLUP_TAGS, timezone=self.window.tz.zone, path=os.path.join(self.state_dir, 'rollup-prices_mean.json'))
 
-        except Exception:
-            logger.error("An error occured while estimating price.", exc_info=True)
-            return None
+    def warm_up(self):
+        """
+        Loads price extractors, connects to InfluxDB and creates database schema, in the background.
+        """
+        if not self.prices_extractors:
+            self.prices_extractors = get_price_extractors()
 
-    def get_base_prices(self, last_hp, hp_price, subscription_price):
+        self.sink.warm_up()
 
-        try:
-            # Get first day of month
-            first_of_month = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            tz = pytz.timezone(os.getenv("TZ", "Europe/Paris"))
-            first_of_month = first_of_month.replace(tzinfo=tz)
+        # Hourly prices are rolled up by LinkyPy itself, continuous query of previous versions would overwrite them.
+        self.sink.schema.drop_continuous_query('prices_mean_cq')
 
-            first_hp, first_hc = self.get_first_hphc(first_of_month.astimezone(pytz.utc).isoformat())
-            first_kwh = first_hp + first_hc
-            consumed_kwh = (last_hp - first_kwh) / 1000.
+    def close(self):
+        """
+        Writes buckets in progress, called once packets are all computed.
+        """
+        points = self.rollup.flush()
+        if points:
+            self.sink.write(points)
+
+    def get_month_start(self, meter):
+        if meter not in self.month_starts:
+            filename = 'month-start-%s.json' % meter if meter else 'month-start.json'
+            fallback = functools.partial(self.get_first_hphc, meter=meter)
+            # State file of versions without meters is only meaningful with a single meter.
+            legacy_path = None
+            if meter and not self.month_starts and len(CONF.linkypy.get('meters') or []) <= 1:
+                legacy_path = os.path.join(self.state_dir, 'month-start.json')
+            self.month_starts[meter] = MonthStartIndex(os.path.join(self.state_dir, filename), fallback=fallback, legacy_path=legacy_path)
+        return self.month_starts[meter]
+
+    def compute(self, data, timestamp, meter=None):
+        """
+        Stores data into InfluxDB, tagged with meter identifier.
+        """
+        if 'HCHP' not in data or 'HCHC' not in data:
+            logger.info("Incomplete Linky packet. Passing...")
+            return
 
-            # Get consumed price
-            price_today = (consumed_kwh * hp_price)
+        # Indexes are decoded once per frame by the reader.
+        self.hchp = data['HCHP']
+        self.hchc = data['HCHC']
+        self.timestamp = timestamp
+        self.meter = meter
 
-            # Get beginning of next month
-            first_of_next_of_month = first_of_month + relativedelta(months=1)
+        self.now = local_time(timestamp, self.window.tz)
+        self.window.update(self.now)
+        self.first_hp, self.first_hc = self.get_month_start(meter).get(self.window, self.hchp, self.hchc)
 
-            now = datetime.datetime.now()
-            tz = pytz.timezone(os.getenv("TZ", "Europe/Paris"))
-            now = now.replace(tzinfo=tz)
+        if self.prices is None or self.prices_version != self.prices_registry.version:
+            self.prices_version = self.prices_registry.version
+            self.prices = PriceMatrix.build(self.prices_extractors, self.power)
 
-            # Get elapsed seconds since beginning of month
-            elapsed_seconds = (now - first_of_month).total_seconds()
+        # Write every offer prices at once, and closed rollups of each offer.
+        points = self.calculate_prices()
+        self.sink.write(points, retention_policy='linky_rp')
 
-            # Get remaining seconds to beginning of next month
-            remaining_seconds = (first_of_next_of_month - now).total_seconds()
+        seconds = packet_seconds(timestamp)
+        rollups = []
+        for point in points:
+            rollups.extend(self.rollup.add(seconds, dict(point['tags'], **point['fields']), point['tags']))
+        if rollups:
+            self.sink.write(rollups)
 
-            # Get remaining price from average price per second
-            price_remaining = remaining_seconds * (price_today / elapsed_seconds)
+    def calculate_prices(self):
+        """
+        Compute current and estimated costs of every offer.
+        """
+        consumed_kwh_hp = (self.hchp - self.first_hp) / 1000.
+        consumed_kwh_hc = (self.hchc - self.first_hc) / 1000.
+        elapsed_seconds = self.window.elapsed_seconds(self.now)
+        remaining_seconds = self.window.remaining_seconds(self.now)
+
+        current, estimated = self.prices.costs(consumed_kwh_hp, consumed_kwh_hc, elapsed_seconds, remaining_seconds)
+
+        month_number = self.now.month
+        year_number = self.now.year
+        month_name = self.now.strftime("%B").title()
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        points = []
+        for offer, current_cost, estimated_cost in zip(self.prices.offers, current.tolist(), estimated.tolist()):
+            costs = {
+                'CURRENT_COST': current_cost,
+                'ESTIMATED_COST': estimated_cost,
+            }
 
-            # Add everything, price since beginning of month + estimate + monthly subscription
-            estimate_monthly = price_today + price_remaining + subscription_price
+            if debug:
+                logger.debug("%24s [%14s / %s]: %s" % (offer['provider'], offer['offer_name'], offer['offer_type'].lower(), costs))
 
-            return {
-                'CURRENT_COST': round(price_today + subscription_price, 2),
-                'ESTIMATED_COST': round(estimate_monthly, 2),
-            }
+            # JSON body to send to influxdb.
+            # Add month tag for InfluxDB 'GROUP BY'
+            tags = dict(offer, month_number=month_number, year_number=year_number, month_name=month_name)
+            if self.meter:
+                tags['meter'] = self.meter
+            points.append({
+                "measurement": "prices",
+                "tags": tags,
+                "time": self.timestamp,
+                "fields": costs
+            })
 
-        except Exception:
-            logger.error("An error occured while estimating price.", exc_info=True)
-            return None
+        logger.info("Computed prices of %d offers" % len(points))
+        return points
 
-    @cached(cache)
-    def get_first_hphc(self, first_of_month):
+    def get_first_hphc(self, first_of_month, meter=None):
 
         # Get HP/HC consumption from beginning of month to now.
         query = "SELECT first(HCHP) AS first_hp, first(HCHC) AS first_hc \
                      FROM linky_mean WHERE time >= '%s'" % first_of_month
-        results = next(self.influx_client.query(query).get_points())
+        results = None
+        if meter:
+            results = next(self.sink.query(query + " AND meter = '%s'" % meter).get_points(), None)
+        if results is None:
+            # Points written before meters were tagged have no meter tag.
+            results = next(self.sink.query(query).get_points(), None)
+        if results is None:
+            logger.warning("No HP/HC found in InfluxDB since %s" % first_of_month)
+            return None, None
 
         logger.info("Getting first HP/HC of the month: %s / %s" % (results['first_hp'], results['first_hc']))
         return results['first_hp'], results['first_hc']
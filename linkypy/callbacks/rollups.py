@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from linkypy.reader.changes import timestamp_seconds
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions (seconds) and their measurement suffix.
+RESOLUTIONS = ((60, '_1m'), (3600, ''), (86400, '_1d'))
+
+FUNCTIONS = ('mean', 'max', 'min', 'first', 'last')
+
+
+def packet_seconds(timestamp):
+    """
+    Seconds since epoch of a packet, current time when its timestamp is unknown.
+    """
+    return timestamp_seconds(timestamp) if isinstance(timestamp, str) else time.time()
+
+
+class LocalDays(object):
+    """
+    Boundaries (seconds since epoch) of the current local day, only computed again when day changes.
+    """
+
+    def __init__(self, timezone):
+        import pytz
+
+        self.tz = pytz.timezone(timezone)
+        self.start = None
+        self.end = None
+
+    def day_start(self, seconds):
+        if self.start is None or not self.start <= seconds < self.end:
+            local = datetime.datetime.fromtimestamp(seconds, self.tz)
+            midnight = datetime.datetime(local.year, local.month, local.day)
+            self.start = int(self.tz.localize(midnight).timestamp())
+            self.end = int(self.tz.localize(midnight + datetime.timedelta(days=1)).timestamp())
+        return self.start
+
+
+class Bucket(object):
+
+    __slots__ = ('start', 'values', 'counts', 'tags')
+
+    def __init__(self, start, size, tags=None):
+        self.start = start
+        self.values = [None] * size
+        self.counts = [0] * size
+        self.tags = tags
+
+    def add(self, aggregations, fields):
+        values = self.values
+        for index, (_, function, source) in enumerate(aggregations):
+            value = fields.get(source)
+            if value is None:
+                continue
+            current = values[index]
+            if current is None:
+                values[index] = value
+            elif function == 'mean':
+                values[index] = current + value
+            elif function == 'max':
+                if value > current:
+                    values[index] = value
+            elif function == 'min':
+                if value < current:
+                    values[index] = value
+            elif function == 'last':
+                values[index] = value
+            self.counts[index] += 1
+
+    def fields(self, aggregations):
+        fields = {}
+        for (field, function, _), value, count in zip(aggregations, self.values, self.counts):
+            if count:
+                fields[field] = float(value) / count if function == 'mean' else value
+        return fields
+
+
+class Rollup(object):
+    """
+    Aggregates of packets fields in 1 minute, 1 hour and 1 day buckets, by series.
+
+    ``aggregations`` are ``(field, function, source field)`` tuples, functions are mean, max, min,
+    first and last. Series are identified by ``tags`` (names), or by every tag when None: other tags
+    are not written, values that change within a series (month, prices...) must be rolled up as
+    fields. Days start at midnight in ``timezone`` (UTC when None).
+
+    Buckets are updated in place for each packet and kept in memory: buckets are closed, and returned
+    as points of ``<measurement>_1m``, ``<measurement>`` (hourly) or ``<measurement>_1d``, when a packet
+    falls in a later bucket, or on :meth:`flush`. Open buckets are then saved to ``path`` (when given),
+    and resumed if they are still current when LinkyPy starts again.
+    """
+
+    def __init__(self, measurement, aggregations, resolutions=RESOLUTIONS, tags=None, timezone=None, path=None):
+
+        for _, function, _ in aggregations:
+            if function not in FUNCTIONS:
+                raise ValueError("Unknown rollup function '%s' (expected one of %s)" % (function, ', '.join(FUNCTIONS)))
+
+        self.aggregations = tuple(aggregations)
+        self.resolutions = tuple((resolution, measurement + suffix) for resolution, suffix in resolutions)
+        self.tags = None if tags is None else tuple(tags)
+        self.days = LocalDays(timezone) if timezone else None
+        self.path = path
+        self.buckets = {}
+        # Start of latest bucket of each measurement.
+        self.current = {}
+        self.lock = threading.Lock()
+
+        if path:
+            self.load()
+
+    def key(self, tags):
+        if self.tags is None:
+            return tuple(sorted(tags.items()))
+        return tuple((name, tags[name]) for name in self.tags if name in tags)
+
+    def bucket_start(self, resolution, seconds):
+        if resolution == 86400 and self.days is not None:
+            return self.days.day_start(seconds)
+        return int(seconds // resolution * resolution)
+
+    def add(self, seconds, fields, tags):
+        """
+        Add fields of a packet received at ``seconds`` (since epoch), return points of closed buckets.
+        """
+        key = self.key(tags)
+        points = []
+        with self.lock:
+            for resolution, measurement in self.resolutions:
+                start = self.bucket_start(resolution, seconds)
+                current = self.current.get(measurement)
+                if current is None or start > current:
+                    # Every earlier bucket is closed, even of series without packets since (previous offers, meters...).
+                    self.current[measurement] = start
+                    for bucket_key, bucket in list(self.buckets.items()):
+                        if bucket_key[0] == measurement and bucket.start < start:
+                            self.close(points, measurement, self.buckets.pop(bucket_key))
+                elif start < current:
+                    # Late packet, its bucket was already closed.
+                    continue
+
+                bucket = self.buckets.get((measurement, key))
+                if bucket is None:
+                    bucket = self.buckets[(measurement, key)] = Bucket(start, len(self.aggregations), dict(key))
+                bucket.add(self.aggregations, fields)
+        return points
+
+    def close(self, points, measurement, bucket):
+        fields = bucket.fields(self.aggregations)
+        if fields:
+            points.append({
+                "measurement": measurement,
+                "tags": dict(bucket.tags or {}),
+                "time": datetime.datetime.utcfromtimestamp(bucket.start).isoformat(),
+                "fields": fields,
+            })
+
+    def flush(self):
+        """
+        Close every open bucket and return their points, open buckets are saved to ``path`` first.
+        """
+        with self.lock:
+            buckets, self.buckets = self.buckets, {}
+            self.current = {}
+
+        if self.path:
+            self.save(buckets)
+
+        points = []
+        for (measurement, _), bucket in buckets.items():
+            self.close(points, measurement, bucket)
+        return points
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        measurements = set(measurement for _, measurement in self.resolutions)
+        for measurement, key, start, values, counts, tags in state.get('buckets', []):
+            # Aggregations may have changed since buckets were saved.
+            if measurement not in measurements or len(values) != len(self.aggregations):
+                continue
+            bucket = Bucket(start, len(self.aggregations), tags)
+            bucket.values, bucket.counts = values, counts
+            self.buckets[(measurement, tuple(tuple(item) for item in key))] = bucket
+        logger.info("Resumed %d rollup buckets from %s" % (len(self.buckets), self.path))
+
+    def save(self, buckets):
+        state = {
+            'buckets': [[measurement, key, bucket.start, bucket.values, bucket.counts, bucket.tags] for (measurement, key), bucket in buckets.items()],
+            'updated': datetime.datetime.utcnow().isoformat(),
+        }
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError, TypeError, ValueError):
+            logger.error("Cannot save rollup buckets to %s" % self.path, exc_info=True)
@@ -1,60 +1,168 @@
 import logging
 import os
+
 import click
-import serial
 from linkypy import CONF
-from linkypy.reader.packet_reader import LinkyPyPacketReader
-from linkypy.prices_extractors import get_price_extractors
 
+logger = logging.getLogger(__name__)
 
-logging.basicConfig(level=getattr(logging, CONF.linkypy.loglevel),
-                    format='%(asctime)s %(levelname)8s %(filename)24s %(message)s')
-logging.propagate = False
-logging.getLogger().setLevel(logging.WARN)
 
-logging.getLogger("urllib3").setLevel(logging.WARN)
-logging.getLogger("pdfminer").setLevel(logging.WARN)
-logging.getLogger("camelot").setLevel(logging.WARN)
-logging.getLogger("pdfplumber").setLevel(logging.WARN)
-logging.getLogger("ghostscript").setLevel(logging.WARN)
-logging.getLogger("linkypy").setLevel(getattr(logging, CONF.linkypy.loglevel))
+def setup_logging():
 
-logger = logging.getLogger(__name__)
+    logging.basicConfig(level=getattr(logging, CONF.linkypy.loglevel),
+                        format='%(asctime)s %(levelname)8s %(filename)24s %(message)s')
+    logging.propagate = False
+    logging.getLogger().setLevel(logging.WARN)
+
+    logging.getLogger("urllib3").setLevel(logging.WARN)
+    logging.getLogger("pdfminer").setLevel(logging.WARN)
+    logging.getLogger("camelot").setLevel(logging.WARN)
+    logging.getLogger("pdfplumber").setLevel(logging.WARN)
+    logging.getLogger("ghostscript").setLevel(logging.WARN)
+    logging.getLogger("linkypy").setLevel(getattr(logging, CONF.linkypy.loglevel))
 
 
 @click.group()
 def linkypy():
     """LinkyPy command line utility."""
+    # Configuration is loaded here, not at import, so that '--help' stays fast.
+    setup_logging()
     logger.info("Using configuration file: %s" % CONF.config_file)
 
 
 @linkypy.command()
-def run():
+@click.option('--port', 'ports', multiple=True,
+              help="Serial port or serial_for_url URL of a meter, repeat to read several meters (default: 'meters' configuration or LINKY_PORT).")
+@click.option('--engine', type=click.Choice(['threaded', 'asyncio']), default=None,
+              help="Reader engine: a reader thread with callback worker threads, or a single asyncio event loop (default when reading several meters).")
+@click.option('--metrics-port', type=int, default=None, help="Serve Prometheus metrics on this local port (default: 'metrics' configuration).")
+@click.option('--query-port', type=int, default=None,
+              help="Serve latest values and recent history of meters as JSON on this local port (default: 'query' configuration).")
+@click.option('--trace', is_flag=True, default=None, help="Trace frames, SIGUSR1 dumps slowest recent ones (default: 'tracing' configuration).")
+@click.option('--profile', 'profile_directory', type=click.Path(file_okay=False), default=None,
+              help="Profile CPU and memory of reader loop, writing .prof and .snapshot files to this directory (default: 'profiling' configuration).")
+@click.option('--profile-frames', type=int, default=None, help="Close profiling window after this number of frames.")
+@click.option('--profile-seconds', type=float, default=None, help="Close profiling window after this number of seconds.")
+@click.option('--profile-rotate', is_flag=True, default=None, help="Open a new profiling window each time one is closed.")
+def run(ports, engine, metrics_port, query_port, trace, profile_directory, profile_frames, profile_seconds, profile_rotate):
     """Launch LinkyPy reader loop."""
-
-    # Get USB connection details through environment variables.
-    linky_port = os.getenv('LINKY_PORT', '/dev/ttyUSB0')
+    from linkypy.profiling import PROFILER
+    from linkypy.tracing import TRACER
+
+    tracing_options = dict(CONF.linkypy.get('tracing') or {})
+    if trace:
+        tracing_options['enabled'] = True
+    TRACER.configure(**tracing_options)
+    TRACER.install()
+
+    profiling_options = dict(CONF.linkypy.get('profiling') or {})
+    for key, value in (('directory', profile_directory), ('frames', profile_frames), ('seconds', profile_seconds), ('rotate', profile_rotate)):
+        if value is not None:
+            profiling_options[key] = value
+    if profiling_options.get('directory'):
+        PROFILER.configure(**profiling_options)
+        PROFILER.start()
+
+    metrics_options = CONF.linkypy.get('metrics') or {}
+    metrics_port = metrics_port or metrics_options.get('port')
+    if metrics_port:
+        from linkypy import metrics
+
+        metrics.serve(metrics_port, metrics_options.get('host', '127.0.0.1'))
+
+    query_options = CONF.linkypy.get('query') or {}
+    query_port = query_port or query_options.get('port')
+    if query_port:
+        from linkypy import history
+
+        history.HISTORY.configure(enabled=True, capacity=query_options.get('capacity', 86400))
+        history.serve(query_port, query_options.get('host', '127.0.0.1'))
+
+    # Get USB connection details through options, configuration file or environment variables.
+    linky_ports = list(ports) or list(CONF.linkypy.get('meters') or []) or [os.getenv('LINKY_PORT', '/dev/ttyUSB0')]
     linky_baudrate = int(os.getenv('LINKY_BAUDRATE', 1200))
 
+    if engine is None:
+        engine = 'asyncio' if len(linky_ports) > 1 else 'threaded'
+
+    if engine == 'asyncio':
+        from linkypy.reader.async_engine import AsyncEngine
+
+        try:
+            AsyncEngine(linky_ports, linky_baudrate).run()
+        finally:
+            PROFILER.stop()
+        return
+
+    if len(linky_ports) > 1:
+        raise click.UsageError("Several meters can only be read with '--engine asyncio'.")
+    linky_port = linky_ports[0]
+
+    from linkypy.reader.packet_reader import open_serial, run_threaded
+
     logger.info("Connecting to Linky through USB dongle on %s (baudrate=%dbps)" % (linky_port, linky_baudrate))
 
     # Connect to serial port.
-    linky_serial_port = serial.serial_for_url(linky_port, linky_baudrate,
-                                              parity=serial.PARITY_EVEN,
-                                              stopbits=serial.STOPBITS_ONE,
-                                              bytesize=serial.SEVENBITS)
+    linky_serial_port = open_serial(linky_port, linky_baudrate)
 
     logger.info("Connected to Linky: %s" % linky_serial_port.get_settings())
 
-    # Launch the reader thread
-    reader_thread = serial.threaded.ReaderThread(linky_serial_port, LinkyPyPacketReader)
-    reader_thread.run()
+    # Launch the reader thread, until port fails or LinkyPy is stopped.
+    try:
+        run_threaded(linky_serial_port)
+    finally:
+        PROFILER.stop()
+
+
+@linkypy.command()
+@click.argument('capture', type=click.Path(exists=True, dir_okay=False))
+@click.option('--realtime', is_flag=True, help="Replay frames at their original pace instead of as fast as possible.")
+@click.option('--speed', type=float, default=1.0, show_default=True, help="Pace multiplier of '--realtime' replay.")
+@click.option('--state-dir', type=click.Path(file_okay=False), default=None,
+              help="Directory of callbacks state (month start indexes, rollups in progress), a temporary one by default.")
+def replay(capture, realtime, speed, state_dir):
+    """Replay a raw TIC capture (optionally gzip, bz2 or xz compressed) through callbacks."""
+    from linkypy.reader.replay import Replay
+
+    Replay(capture, realtime=realtime, speed=speed, baudrate=int(os.getenv('LINKY_BAUDRATE', 1200)), state_dir=state_dir).run()
+
+
+@linkypy.command()
+@click.option('--frames', type=int, default=2000, show_default=True, help="Number of frames of each benchmark.")
+@click.option('--mode', 'modes', type=click.Choice(['historic', 'standard']), multiple=True, help="TIC mode, repeat for both (default: both).")
+@click.option('--baseline', type=click.Path(dir_okay=False), default=None,
+              help="Baseline results to compare with (default: baseline shipped with LinkyPy). Use '-' to skip comparison.")
+@click.option('--tolerance', type=float, default=0.25, show_default=True, help="Allowed regression ratio against baseline.")
+@click.option('--save', type=click.Path(dir_okay=False), default=None, help="Save results as JSON, for instance as a new baseline.")
+def benchmark(frames, modes, baseline, tolerance, save):
+    """Run benchmarks with synthetic frames, and fail on regressions."""
+    import sys
+    from linkypy.benchmarks import runner
+
+    # Logging every packet would be benchmarked too.
+    logging.getLogger("linkypy").setLevel(logging.WARN)
+
+    results = runner.run_benchmarks(frames, modes or ('historic', 'standard'))
+    click.echo(runner.format_results(results))
+    if save:
+        runner.save_results(results, save)
+
+    if baseline != '-':
+        baseline = baseline or runner.BASELINE
+        regressions = runner.compare(results, runner.load_results(baseline), tolerance)
+        for regression in regressions:
+            click.echo("REGRESSION %s" % regression, err=True)
+        if regressions:
+            sys.exit(1)
+        click.echo("No regression against %s" % baseline)
 
 
 @linkypy.command()
 def prices():
     """Get prices from extractors."""
-    prices_extractors = get_price_extractors()
+    from linkypy.prices_extractors import get_price_extractors
+
+    prices_extractors = get_price_extractors(wait=True)
 
     for prices_extractor in prices_extractors:
         for offer_name in prices_extractor.get_available_offers_names():
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import math
+import os
+import threading
+import time
+
+# Columns kept for each frame, besides its time.
+COLUMNS = ('PAPP', 'HCHC', 'HCHP', 'IINST')
+# Indexes give consumption over windows, other columns are averaged.
+INDEXES = ('HCHC', 'HCHP')
+
+
+def json_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else round(value, 3)
+
+
+def iso_time(seconds):
+    return datetime.datetime.utcfromtimestamp(seconds).isoformat()
+
+
+def json_response(status, body):
+    return status, 'application/json', json.dumps(body)
+
+
+class RingBuffer(object):
+    """
+    Fixed-size columnar buffer of the recent frames of a meter, oldest frames are overwritten first.
+
+    Missing values are NaN. Frames are expected in chronological order, windows are then found by binary search.
+    """
+
+    def __init__(self, capacity, columns=COLUMNS):
+        import numpy as np
+
+        self.capacity = int(capacity)
+        self.columns = tuple(columns)
+        self.times = np.zeros(self.capacity)
+        self.values = np.full((len(self.columns), self.capacity), np.nan)
+        self.next = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def append(self, seconds, fields):
+        values = [fields.get(column) for column in self.columns]
+        with self.lock:
+            index = self.next
+            self.times[index] = seconds
+            self.values[:, index] = [value if isinstance(value, (int, float)) else math.nan for value in values]
+            self.next = (index + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+    def segments(self):
+        """
+        Slices of buffer in chronological order.
+        """
+        if self.size < self.capacity:
+            return [slice(0, self.size)]
+        return [slice(self.next, self.capacity), slice(0, self.next)]
+
+    def latest(self):
+        with self.lock:
+            if not self.size:
+                return None
+            index = (self.next - 1) % self.capacity
+            return self.times[index], self.values[:, index].copy()
+
+    def window(self, since):
+        """
+        Times and values (copies) of frames received at or after ``since`` (seconds since epoch).
+        """
+        import numpy as np
+
+        with self.lock:
+            times, values = [], []
+            for segment in self.segments():
+                segment_times = self.times[segment]
+                start = int(np.searchsorted(segment_times, since, side='left'))
+                times.append(segment_times[start:])
+                values.append(self.values[:, segment][:, start:])
+            return np.concatenate(times), np.concatenate(values, axis=1)
+
+
+class FrameHistory(object):
+    """
+    Recent frames of every meter, in :class:`RingBuffer`, answering local queries without InfluxDB.
+
+    Disabled by default: reader then only checks ``enabled`` flag.
+    """
+
+    def __init__(self):
+
+        self.enabled = False
+        self.capacity = 86400
+        self.buffers = {}
+        self.lock = threading.Lock()
+        self.tz = None
+
+    def configure(self, enabled=False, capacity=86400):
+        self.enabled = bool(enabled)
+        self.capacity = int(capacity)
+
+    def labels(self):
+        """
+        Labels reader must decode for history.
+        """
+        return frozenset(COLUMNS) if self.enabled else frozenset()
+
+    def buffer(self, meter):
+        buffer = self.buffers.get(meter)
+        if buffer is None:
+            with self.lock:
+                buffer = self.buffers.get(meter)
+                if buffer is None:
+                    buffer = self.buffers[meter] = RingBuffer(self.capacity)
+        return buffer
+
+    def append(self, meter, seconds, fields):
+        self.buffer(meter).append(seconds, fields)
+
+    def find(self, query):
+        """
+        Buffer of the meter given in query, the only one when query does not give any.
+        """
+        meters = query.get('meter')
+        if meters:
+            return meters[0], self.buffers.get(meters[0])
+        buffers = list(self.buffers.items())
+        if len(buffers) == 1:
+            return buffers[0]
+        return None, None
+
+    def since(self, query):
+        """
+        Start of queried window: ``since`` (ISO time, naive ones are UTC, or 'today' in local time), or last ``minutes`` (60 by default).
+        """
+        from linkypy.reader.changes import timestamp_seconds
+
+        since = query.get('since', [None])[0]
+        if since == 'today':
+            if self.tz is None:
+                import pytz
+                self.tz = pytz.timezone(os.getenv("TZ", "Europe/Paris"))
+            now = datetime.datetime.now(self.tz)
+            return self.tz.localize(datetime.datetime(now.year, now.month, now.day)).timestamp()
+        if since:
+            return timestamp_seconds(since)
+        return time.time() - 60. * float(query.get('minutes', [60])[0])
+
+    def respond(self, query, func):
+        meter, buffer = self.find(query)
+        if buffer is None:
+            return json_response(404, {'error': "Unknown meter, try one of: %s" % ", ".join(sorted(str(meter) for meter in self.buffers))})
+        try:
+            since = self.since(query)
+        except ValueError as e:
+            return json_response(400, {'error': str(e)})
+        body = func(buffer, since)
+        body['meter'] = meter
+        return json_response(200, body)
+
+    def latest(self, query):
+        meter, buffer = self.find(query)
+        latest = buffer.latest() if buffer is not None else None
+        if latest is None:
+            return json_response(404, {'error': "No frame received yet for meter %s" % meter})
+        seconds, values = latest
+        body = dict((column, json_value(value)) for column, value in zip(buffer.columns, values))
+        body.update(meter=meter, time=iso_time(seconds))
+        return json_response(200, body)
+
+    def history(self, query):
+
+        def history(buffer, since):
+            times, values = buffer.window(since)
+            body = dict((column, [json_value(value) for value in column_values]) for column, column_values in zip(buffer.columns, values))
+            body['time'] = [iso_time(seconds) for seconds in times]
+            return body
+
+        return self.respond(query, history)
+
+    def aggregate(self, query):
+
+        def aggregate(buffer, since):
+            import numpy as np
+
+            times, values = buffer.window(since)
+            body = {'count': len(times), 'since': iso_time(since)}
+            if not len(times):
+                return body
+            body['from'], body['to'] = iso_time(times[0]), iso_time(times[-1])
+            for column, column_values in zip(buffer.columns, values):
+                known = column_values[~np.isnan(column_values)]
+                if not len(known):
+                    body[column] = None
+                elif column in INDEXES:
+                    # Consumption (Wh) over window.
+                    body[column] = {'first': json_value(known[0]), 'last': json_value(known[-1]), 'delta': json_value(known[-1] - known[0])}
+                else:
+                    body[column] = {'mean': json_value(known.mean()), 'min': json_value(known.min()), 'max': json_value(known.max())}
+            return body
+
+        return self.respond(query, aggregate)
+
+    def routes(self):
+        return {'/latest': self.latest, '/history': self.history, '/aggregate': self.aggregate}
+
+
+HISTORY = FrameHistory()
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Serve history on ``http://<host>:<port>/latest``, ``/history`` and ``/aggregate``, from a background thread.
+    """
+    from linkypy.http_server import serve as serve_http
+
+    return serve_http(port, HISTORY.routes(), host)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class RoutesHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET requests with the route matching request path.
+
+    Routes are called with parsed query string (``{name: [values]}``), and return a
+    ``(status, content type, body)`` tuple.
+    """
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = self.server.routes.get(url.path)
+        if route is None:
+            status, content_type, body = 404, 'text/plain; charset=utf-8', "Not found, try one of: %s\n" % ", ".join(sorted(self.server.routes))
+        else:
+            try:
+                status, content_type, body = route(parse_qs(url.query))
+            except Exception as e:
+                logger.error("An error occured while serving %s" % self.path, exc_info=True)
+                status, content_type, body = 500, 'text/plain; charset=utf-8', "%s\n" % e
+
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port, routes, host='127.0.0.1'):
+    """
+    Serve given ``{path: route}`` routes from a background thread, return the HTTP server.
+    """
+    server = ThreadingHTTPServer((host, int(port)), RoutesHandler)
+    server.daemon_threads = True
+    server.routes = routes
+
+    thread = threading.Thread(target=server.serve_forever, name="HTTPServer-%s" % server.server_address[1], daemon=True)
+    thread.start()
+
+    logger.info("Serving %s on http://%s:%d" % (", ".join(sorted(routes)), host, server.server_address[1]))
+    return server
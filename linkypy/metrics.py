@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import bisect
+import math
+import threading
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+
+class Metric(object):
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError("Metric '%s' expects labels %s, got %r" % (self.name, self.labelnames, labelvalues))
+        return tuple(str(value) for value in labelvalues)
+
+    def samples(self):
+        """
+        Yield ``(suffix, labelvalues, extra label, value)`` samples.
+        """
+        with self.lock:
+            items = list(self.values.items())
+        for labelvalues, value in sorted(items):
+            yield '', labelvalues, None, value
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.TYPE)]
+        for suffix, labelvalues, extra, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, format_labels(self.labelnames, labelvalues, extra), format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    """
+    Monotonic counter.
+    """
+
+    TYPE = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        key = self.key(labelvalues)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, *labelvalues):
+        return self.values.get(self.key(labelvalues), 0)
+
+
+class Gauge(Metric):
+    """
+    Value that goes up and down, either set directly or collected by ``collect`` when scraped.
+
+    ``collect`` returns an iterable of ``(labelvalues, value)``.
+    """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def set(self, value, *labelvalues):
+        key = self.key(labelvalues)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super(Gauge, self).samples()
+        return (('', self.key(labelvalues), None, value) for labelvalues, value in sorted(self.collect()))
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, *labelvalues):
+        key = self.key(labelvalues)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0., 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items()]
+        for labelvalues, (counts, total, count) in sorted(items):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', labelvalues, ('le', format_value(bound)), cumulative
+            yield '_sum', labelvalues, None, total
+            yield '_count', labelvalues, None, count
+
+
+class MetricsRegistry(object):
+    """
+    Metrics of the process, exposed in Prometheus text format.
+
+    Updating a metric is a dictionary lookup and an addition under a lock, values already known
+    elsewhere (queue depths...) are collected by gauges only when metrics are scraped.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, klass, name, documentation, labelnames=(), **options):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = klass(name, documentation, labelnames, **options)
+            elif not isinstance(metric, klass):
+                raise ValueError("Metric '%s' is already registered as a %s" % (name, metric.TYPE))
+            return metric
+
+    def expose(self):
+        """
+        Metrics in Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=(), collect=None):
+    return REGISTRY.register(Gauge, name, documentation, labelnames, collect=collect)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Serve metrics on ``http://<host>:<port>/metrics``, from a background thread.
+    """
+    from linkypy.http_server import serve as serve_http
+
+    return serve_http(port, {'/metrics': lambda query: (200, 'text/plain; version=0.0.4; charset=utf-8', REGISTRY.expose())}, host)
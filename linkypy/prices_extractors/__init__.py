@@ -2,12 +2,17 @@ import importlib
 import logging
 
 from linkypy import CONF
+from linkypy.prices_extractors.registry import get_price_registry
 
 logger = logging.getLogger(__name__)
 
 
-def get_price_extractors():
+def get_price_extractors(wait=False):
+    """
+    Load declared price extractors and start refreshing their prices in the background.
 
+    When ``wait`` is set, prices that were never loaded are loaded before returning.
+    """
     pes = []
     for price_extractor in CONF.linkypy.price_extractors:
         logger.info("Loading price extractor '%s'..." % price_extractor)
@@ -18,4 +23,10 @@ def get_price_extractors():
         except Exception as e:
             logger.error("An error occured while loading price extractor '%s': %s" % (price_extractor, str(e)))
             continue
+
+    registry = get_price_registry()
+    if wait:
+        registry.refresh([entry for entry in list(registry.entries.values()) if entry.tables is None])
+    registry.start()
+
     return pes
@@ -1,10 +1,34 @@
 import logging
 import os
+import tempfile
+
+from linkypy import CONF
+from linkypy.prices_extractors.cache import get_prices_cache
+from linkypy.prices_extractors.fetch import fetch
+from linkypy.prices_extractors.isolation import parse_pdf_job, run_isolated
+from linkypy.prices_extractors.registry import get_price_registry
 
 logger = logging.getLogger(__name__)
 
 
 class BasePriceExtractor(object):
+    """
+    Base class of price extractors.
+
+    Subclasses declare their ``PDFS`` (offer name -> URL) and implement :meth:`parse_pdf`,
+    returning prices tables as ``{offer_type: {power: [subscription, hp_kwh_price, hc_kwh_price]}}``.
+    PDFs are parsed in a child process, see :func:`linkypy.prices_extractors.isolation.run_isolated`.
+    Tables are kept in the on-disk prices cache, a PDF is only downloaded again when modified on provider
+    side (ETag / Last-Modified), and only parsed again when its content changed.
+
+    Prices are always served from last known tables, which are refreshed in the background
+    (see :class:`linkypy.prices_extractors.registry.PriceRegistry`).
+    """
+
+    PDFS = {}
+    OFFER_TYPES = ('BASE', 'HPHC')
+
+    provider_name = None
 
     def __init__(self):
 
@@ -14,3 +38,75 @@ class BasePriceExtractor(object):
             'HP_KWH_PRICE': float(os.getenv('HP_KWH_PRICE', 0)),
             'HC_KWH_PRICE': float(os.getenv('HC_KWH_PRICE', 0))
         }
+
+        self.cache = get_prices_cache()
+        self.registry = get_price_registry()
+        for url in self.PDFS.values():
+            self.registry.register(self, url)
+
+    def get_available_offers_names(self):
+        return self.PDFS.keys()
+
+    def get_available_offers_types(self):
+        return self.OFFER_TYPES
+
+    def load_tables(self, url):
+        """
+        Download PDF at given URL if modified, parse it if its content changed, and return its cache entry.
+        """
+        entry = self.cache.get(url)
+
+        logger.info("Updating prices cache from %s" % url)
+        fd, tmp_output = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        try:
+            # Downloading PDF file, unless not modified since last download
+            result = fetch(url, tmp_output,
+                           etag=entry.get('etag') if entry else None,
+                           last_modified=entry.get('last_modified') if entry else None)
+            validators = {'etag': result.etag, 'last_modified': result.last_modified}
+
+            if entry is not None and (not result.modified or entry['digest'] == result.digest):
+                logger.info("Prices from %s did not change" % url)
+                self.cache.touch(url, **validators)
+            else:
+                self.cache.set(url, result.digest, self.parse(tmp_output), **validators)
+
+        finally:
+            os.remove(tmp_output)
+
+        return self.cache.get(url)
+
+    def parse(self, path):
+        """
+        Parse given PDF file in a child process, with configured timeout and memory limit.
+        """
+        options = CONF.linkypy.get('price_extraction', {})
+        class_path = "%s.%s" % (type(self).__module__, type(self).__name__)
+        return run_isolated(parse_pdf_job, (class_path, path),
+                            timeout=options.get('timeout', 300), memory_limit=options.get('memory_limit'))
+
+    def parse_pdf(self, path):
+        """
+        Extract prices tables from given PDF file.
+        """
+        raise NotImplementedError('please implement prices extraction in parse_pdf')
+
+    def get_prices(self, offer_name, offer_type, power):
+
+        tables = self.registry.get(self.PDFS[offer_name])
+        if tables is None:
+            logger.warning("Prices from %s were never loaded. Falling back to environment variable prices: %s" % (self.provider_name, self.fallback_prices))
+            return self.fallback_prices
+
+        try:
+            subscription, hp_kwh_price, hc_kwh_price = tables[offer_type][power]
+            return {
+                'MONTHLY_SUBSCRIPTION_PRICE': subscription,
+                'HP_KWH_PRICE': hp_kwh_price,
+                'HC_KWH_PRICE': hc_kwh_price,
+            }
+
+        except Exception:
+            logger.error("An error occured while syncing prices. Falling back to environment variable prices: %s" % self.fallback_prices, exc_info=True)
+            return self.fallback_prices
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+
+from linkypy import CONF
+
+logger = logging.getLogger(__name__)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prices_cache():
+    """
+    Get the prices cache shared by every price extractor.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            state_dir = CONF.linkypy.get('state_dir', '/var/lib/linkypy')
+            _cache = PricesCache(os.path.join(state_dir, 'prices-cache.json'))
+        return _cache
+
+
+class PricesCache(object):
+    """
+    On-disk cache of prices tables extracted from providers PDFs, keyed by PDF URL.
+
+    Each entry keeps the PDF SHA-256 digest, so a PDF is only parsed again when its content changed.
+    Tables are stored as ``{offer_type: {power: [subscription, hp_kwh_price, hc_kwh_price]}}``.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+            logger.info("Loaded %d prices tables from %s" % (len(self.entries), path))
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, url):
+        """
+        Return cache entry of given URL (``digest``, ``updated``, ``tables``...) or None.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            entry = dict(entry)
+
+        entry['tables'] = dict(
+            (offer_type, dict((int(power), prices) for power, prices in table.items()))
+            for offer_type, table in entry['tables'].items())
+        return entry
+
+    def set(self, url, digest, tables, **extra):
+        entry = dict(extra, digest=digest, updated=time.time(), tables=tables)
+        with self.lock:
+            self.entries[url] = entry
+            self.save()
+
+    def touch(self, url, **extra):
+        """
+        Mark entry of given URL as up to date.
+        """
+        with self.lock:
+            if url in self.entries:
+                self.entries[url].update(extra, updated=time.time())
+                self.save()
+
+    def save(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError):
+            logger.error("Cannot save prices cache to %s" % self.path, exc_info=True)
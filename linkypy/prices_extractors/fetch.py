@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import collections
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {"user-agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:81.0) Gecko/20100101 Firefox/81.0"}
+
+FetchResult = collections.namedtuple('FetchResult', ['modified', 'digest', 'etag', 'last_modified'])
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Get the HTTP session shared by every price extractor, keeping connections to providers alive.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            _session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def fetch(url, path, etag=None, last_modified=None, timeout=60, chunk_size=65536):
+    """
+    Download ``url`` into ``path`` unless it was not modified since given ``etag`` / ``last_modified``.
+
+    Body is streamed to disk and hashed on the fly. When server answers ``304 Not Modified``,
+    nothing is written and returned ``modified`` is False.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    with get_session().get(url, headers=headers, stream=True, timeout=timeout) as response:
+
+        if response.status_code == 304:
+            logger.info("%s was not modified" % url)
+            return FetchResult(False, None, response.headers.get('ETag', etag), response.headers.get('Last-Modified', last_modified))
+
+        response.raise_for_status()
+
+        digest = hashlib.sha256()
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size):
+                digest.update(chunk)
+                f.write(chunk)
+
+        return FetchResult(True, digest.hexdigest(), response.headers.get('ETag'), response.headers.get('Last-Modified'))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import importlib
+import logging
+import multiprocessing
+import traceback
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from linkypy.profiling import PROFILER, profile_call
+
+logger = logging.getLogger(__name__)
+
+
+class LinkyPyExtractionError(Exception):
+    pass
+
+
+class LinkyPyExtractionTimeout(LinkyPyExtractionError):
+    pass
+
+
+def get_context():
+    # Never fork the (multi-threaded) reader process itself.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def parse_pdf_job(class_path, path):
+    """
+    Parse PDF file with ``parse_pdf`` of given price extractor class, without building the extractor.
+    """
+    module_name, class_name = class_path.rsplit(".", 1)
+    klass = getattr(importlib.import_module(module_name), class_name)
+    return klass.parse_pdf(klass.__new__(klass), path)
+
+
+def _run(connection, func, args, memory_limit, profile=None):
+    try:
+        if memory_limit and resource is not None:
+            limit = int(memory_limit) * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        if profile is not None:
+            connection.send((True, profile_call(func, args, profile)))
+        else:
+            connection.send((True, func(*args)))
+    except BaseException:
+        connection.send((False, traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def run_isolated(func, args=(), timeout=300, memory_limit=None):
+    """
+    Run ``func(*args)`` in a child process and return its (picklable) result.
+
+    Child is killed after ``timeout`` seconds, its address space is limited to ``memory_limit`` MB.
+    A crash, a timeout or an exception in child raise :class:`LinkyPyExtractionError`.
+    Child is profiled while a profiling window is open.
+    """
+    context = get_context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run, args=(sender, func, args, memory_limit, PROFILER.child_prefix()), daemon=True)
+    process.start()
+    sender.close()
+
+    try:
+        if not receiver.poll(timeout):
+            process.kill()
+            raise LinkyPyExtractionTimeout("%s%s did not finish within %ss" % (func.__name__, args, timeout))
+        try:
+            success, result = receiver.recv()
+        except EOFError:
+            process.join()
+            raise LinkyPyExtractionError("%s%s crashed (exit code %s)" % (func.__name__, args, process.exitcode))
+    finally:
+        receiver.close()
+        process.join()
+
+    if not success:
+        raise LinkyPyExtractionError("%s%s failed:\n%s" % (func.__name__, args, result))
+    return result
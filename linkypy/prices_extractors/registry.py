@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from linkypy import CONF, metrics
+from linkypy.profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+REFRESH_DURATION = metrics.histogram('linkypy_prices_refresh_duration_seconds', "Duration of prices tables refreshes, by provider and status.", ['provider', 'status'],
+                                     buckets=(.1, .5, 1., 2.5, 5., 10., 30., 60., 120., 300.))
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_price_registry():
+    """
+    Get the prices registry shared by every price extractor.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            options = CONF.linkypy.get('price_extraction', {})
+            _registry = PriceRegistry(**dict((key, options[key]) for key in PriceRegistry.OPTIONS if key in options))
+        return _registry
+
+
+class PriceTable(object):
+    """
+    Last known prices tables of a PDF, with its refresh status.
+    """
+
+    def __init__(self, extractor, url):
+
+        self.extractor = extractor
+        self.url = url
+        self.tables = None
+        self.updated = None
+        self.status = 'never loaded'
+        self.error = None
+        self.failures = 0
+        self.next_refresh = 0
+        self.refreshing = False
+
+
+class PriceRegistry(object):
+    """
+    Serves last known prices tables immediately, and refreshes them on a background scheduler.
+
+    Tables are refreshed every ``refresh_interval`` seconds, failed refreshes are retried after
+    ``retry_interval`` seconds, doubled on each failure up to ``max_retry_interval``.
+    Every delay is randomized by +/- ``jitter`` (ratio) so that PDFs are not all refreshed together.
+    """
+
+    OPTIONS = ('refresh_interval', 'retry_interval', 'max_retry_interval', 'jitter', 'workers')
+
+    def __init__(self, refresh_interval=86400, retry_interval=300, max_retry_interval=21600, jitter=0.1, workers=2):
+
+        self.refresh_interval = float(refresh_interval)
+        self.retry_interval = float(retry_interval)
+        self.max_retry_interval = float(max_retry_interval)
+        self.jitter = float(jitter)
+        self.workers = max(1, int(workers))
+
+        self.entries = {}
+        self.version = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+        self.scheduled = False
+
+    def delay(self, seconds):
+        return seconds * random.uniform(1. - self.jitter, 1. + self.jitter)
+
+    def register(self, extractor, url):
+        """
+        Register a PDF of given extractor, last known tables are loaded from prices cache.
+        """
+        entry = PriceTable(extractor, url)
+        cached = extractor.cache.get(url)
+        if cached is not None:
+            entry.tables = cached['tables']
+            entry.updated = cached['updated']
+            entry.status = 'cached'
+            entry.next_refresh = entry.updated + self.delay(self.refresh_interval)
+
+        with self.lock:
+            self.entries[url] = entry
+            self.version += 1
+        self.wakeup.set()
+
+    def get(self, url):
+        """
+        Return last known tables of given URL, None if they were never loaded.
+        """
+        entry = self.entries.get(url)
+        return entry.tables if entry is not None else None
+
+    def refresh_entry(self, entry):
+
+        start = time.time()
+        try:
+            cached = entry.extractor.load_tables(entry.url)
+            with self.lock:
+                if cached['tables'] != entry.tables:
+                    self.version += 1
+                entry.tables = cached['tables']
+                entry.updated = cached['updated']
+                entry.status = 'ok'
+                entry.error = None
+                entry.failures = 0
+                entry.next_refresh = time.time() + self.delay(self.refresh_interval)
+            logger.info("Refreshed prices from %s in %.1fs" % (entry.url, time.time() - start))
+            REFRESH_DURATION.observe(time.time() - start, entry.extractor.provider_name, 'ok')
+
+        except Exception as e:
+            with self.lock:
+                entry.status = 'error'
+                entry.error = str(e)
+                entry.failures += 1
+                retry = min(self.max_retry_interval, self.retry_interval * 2 ** (entry.failures - 1))
+                entry.next_refresh = time.time() + self.delay(retry)
+            logger.error("An error occured while refreshing prices from %s (retry in %ds), keeping last known prices." % (entry.url, retry), exc_info=True)
+            REFRESH_DURATION.observe(time.time() - start, entry.extractor.provider_name, 'error')
+
+        finally:
+            entry.refreshing = False
+
+    def claim(self, entries=None):
+        with self.lock:
+            if entries is None:
+                entries = list(self.entries.values())
+            entries = [entry for entry in entries if not entry.refreshing]
+            for entry in entries:
+                entry.refreshing = True
+        return entries
+
+    def due_entries(self):
+        now = time.time()
+        return [entry for entry in list(self.entries.values()) if entry.next_refresh <= now]
+
+    def next_wakeup(self):
+        next_refresh = min([entry.next_refresh for entry in list(self.entries.values())] or [time.time() + 60])
+        return min(60, max(1, next_refresh - time.time()))
+
+    def refresh(self, entries=None):
+        """
+        Refresh given entries (every entry by default) in parallel, and wait for them.
+        """
+        entries = self.claim(entries)
+        if entries:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="PricesRefresh") as executor:
+                list(executor.map(functools.partial(PROFILER.call, 'PricesRefresh', self.refresh_entry), entries))
+
+    def refresh_due(self):
+        self.refresh(self.due_entries())
+
+    def start(self):
+        """
+        Start refreshing tables in the background.
+        """
+        with self.lock:
+            if self.thread is not None or self.scheduled:
+                return
+            self.thread = threading.Thread(target=self.run, name="PricesRefresh", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped:
+            self.refresh_due()
+            self.wakeup.wait(self.next_wakeup())
+            self.wakeup.clear()
+
+    async def run_async(self, executor=None):
+        """
+        Refresh tables from an asyncio event loop instead of a scheduler thread, loading tables in given executor.
+        """
+        self.scheduled = True
+        loop = asyncio.get_event_loop()
+        while not self.stopped:
+            entries = self.claim(self.due_entries())
+            if entries:
+                await asyncio.gather(*(loop.run_in_executor(executor, PROFILER.call, 'PricesRefresh', self.refresh_entry, entry) for entry in entries))
+
+            # Wake up early when a PDF is registered.
+            deadline = time.monotonic() + self.next_wakeup()
+            while not self.stopped and not self.wakeup.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(min(1, deadline - time.monotonic()))
+            self.wakeup.clear()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def status(self):
+        return [{
+            'url': entry.url,
+            'provider': entry.extractor.provider_name,
+            'status': entry.status,
+            'updated': entry.updated,
+            'next_refresh': entry.next_refresh,
+            'error': entry.error,
+        } for entry in list(self.entries.values())]
@@ -1,19 +1,10 @@
 import logging
-import os
-import uuid
-from multiprocessing.dummy import Pool as ThreadPool
+
 from linkypy.prices_extractors.base import BasePriceExtractor
-import pdfplumber
-import requests
-from cachetools import TTLCache, cached
 
 logger = logging.getLogger(__name__)
 
 
-ttl = 2592000
-cache = TTLCache(maxsize=128, ttl=ttl)
-
-
 class TotalDirectEnergiePriceExtractor(BasePriceExtractor):
 
     PDFS = {
@@ -24,59 +15,27 @@ class TotalDirectEnergiePriceExtractor(BasePriceExtractor):
     OFFER_NAMES = PDFS.keys()
     OFFER_TYPES = ('BASE', 'HPHC')
 
-    def __init__(self):
-
-        super().__init__()
-
-        self.provider_name = "Total Direct Energie"
-
-        # Preload PDFs
-        pool = ThreadPool(1)
-        _ = pool.map(self.download_pdf, TotalDirectEnergiePriceExtractor.PDFS.values())
-        pool.close()
-        pool.join()
-
-    def get_available_offers_names(self):
-        return TotalDirectEnergiePriceExtractor.OFFER_NAMES
-
-    def get_available_offers_types(self):
-        return TotalDirectEnergiePriceExtractor.OFFER_TYPES
-
-    @cached(cache)
-    def download_pdf(self, url):
-
-        logger.info("Updating prices cache from %s" % url)
-        tmp_output = os.path.join("/tmp/%s.pdf" % str(uuid.uuid5(uuid.NAMESPACE_DNS, url)))
-        headers = {"user-agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:81.0) Gecko/20100101 Firefox/81.0"}
-
-        with open(tmp_output, 'wb') as f:
-            # Downloading PDF file
-            f.write(requests.get(url, headers=headers).content)
-
-        # Load PDF file
-        pdf = pdfplumber.open(tmp_output)
-        os.remove(tmp_output)
-
-        return pdf
+    provider_name = "Total Direct Energie"
 
-    @cached(cache)
-    def get_prices_list(self, offer_name, offer_type):
+    def parse_pdf(self, path):
+        # Heavy libraries are only imported when a PDF has to be parsed.
+        import pdfplumber
 
-        url = TotalDirectEnergiePriceExtractor.PDFS[offer_name]
-
-        # Load PDF file
-        pdf = self.download_pdf(url)
-
-        # Find page with table
+        # Load PDF file and find page with table
         table = None
-        for i, page in enumerate(pdf.pages):
-            table = page.extract_table()
-            if table is not None:
-                break
+        with pdfplumber.open(path) as pdf:
+            for i, page in enumerate(pdf.pages):
+                table = page.extract_table()
+                if table is not None:
+                    break
 
         # Error if not table found
         if table is None:
-            raise Exception("Cannot find prices table in PDF %s" % url)
+            raise Exception("Cannot find prices table in PDF %s" % path)
+
+        return dict((offer_type, self.get_prices_list(table, offer_type)) for offer_type in self.OFFER_TYPES)
+
+    def get_prices_list(self, table, offer_type):
 
         # Search line with power (kVA) as first element
         data = []
@@ -98,31 +57,11 @@ class TotalDirectEnergiePriceExtractor(BasePriceExtractor):
 
         prices = {}
         for line in data:
-            prices[int(line[0].split()[0])] = line
-
-        return prices
-
-    def get_prices(self, offer_name, offer_type, power):
-
-        try:
-
-            prices = self.get_prices_list(offer_name, offer_type)
-            line = prices[power]
-
             if offer_type == "BASE":
-                return {
-                    'MONTHLY_SUBSCRIPTION_PRICE': float(line[2].replace(',', '.')),
-                    'HP_KWH_PRICE': float(line[-1].replace(',', '.')),
-                    'HC_KWH_PRICE': float(line[-1].replace(',', '.'))
-
-                }
+                hp_kwh_price = hc_kwh_price = float(line[-1].replace(',', '.'))
             elif offer_type == "HPHC":
-                return {
-                    'MONTHLY_SUBSCRIPTION_PRICE': float(line[2].replace(',', '.')),
-                    'HP_KWH_PRICE': float(line[7].replace(',', '.')),
-                    'HC_KWH_PRICE': float(line[12].replace(',', '.'))
-                }
-
-        except Exception:
-            logger.error("An error occured while syncing prices. Falling back to environment variable prices: %s" % self.fallback_prices, exc_info=True)
-            return self.fallback_prices
+                hp_kwh_price = float(line[7].replace(',', '.'))
+                hc_kwh_price = float(line[12].replace(',', '.'))
+            prices[int(line[0].split()[0])] = [float(line[2].replace(',', '.')), hp_kwh_price, hc_kwh_price]
+
+        return prices
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import glob
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+SESSION_FILE = re.compile(r'^linkypy-(\d+)[-.]')
+
+
+def safe_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+
+def dump_snapshot(path, top=10):
+    snapshot = tracemalloc.take_snapshot()
+    snapshot.dump(path)
+    statistics = snapshot.statistics('lineno')[:top]
+    logger.info("Top %d allocations (snapshot written to %s):\n%s" % (len(statistics), path, "\n".join(str(statistic) for statistic in statistics)))
+
+
+def profile_call(func, args, prefix):
+    """
+    Call ``func(*args)`` under cProfile and tracemalloc, in a price extraction child process.
+    """
+    profile = cProfile.Profile()
+    tracemalloc.start(25)
+    try:
+        return profile.runcall(func, *args)
+    finally:
+        path = "%s-child-%s-%d" % (prefix, safe_name(func.__name__), os.getpid())
+        profile.dump_stats(path + '.prof')
+        dump_snapshot(path + '.snapshot')
+        tracemalloc.stop()
+
+
+class Profiler(object):
+    """
+    Profiles CPU (cProfile) and memory (tracemalloc) for a window of ``frames`` frames or ``seconds``
+    seconds, whichever comes first, then writes ``.prof`` and ``.snapshot`` files to ``directory``.
+
+    cProfile only profiles the thread it is enabled in: threads of the pipeline (reader, callback
+    workers, InfluxDB writer, prices refreshes) call :meth:`tick` in their loop, so that each one
+    profiles itself while a window is open and writes its own ``.prof`` file on its first tick after.
+    Price extraction child processes write their own files too.
+
+    With ``rotate``, a new window is opened as soon as one ends, and only the last ``keep`` ones are kept.
+    """
+
+    def __init__(self):
+
+        self.enabled = False
+        self.active = False
+        self.directory = None
+        self.frames_limit = None
+        self.seconds_limit = None
+        self.rotate = False
+        self.keep = 5
+
+        self.session = 0
+        self.started = None
+        self.frames = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.calls = itertools.count(1)
+
+    def configure(self, directory, frames=None, seconds=None, rotate=False, keep=5):
+
+        self.directory = os.path.abspath(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.frames_limit = int(frames) if frames else None
+        self.seconds_limit = float(seconds) if seconds else None
+        if self.frames_limit is None and self.seconds_limit is None:
+            self.seconds_limit = 60.
+        self.rotate = rotate
+        self.keep = max(1, int(keep))
+        self.enabled = True
+
+    def prefix(self, session=None):
+        return os.path.join(self.directory, "linkypy-%04d" % (session or self.session))
+
+    def start(self):
+        with self.lock:
+            self.open()
+
+    def open(self):
+        self.session += 1
+        self.started = time.monotonic()
+        self.frames = 0
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        self.active = True
+        logger.info("Profiling window %d started (frames=%s, seconds=%s), writing to %s" % (self.session, self.frames_limit, self.seconds_limit, self.directory))
+
+    def close(self):
+        self.active = False
+        dump_snapshot(self.prefix() + '.snapshot')
+        logger.info("Profiling window %d ended after %d frames and %.1fs, threads write their profiles on their next iteration"
+                    % (self.session, self.frames, time.monotonic() - self.started))
+        if self.rotate:
+            self.cleanup(self.session - self.keep + 1)
+            self.open()
+        else:
+            tracemalloc.stop()
+
+    def cleanup(self, first_session):
+        for path in glob.glob(os.path.join(self.directory, 'linkypy-*')):
+            match = SESSION_FILE.match(os.path.basename(path))
+            if match and int(match.group(1)) < first_session:
+                os.remove(path)
+
+    def stop(self):
+        with self.lock:
+            if self.active:
+                self.rotate = False
+                self.close()
+        self.tick()
+
+    def frame(self):
+        """
+        Count a frame, called by packet readers.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.frames += 1
+        self.tick()
+
+    def tick(self):
+        """
+        Start, stop or rotate profile of current thread, following profiling windows.
+        """
+        if not self.enabled:
+            return
+
+        if self.active:
+            started = self.started
+            expired = (self.frames_limit is not None and self.frames >= self.frames_limit) or \
+                (self.seconds_limit is not None and time.monotonic() - started >= self.seconds_limit)
+            if expired:
+                with self.lock:
+                    # Another thread may have closed (and rotated) the window meanwhile.
+                    if self.active and self.started is started:
+                        self.close()
+
+        local = self.local
+        profile = getattr(local, 'profile', None)
+        if profile is not None and (not self.active or local.session != self.session):
+            profile.disable()
+            path = "%s-%s.prof" % (self.prefix(local.session), safe_name(threading.current_thread().name))
+            profile.dump_stats(path)
+            local.profile = profile = None
+            logger.debug("Thread profile written to %s" % path)
+
+        if profile is None and self.active:
+            local.session = self.session
+            local.profile = cProfile.Profile()
+            local.profile.enable()
+
+    def call(self, name, func, *args):
+        """
+        Call ``func(*args)`` from a short-lived thread, profiled in its own file while a window is open.
+        """
+        prefix = self.child_prefix()
+        # A thread can only be profiled once at a time.
+        if prefix is None or getattr(self.local, 'profile', None) is not None:
+            return func(*args)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            profile.dump_stats("%s-%s-%d.prof" % (prefix, safe_name(name), next(self.calls)))
+
+    def child_prefix(self):
+        """
+        Files prefix of price extraction child processes, None unless a window is open.
+        """
+        return self.prefix() if self.active else None
+
+
+PROFILER = Profiler()
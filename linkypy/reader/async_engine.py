@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from linkypy import CONF
+from linkypy.callbacks import get_callbacks
+from linkypy.reader.dispatcher import _STOP, CALLBACK_ERRORS, CallbackDispatcher, CallbackWorker
+from linkypy.reader.packet_reader import LinkyPyPacketReader, open_serial
+from linkypy.profiling import PROFILER
+from linkypy.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCallbackWorker(CallbackWorker):
+    """
+    Bounded queue and tasks feeding a single callback from the event loop.
+
+    Callbacks may provide ``compute_async()`` / ``warm_up_async()`` / ``close_async()`` coroutines, synchronous
+    ``compute()`` / ``warm_up()`` / ``close()`` methods are run in the engine executor instead.
+    """
+
+    Queue = asyncio.Queue
+    Full = asyncio.QueueFull
+    Empty = asyncio.QueueEmpty
+
+    def __init__(self, callback, executor=None, **options):
+        super(AsyncCallbackWorker, self).__init__(callback, **options)
+        self.executor = executor
+        self.ready = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.pending = []
+        self.tasks = []
+        self.warm_up_task = None
+
+    def start(self):
+        if hasattr(self.callback, 'warm_up_async') or hasattr(self.callback, 'warm_up'):
+            self.warm_up_task = asyncio.ensure_future(self.warm_up())
+        else:
+            self.warmed = True
+            self.ready.set()
+
+        self.tasks = [asyncio.ensure_future(self.run()) for _ in range(self.workers)]
+
+    def put_blocking(self, item):
+        # Reader awaits pending puts (see drain()) before reading next data.
+        self.pending.append(asyncio.ensure_future(self.queue.put(item)))
+
+    async def drain(self):
+        while self.pending:
+            pending, self.pending = self.pending, []
+            await asyncio.gather(*pending)
+
+    async def call(self, name, *args, **kwargs):
+        method = getattr(self.callback, name + '_async', None)
+        if method is not None:
+            return await method(*args, **kwargs)
+        method = functools.partial(getattr(self.callback, name), *args, **kwargs)
+        if name == 'compute' and (TRACER.watching or PROFILER.enabled):
+            method = functools.partial(self.watched, method)
+        return await asyncio.get_event_loop().run_in_executor(self.executor, method)
+
+    def watched(self, method):
+        PROFILER.tick()
+        if not TRACER.watching:
+            return method()
+        TRACER.enter(self.name)
+        try:
+            return method()
+        finally:
+            TRACER.exit()
+
+    async def warm_up(self, retry_interval=1, max_retry_interval=60):
+        while not self.stopping.is_set():
+            try:
+                start = time.monotonic()
+                await self.call('warm_up')
+                self.warmed = True
+                logger.info("Callback '%s' is ready (warm-up took %.1fs, %d packet(s) buffered)" % (self.name, time.monotonic() - start, self.queue.qsize()))
+                self.ready.set()
+                return
+            except Exception as e:
+                logger.error("An error occured while warming up callback '%s' (retry in %ds): %s" % (self.name, retry_interval, e))
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), retry_interval)
+                except asyncio.TimeoutError:
+                    pass
+                retry_interval = min(max_retry_interval, retry_interval * 2)
+
+    async def run(self):
+        await self.ready.wait()
+        while True:
+            item = await self.queue.get()
+            try:
+                if item is _STOP or self.stopping.is_set() and not self.warmed:
+                    return
+                args, kwargs, trace = self.get(item)
+                start = time.perf_counter()
+                try:
+                    await self.call('compute', *args, **kwargs)
+                finally:
+                    self.computed(trace, start)
+                self.processed += 1
+            except Exception:
+                self.errors += 1
+                CALLBACK_ERRORS.inc(self.name)
+                logger.error("An error occured in callback '%s'." % self.name, exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    async def stop(self, timeout=None, deadline=None):
+        self.stopping.set()
+        self.ready.set()
+        if self.warm_up_task is not None:
+            self.warm_up_task.cancel()
+        if deadline is None and timeout is not None:
+            deadline = time.monotonic() + timeout
+        for _ in self.tasks:
+            try:
+                await asyncio.wait_for(self.queue.put(_STOP), None if deadline is None else max(0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self.put_dropping(_STOP)
+        pending = ()
+        if self.tasks:
+            _, pending = await asyncio.wait(self.tasks, timeout=None if deadline is None else max(0.001, deadline - time.monotonic()))
+        self.tasks = []
+        if pending:
+            logger.warning("Callback '%s' is still computing a packet, it is not closed." % self.name)
+        elif hasattr(self.callback, 'close_async') or hasattr(self.callback, 'close'):
+            try:
+                await self.call('close')
+            except Exception:
+                logger.error("An error occured while closing callback '%s'." % self.name, exc_info=True)
+
+
+class AsyncCallbackDispatcher(CallbackDispatcher):
+    """
+    Hands packets over from meter readers to callback tasks, on the event loop.
+    """
+
+    Worker = AsyncCallbackWorker
+
+    def __init__(self, plugins, executor=None, **options):
+        super(AsyncCallbackDispatcher, self).__init__(plugins, executor=executor, **options)
+
+    async def drain(self):
+        """
+        Wait for packets waiting for room in queues of callbacks with 'block' overflow policy.
+        """
+        for worker in self.workers:
+            await worker.drain()
+
+    async def join(self):
+        for worker in self.workers:
+            await worker.drain()
+            await worker.queue.join()
+
+    async def stop(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self.workers:
+            await worker.stop(deadline=deadline)
+
+
+class AsyncEngine(object):
+    """
+    Reads every meter, computes callbacks, writes sinks and refreshes prices from a single event loop.
+
+    Blocking work (synchronous callbacks, prices loading) runs in one small shared thread pool.
+    Serial ports are read when their file descriptor is readable, or polled every ``poll_interval``
+    seconds for URLs without one (``loop://``, ``socket://``...).
+    """
+
+    def __init__(self, ports, baudrate=1200, workers=4, poll_interval=0.05):
+
+        self.ports = list(ports)
+        self.baudrate = baudrate
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.executor = None
+        self.dispatcher = None
+        self.stopping = None
+        self.readables = []
+
+    def run(self):
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            logger.info("Interrupted, exiting")
+
+    async def main(self):
+        from linkypy.prices_extractors.registry import get_price_registry
+        from linkypy.sinks import get_sinks
+
+        self.stopping = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="LinkyPyEngine")
+
+        # Prices are refreshed by this loop, not by a scheduler thread.
+        registry = get_price_registry()
+        registry.scheduled = True
+
+        callbacks = get_callbacks()
+        self.dispatcher = AsyncCallbackDispatcher(callbacks, executor=self.executor, **CONF.linkypy.get('dispatch', {}))
+        self.dispatcher.start()
+
+        tasks = [asyncio.ensure_future(self.read_meter(port)) for port in self.ports]
+        background = [asyncio.ensure_future(sink.run_async()) for sink in get_sinks()]
+        background.append(asyncio.ensure_future(registry.run_async(self.executor)))
+
+        # Stop cleanly on SIGTERM too (docker stop), so that pending points and rollups are written.
+        loop = asyncio.get_event_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self.stop)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Not supported on this platform, or not in main thread.
+            loop = None
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            if loop is not None:
+                loop.remove_signal_handler(signal.SIGTERM)
+            await self.dispatcher.stop(timeout=5)
+            registry.stop()
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            for sink in get_sinks():
+                sink.close()
+            self.executor.shutdown(wait=False)
+
+    def open(self, url):
+        logger.info("Connecting to Linky through USB dongle on %s (baudrate=%dbps)" % (url, self.baudrate))
+        port = open_serial(url, self.baudrate, timeout=0)
+        logger.info("Connected to Linky: %s" % port.get_settings())
+        return port
+
+    async def read_meter(self, url, retry_interval=1, max_retry_interval=60):
+        """
+        Read a meter until engine is stopped, reconnecting when its port fails, without affecting other meters.
+        """
+        while not self.stopping.is_set():
+            try:
+                await self.read_port(url)
+                return
+            except Exception as e:
+                logger.error("An error occured while reading Linky on %s (retry in %ds): %s" % (url, retry_interval, e))
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), retry_interval)
+                except asyncio.TimeoutError:
+                    pass
+                retry_interval = min(max_retry_interval, retry_interval * 2)
+
+    async def read_port(self, url):
+        loop = asyncio.get_event_loop()
+        port = await loop.run_in_executor(self.executor, self.open, url)
+
+        protocol = LinkyPyPacketReader()
+        protocol.transport = port
+        protocol.dispatcher = self.dispatcher
+
+        readable = asyncio.Event()
+        self.readables.append(readable)
+        try:
+            fileno = port.fileno()
+            loop.add_reader(fileno, readable.set)
+        except (AttributeError, NotImplementedError, ValueError):
+            fileno = None
+
+        try:
+            while not self.stopping.is_set():
+                if fileno is not None:
+                    await readable.wait()
+                    readable.clear()
+                else:
+                    await asyncio.sleep(self.poll_interval)
+
+                data = port.read(port.in_waiting or 1)
+                if data:
+                    protocol.data_received(data)
+                    await self.dispatcher.drain()
+        finally:
+            if fileno is not None:
+                loop.remove_reader(fileno)
+            port.close()
+
+    def stop(self):
+        """
+        Stop reading meters, must be called from the event loop.
+        """
+        self.stopping.set()
+        for readable in self.readables:
+            readable.set()
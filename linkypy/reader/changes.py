@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import datetime
+import time
+
+_MISSING = object()
+
+
+def timestamp_seconds(timestamp):
+    """
+    Seconds since epoch of a packet ``timestamp`` (ISO string, naive ones are UTC).
+    """
+    moment = datetime.datetime.fromisoformat(timestamp)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+class ChangeDetector(object):
+    """
+    Keeps last emitted value of each label, by meter, to emit only fields that changed.
+
+    Every field is emitted again (snapshot) every ``heartbeat`` seconds. Integer values of labels with a
+    ``deadbands`` entry are only emitted when they moved by at least that amount since last emitted value.
+    """
+
+    def __init__(self, heartbeat=300, deadbands=None):
+
+        self.heartbeat = float(heartbeat) if heartbeat else None
+        self.deadbands = dict(deadbands or {})
+        # Last emitted values and time of last snapshot, by meter.
+        self.emitted = {}
+        self.snapshots = {}
+
+    @classmethod
+    def from_config(cls, options):
+        """
+        Detector built from 'changes' configuration section, None when it is disabled.
+        """
+        options = dict(options or {})
+        if not options.pop('enabled', False):
+            return None
+        return cls(**options)
+
+    def changes(self, fields, meter=None, now=None):
+        """
+        Fields of a packet that changed since the last ones emitted for the same meter, every field when a snapshot is due.
+        """
+        if now is None:
+            now = time.time()
+
+        emitted = self.emitted.get(meter)
+        last = self.snapshots.get(meter)
+        # Clock going back (replays) forces a snapshot too.
+        if emitted is None or self.heartbeat is not None and (now - last >= self.heartbeat or now < last):
+            self.emitted[meter] = dict(fields)
+            self.snapshots[meter] = now
+            return fields
+
+        changes = {}
+        deadbands = self.deadbands
+        for label, value in fields.items():
+            previous = emitted.get(label, _MISSING)
+            if previous == value:
+                continue
+            deadband = deadbands.get(label)
+            if deadband is not None and isinstance(value, int) and isinstance(previous, int) and abs(value - previous) < deadband:
+                continue
+            changes[label] = value
+
+        if changes:
+            emitted.update(changes)
+        return changes
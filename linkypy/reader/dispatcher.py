@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+import inspect
+import logging
+import queue
+import threading
+import time
+import weakref
+
+from linkypy import metrics
+from linkypy.callbacks import callback_labels
+from linkypy.profiling import PROFILER
+from linkypy.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_COALESCE = 'coalesce'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
+
+_STOP = object()
+
+# Dispatchers of the process, for queue depth metrics.
+_dispatchers = weakref.WeakSet()
+
+
+def collect_queue_depths():
+    for dispatcher in list(_dispatchers):
+        for worker in dispatcher.workers:
+            yield (worker.name,), worker.queue.qsize()
+
+
+CALLBACK_DURATION = metrics.histogram('linkypy_callback_duration_seconds', "Packet computation duration, by callback.", ['callback'])
+CALLBACK_ERRORS = metrics.counter('linkypy_callback_errors_total', "Packets whose computation failed, by callback.", ['callback'])
+CALLBACK_SKIPPED = metrics.counter('linkypy_callback_skipped_total', "Packets not handed to callback as its labels were missing or unchanged, by callback.", ['callback'])
+CALLBACK_DROPPED = metrics.counter('linkypy_callback_dropped_total', "Packets dropped because callback queue was full, by callback.", ['callback'])
+QUEUE_DEPTH = metrics.gauge('linkypy_callback_queue_depth', "Packets waiting in callback queue, by callback.", ['callback'], collect=collect_queue_depths)
+
+
+def callback_name(callback):
+    return "%s.%s" % (type(callback).__module__, type(callback).__name__)
+
+
+def accepts_meter(method):
+    """
+    Whether given compute method accepts the ``meter`` keyword argument (older callbacks do not).
+    """
+    try:
+        parameters = inspect.signature(method).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == 'meter' or p.kind == p.VAR_KEYWORD for p in parameters)
+
+
+class CallbackWorker(object):
+    """
+    Bounded queue and worker threads feeding a single callback.
+
+    When callback has a ``warm_up()`` method, it is called (and retried until it succeeds) in the
+    background before any packet is computed, packets are buffered in the queue meanwhile. Its
+    ``close()`` method, if any, is called once workers are stopped.
+
+    Items are ``(data, timestamp, meter, trace)`` tuples, ``trace`` is None unless tracing is enabled. Same (read-only)
+    ``data`` is shared by every callback, which must not modify it. When coalescing, only the latest packet of each
+    meter is kept: queue holds meters, and their latest packet is kept aside.
+
+    Callbacks are computed by a single worker thread unless they are marked ``THREAD_SAFE``.
+
+    Callbacks declaring the labels they read (``LABELS``, required, and ``OPTIONAL_LABELS``) are skipped when a
+    required label is missing, or when none of their labels changed since previous packet of the same meter
+    (unless ``SKIP_UNCHANGED`` is False), or is in frame changes when reader detects them.
+    """
+
+    Queue = queue.Queue
+    Full = queue.Full
+    Empty = queue.Empty
+
+    def __init__(self, callback, queue_size=16, workers=1, overflow=OVERFLOW_DROP_OLDEST):
+
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy '%s' (expected one of %s)" % (overflow, ', '.join(OVERFLOW_POLICIES)))
+        # Callbacks keeping per-packet state on their instance must be computed by a single worker.
+        if int(workers) > 1 and not getattr(callback, 'THREAD_SAFE', False):
+            raise ValueError("Callback '%s' is not thread-safe (THREAD_SAFE), it cannot have %s workers" % (callback_name(callback), workers))
+
+        self.callback = callback
+        self.name = callback_name(callback)
+        self.overflow = overflow
+        self.workers = max(1, int(workers))
+        self.queue = self.Queue(maxsize=max(1, int(queue_size)))
+        self.latest = {}
+        self.lock = threading.Lock()
+        self.takes_meter = accepts_meter(getattr(callback, 'compute_async', None) or callback.compute)
+        self.labels = callback_labels(callback)
+        self.required_labels = tuple(getattr(callback, 'LABELS', None) or ())
+        self.skip_unchanged = self.labels is not None and getattr(callback, 'SKIP_UNCHANGED', True)
+        # Values of labels in previous packet handed to callback, and last queued ``(item, values)``, by meter.
+        # Packets are compared with the last queued one, or the last computed one once it was dropped.
+        self.previous = {}
+        self.queued = {}
+        self.threads = []
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+        self.warmed = False
+
+        # Counters
+        self.enqueued = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def start(self):
+        if hasattr(self.callback, 'warm_up'):
+            thread = threading.Thread(target=self.warm_up, name="%s-warm-up" % type(self.callback).__name__, daemon=True)
+            thread.start()
+        else:
+            self.warmed = True
+            self.ready.set()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run, name="%s-%d" % (type(self.callback).__name__, i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, item):
+        """
+        Enqueue an item following the overflow policy. Called from the reader thread only.
+        """
+        if self.labels is not None and not self.wants(item):
+            self.skip(item)
+            return
+
+        # Never block reader while callback is warming up.
+        if self.overflow == OVERFLOW_COALESCE:
+            self.coalesce(item)
+        elif self.overflow == OVERFLOW_BLOCK and self.ready.is_set():
+            self.put_blocking(item)
+        else:
+            self.put_dropping(item)
+
+        values = self.values(item)
+        if values is not None:
+            self.queued[item[2]] = (item, values)
+
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def wants(self, item):
+        """
+        Whether item carries every required label, and (when skipping unchanged packets) a changed label.
+        """
+        data, meter = item[0], item[2]
+        for label in self.required_labels:
+            if label not in data:
+                return False
+        if not self.skip_unchanged:
+            return True
+        # Frames of reader with change detection tell what changed (taking deadbands and heartbeat into account).
+        changes = getattr(data, 'changes', None)
+        if changes is not None:
+            for label in self.labels:
+                if label in changes:
+                    return True
+            return False
+        queued = self.queued.get(meter)
+        previous = queued[1] if queued is not None else self.previous.get(meter)
+        return previous != self.values(item)
+
+    def values(self, item):
+        """
+        Values of callback labels in item, None when unchanged packets are not skipped by comparing them.
+        """
+        if not self.skip_unchanged or getattr(item[0], 'changes', None) is not None:
+            return None
+        return tuple(item[0].get(label) for label in self.labels)
+
+    def dequeued(self, item):
+        """
+        Item left the queue, computed or dropped: forget it as last queued item of its meter.
+        """
+        meter = item[2]
+        queued = self.queued.get(meter)
+        if queued is not None and queued[0] is item:
+            self.queued.pop(meter, None)
+
+    def skip(self, item):
+        if item[3] is not None:
+            item[3].skipped(self.name)
+        self.skipped += 1
+        CALLBACK_SKIPPED.inc(self.name)
+
+    def put_blocking(self, item):
+        self.queue.put(item)
+
+    def put_dropping(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except self.Full:
+                self.discard()
+
+    def coalesce(self, item):
+        meter = item[2]
+        with self.lock:
+            if meter in self.latest:
+                # A packet of this meter is still pending: replace it.
+                self.drop(self.latest[meter])
+                self.latest[meter] = item
+                return
+            self.put_dropping(meter)
+            self.latest[meter] = item
+
+    def discard(self):
+        """
+        Drop the oldest pending item.
+        """
+        try:
+            item = self.queue.get_nowait()
+            self.queue.task_done()
+        except self.Empty:
+            return
+        if self.overflow == OVERFLOW_COALESCE:
+            item = self.latest.pop(item, None)
+        self.drop(item)
+
+    def drop(self, item):
+        if item is not None:
+            self.dequeued(item)
+            if item[3] is not None:
+                item[3].dropped(self.name)
+        self.dropped += 1
+        CALLBACK_DROPPED.inc(self.name)
+        if self.dropped % 100 == 1:
+            logger.warning("Callback '%s' is too slow, %d packet(s) dropped so far" % (self.name, self.dropped))
+
+    def get(self, item):
+        """
+        Return callback arguments and trace of a dequeued item.
+        """
+        if self.overflow == OVERFLOW_COALESCE:
+            with self.lock:
+                item = self.latest.pop(item)
+        data, timestamp, meter, trace = item
+        values = self.values(item)
+        if values is not None:
+            self.previous[meter] = values
+            self.dequeued(item)
+        return (data, timestamp), ({'meter': meter} if self.takes_meter else {}), trace
+
+    def computed(self, trace, start):
+        end = time.perf_counter()
+        CALLBACK_DURATION.observe(end - start, self.name)
+        if trace is not None:
+            trace.computed(self.name, start, end)
+
+    def warm_up(self, retry_interval=1, max_retry_interval=60):
+        while not self.stopping.is_set():
+            try:
+                start = time.monotonic()
+                self.callback.warm_up()
+                self.warmed = True
+                logger.info("Callback '%s' is ready (warm-up took %.1fs, %d packet(s) buffered)" % (self.name, time.monotonic() - start, self.queue.qsize()))
+                self.ready.set()
+                return
+            except Exception as e:
+                logger.error("An error occured while warming up callback '%s' (retry in %ds): %s" % (self.name, retry_interval, e))
+                self.stopping.wait(retry_interval)
+                retry_interval = min(max_retry_interval, retry_interval * 2)
+
+    def run(self):
+        self.ready.wait()
+        while True:
+            item = self.queue.get()
+            PROFILER.tick()
+            try:
+                if item is _STOP or self.stopping.is_set() and not self.warmed:
+                    return
+                args, kwargs, trace = self.get(item)
+                start = time.perf_counter()
+                if TRACER.watching:
+                    TRACER.enter(self.name)
+                try:
+                    self.callback.compute(*args, **kwargs)
+                finally:
+                    if TRACER.watching:
+                        TRACER.exit()
+                    self.computed(trace, start)
+                self.processed += 1
+            except Exception:
+                self.errors += 1
+                CALLBACK_ERRORS.inc(self.name)
+                logger.error("An error occured in callback '%s'." % self.name, exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def stop(self, timeout=None, deadline=None):
+        """
+        Stop workers once pending packets are computed, waiting at most ``timeout`` seconds overall
+        (or until ``deadline``, a :func:`time.monotonic` time).
+
+        Workers still computing after that (a hanging callback) are left behind, as daemon threads,
+        and callback is not closed as it may still be computing a packet.
+        """
+        self.stopping.set()
+        self.ready.set()
+        if deadline is None and timeout is not None:
+            deadline = time.monotonic() + timeout
+        for _ in self.threads:
+            self.put_stop(deadline)
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        alive = [thread for thread in self.threads if thread.is_alive()]
+        self.threads = []
+        if alive:
+            logger.warning("Callback '%s' is still computing a packet, it is not closed." % self.name)
+        elif hasattr(self.callback, 'close'):
+            try:
+                self.callback.close()
+            except Exception:
+                logger.error("An error occured while closing callback '%s'." % self.name, exc_info=True)
+
+    def put_stop(self, deadline):
+        """
+        Queue a stop marker after pending packets, dropping oldest ones when queue is still full at deadline.
+        """
+        try:
+            self.queue.put(_STOP, timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+        except self.Full:
+            self.put_dropping(_STOP)
+
+    def stats(self):
+        return {
+            'ready': self.ready.is_set(),
+            'depth': self.queue.qsize(),
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'skipped': self.skipped,
+            'dropped': self.dropped,
+            'processed': self.processed,
+            'errors': self.errors,
+        }
+
+
+class CallbackDispatcher(object):
+    """
+    Hands packets over from the reader thread to callback workers.
+
+    ``options`` are defaults for every callback (``queue_size``, ``workers``, ``overflow``),
+    ``options['callbacks']`` may override them per callback class path.
+    """
+
+    Worker = CallbackWorker
+
+    def __init__(self, plugins, **options):
+
+        # Positional argument is not named 'callbacks' since per callback overrides use that option name.
+        overrides = options.pop('callbacks', None) or {}
+
+        self.workers = []
+        for callback in plugins:
+            callback_options = dict(options)
+            callback_options.update(overrides.get(callback_name(callback), {}))
+            self.workers.append(self.Worker(callback, **callback_options))
+        _dispatchers.add(self)
+
+        # Labels the reader decodes: those read by callbacks, None when any callback reads every label.
+        labels = [worker.labels for worker in self.workers]
+        self.labels = None if None in labels else frozenset(label for worker_labels in labels for label in worker_labels)
+
+    def start(self):
+        for worker in self.workers:
+            logger.info("Starting %d worker(s) for callback '%s' (queue_size=%d, overflow=%s)"
+                        % (worker.workers, worker.name, worker.queue.maxsize, worker.overflow))
+            worker.start()
+
+    def wait_ready(self):
+        """
+        Wait for every callback to be warmed up.
+        """
+        for worker in self.workers:
+            worker.ready.wait()
+
+    def dispatch(self, data, timestamp, meter=None, trace=None):
+        if trace is not None:
+            trace.dispatch(meter, len(self.workers))
+        for worker in self.workers:
+            worker.put((data, timestamp, meter, trace))
+
+    def join(self):
+        """
+        Wait for every queued packet to be processed.
+        """
+        for worker in self.workers:
+            worker.queue.join()
+
+    def stop(self, timeout=None):
+        """
+        Stop every worker, waiting at most ``timeout`` seconds for all of them.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self.workers:
+            worker.stop(deadline=deadline)
+
+    def stats(self):
+        return dict((worker.name, worker.stats()) for worker in self.workers)
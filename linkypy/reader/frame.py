@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import enum
+from collections.abc import Mapping
+
+
+class Ptec(str, enum.Enum):
+    """
+    Current tariff period (PTEC label of historic mode).
+    """
+
+    ALL_HOURS = 'TH..'
+    OFF_PEAK = 'HC..'
+    PEAK = 'HP..'
+    NORMAL = 'HN..'
+    MOBILE_PEAK = 'PM..'
+    OFF_PEAK_BLUE = 'HCJB'
+    OFF_PEAK_WHITE = 'HCJW'
+    OFF_PEAK_RED = 'HCJR'
+    PEAK_BLUE = 'HPJB'
+    PEAK_WHITE = 'HPJW'
+    PEAK_RED = 'HPJR'
+
+    def __str__(self):
+        return self.value
+
+
+def decode_ptec(value):
+    try:
+        return Ptec(value)
+    except ValueError:
+        return value
+
+
+# Historic mode: indexes (Wh), intensities (A) and apparent power (VA).
+HISTORIC_INTEGERS = (
+    'BASE', 'HCHC', 'HCHP', 'EJPHN', 'EJPHPM', 'BBRHCJB', 'BBRHPJB', 'BBRHCJW', 'BBRHPJW', 'BBRHCJR', 'BBRHPJR', 'GAZ', 'AUTRE',
+    'ISOUSC', 'IINST', 'IINST1', 'IINST2', 'IINST3', 'IMAX', 'IMAX1', 'IMAX2', 'IMAX3', 'ADPS', 'ADIR1', 'ADIR2', 'ADIR3',
+    'PAPP', 'PMAX', 'PEJP',
+)
+
+# Standard mode: indexes (Wh), currents (A), voltages (V) and powers (VA).
+STANDARD_INTEGERS = (
+    'EAST', 'EASD01', 'EASD02', 'EASD03', 'EASD04', 'EAIT', 'ERQ1', 'ERQ2', 'ERQ3', 'ERQ4',
+    'IRMS1', 'IRMS2', 'IRMS3', 'URMS1', 'URMS2', 'URMS3', 'UMOY1', 'UMOY2', 'UMOY3', 'PREF', 'PCOUP',
+    'SINSTS', 'SINSTS1', 'SINSTS2', 'SINSTS3', 'SMAXSN', 'SMAXSN1', 'SMAXSN2', 'SMAXSN3', 'SINSTI', 'SMAXIN',
+    'CCASN', 'CCAIN', 'NTARF',
+) + tuple('EASF%02d' % index for index in range(1, 11))
+
+# Decoders of labels with a typed value, other values are kept as strings.
+DECODERS = dict((label, int) for label in HISTORIC_INTEGERS + STANDARD_INTEGERS)
+DECODERS['PTEC'] = decode_ptec
+
+
+def decode(label, value):
+    """
+    Typed value of a label, raw string when label is unknown or value is malformed.
+    """
+    decoder = DECODERS.get(label)
+    if decoder is None:
+        return value
+    try:
+        return decoder(value)
+    except ValueError:
+        return value
+
+
+class LinkyFrame(Mapping):
+    """
+    Read-only mapping of a frame typed values by label, built once and shared by every callback.
+
+    ``changes`` holds fields that changed since previous frames, None unless change detection is enabled.
+    """
+
+    __slots__ = ('fields', 'meter', 'timestamp', 'changes')
+
+    def __init__(self, fields=None, meter=None, timestamp=None, changes=None):
+        self.fields = {} if fields is None else fields
+        self.meter = meter
+        self.timestamp = timestamp
+        self.changes = changes
+
+    def __getitem__(self, label):
+        return self.fields[label]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __contains__(self, label):
+        return label in self.fields
+
+    def get(self, label, default=None):
+        return self.fields.get(label, default)
+
+    def keys(self):
+        return self.fields.keys()
+
+    def items(self):
+        return self.fields.items()
+
+    def values(self):
+        return self.fields.values()
+
+    def __repr__(self):
+        return "LinkyFrame(%r, meter=%r, timestamp=%r)" % (self.fields, self.meter, self.timestamp)
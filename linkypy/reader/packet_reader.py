@@ -1,21 +1,52 @@
 # -*- coding: utf-8 -*-
 import datetime
 import logging
-import re
+import signal
+import time
 
+import serial
 import serial.threaded
 try:
     import thread  # noqa
 except ImportError:
     import _thread as thread  # noqa
 
+from linkypy import CONF, metrics
+from linkypy.history import HISTORY
 from linkypy.callbacks import get_callbacks
+from linkypy.reader.changes import ChangeDetector, timestamp_seconds
+from linkypy.reader.dispatcher import CallbackDispatcher
+from linkypy.reader.frame import LinkyFrame, decode
+from linkypy.profiling import PROFILER
+from linkypy.tracing import TRACER
 
 logger = logging.getLogger(__name__)
 
+FRAMES_RECEIVED = metrics.counter('linkypy_frames_received_total', "Frames received from meters.")
+FRAMES_PARSED = metrics.counter('linkypy_frames_parsed_total', "Frames successfully parsed.")
+FRAMES_REJECTED = metrics.counter('linkypy_frames_rejected_total', "Frames rejected, by reason.", ['reason'])
+# Labels always decoded, to tag packets with their meter.
+METER_LABELS = frozenset(('ADCO', 'ADSC'))
+
+CHECKSUM_ERRORS = metrics.counter('linkypy_checksum_errors_total', "Lines with an invalid checksum, by label.", ['label'])
+
+
+def open_serial(url, baudrate=1200, **kwargs):
+    """
+    Open Linky serial port, ``url`` is anything supported by ``serial.serial_for_url``.
+    """
+    return serial.serial_for_url(url, baudrate,
+                                 parity=serial.PARITY_EVEN,
+                                 stopbits=serial.STOPBITS_ONE,
+                                 bytesize=serial.SEVENBITS,
+                                 **kwargs)
+
 
 class LinkyPyChecksumError(Exception):
-    pass
+
+    def __init__(self, message, label=None):
+        super(LinkyPyChecksumError, self).__init__(message)
+        self.label = label
 
 
 class LinkyPyPacketError(Exception):
@@ -26,46 +57,245 @@ class LinkyPyPacketReader(serial.threaded.Packetizer):
 
     TERMINATOR = b'\x03\x02'
 
+    # Line delimiters and field separators (historic mode uses SP, standard mode uses HT).
+    LINE_START = 0x0A
+    LINE_END = 0x0D
+    SP = 0x20
+    HT = 0x09
+    # Same delimiters as bytes, for find() (mmap buffers do not accept integers).
+    DELIMITERS = {LINE_END: b'\r', SP: b' ', HT: b'\t'}
+
     def __init__(self, *args, **kwargs):
         super(LinkyPyPacketReader, self).__init__(*args, **kwargs)
         self.callbacks = []
+        self.dispatcher = None
+        self.labels = {}
+        self.known_labels = set()
+        # Meter identifier (ADCO in historic mode, ADSC in standard mode), kept when a frame misses it.
+        self.meter = None
+        # Labels decoded for callbacks, computed again when dispatcher labels change.
+        self.projection = None
+        self.projection_labels = None
+        self.detector = ChangeDetector.from_config(self.change_options())
 
     def connection_made(self, transport):
         super(LinkyPyPacketReader, self).connection_made(transport)
 
-        # Load callbacks from configuration file.
-        self.callbacks = get_callbacks()
+        self.callbacks = self.load_callbacks()
+
+        # Callbacks are computed by their own workers, reader thread only parses packets.
+        self.dispatcher = CallbackDispatcher(self.callbacks, **self.dispatch_options())
+        self.dispatcher.start()
+
+        logger.warning("First packet may have checksum errors as it is not complete.")
 
-        logger.warn("First packet may have checksum errors as it is not complete.")
+    def load_callbacks(self):
+        """
+        Load callbacks from configuration file.
+        """
+        return get_callbacks()
 
-    def handle_packet(self, packet):
+    def dispatch_options(self):
+        return CONF.linkypy.get('dispatch', {})
+
+    def change_options(self):
+        return CONF.linkypy.get('changes')
+
+    def connection_lost(self, exc):
+        if self.dispatcher is not None:
+            self.dispatcher.stop(timeout=5)
+        super(LinkyPyPacketReader, self).connection_lost(exc)
+
+    def data_received(self, data):
+        """
+        Buffer received data and handle each complete packet in place.
+
+        Packets are handed over as offsets into the receive buffer, which is compacted once per call.
+        """
+        buffer = self.buffer
+        buffer.extend(data)
+
+        start = 0
+        while True:
+            end = buffer.find(self.TERMINATOR, start)
+            if end < 0:
+                break
+            self.handle_packet(buffer, start, end)
+            start = end + len(self.TERMINATOR)
+
+        if start:
+            del buffer[:start]
+
+    def handle_packet(self, packet, start=0, end=None, timestamp=None):
+        """
+        Compute a Linky packet into a :class:`LinkyFrame` of typed values, ``timestamp`` defaults to reception time.
         """
-        Compute a Linky packet into a dictionary.
+        if end is None:
+            end = len(packet)
+
+        logger.info("Received packet from Linky [%d characters]" % (end - start))
+        FRAMES_RECEIVED.inc()
+        PROFILER.frame()
+        trace = TRACER.frame() if TRACER.enabled else None
+        received = None
+        if timestamp is None:
+            received = time.time()
+            timestamp = datetime.datetime.utcnow().isoformat()
+        frame = LinkyFrame(timestamp=timestamp)
+        data = frame.fields
+        labels = self.decoded_labels()
+        known_labels = self.known_labels
+
+        # Compute each line and fill frame, with labels read by callbacks only (every checksum is still checked).
+        with memoryview(packet) as view:
+            for line_start, line_end in self.iter_lines(packet, start, end):
+                try:
+                    key, value = self.parse_line(packet, line_start, line_end, view, labels)
+                    if value is not None:
+                        data[key] = decode(key, value)
+                    elif key not in known_labels:
+                        known_labels.add(key)
+                except LinkyPyChecksumError as lce:
+                    logger.error(lce)
+                    # Corrupted labels are not used as metric labels.
+                    CHECKSUM_ERRORS.inc(lce.label if lce.label in self.known_labels else 'other')
+                    FRAMES_REJECTED.inc('checksum')
+                    return frame
+                except LinkyPyPacketError as lpe:
+                    logger.error(lpe)
+                    FRAMES_REJECTED.inc('invalid')
+                    return frame
+                except Exception as e:
+                    logger.error(e, exc_info=True)
+                    FRAMES_REJECTED.inc('error')
+                    return frame
+
+        FRAMES_PARSED.inc()
+        if not self.known_labels.issuperset(data):
+            self.known_labels.update(data)
+
+        self.meter = frame.meter = data.get('ADCO') or data.get('ADSC') or self.meter
+
+        if self.detector is not None or HISTORY.enabled:
+            seconds = received if received is not None else timestamp_seconds(timestamp)
+            if self.detector is not None:
+                frame.changes = self.detector.changes(data, self.meter, seconds)
+            if HISTORY.enabled:
+                HISTORY.append(self.meter, seconds, data)
+
+        if trace is not None:
+            trace.span('parse', trace.start, time.perf_counter())
+
+        # Hand frame over to each declared callback, shared as it is read-only.
+        if self.dispatcher is not None:
+            self.dispatcher.dispatch(frame, timestamp, self.meter, trace)
+
+        return frame
+
+    def decoded_labels(self):
         """
-        logger.info("Received packet from Linky [%d characters]" % len(packet))
-        timestamp = datetime.datetime.utcnow().isoformat()
-        data = {}
+        Labels read by callbacks, meter labels and labels kept in history, None when every label is read.
+        """
+        labels = self.dispatcher.labels if self.dispatcher is not None else None
+        if labels is None:
+            return None
+        if labels is not self.projection_labels:
+            self.projection_labels = labels
+            self.projection = labels | METER_LABELS | HISTORY.labels()
+        return self.projection
+
+    def iter_lines(self, packet, start, end):
+        """
+        Yield ``(start, end)`` offsets of each line in packet, without LF/CR delimiters.
+        """
+        while start < end:
+            # Skip delimiters and whitespaces between lines.
+            while start < end and packet[start] in b'\x02\x03\n\r ':
+                start += 1
+            if start >= end:
+                return
+
+            line_end = packet.find(self.DELIMITERS[self.LINE_END], start, end)
+            if line_end < 0:
+                line_end = end
+            yield start, line_end
+            start = line_end + 1
+
+    def parse_line(self, packet, start, end, view=None, labels=None):
+        """
+        Read the fields of the line found between ``start`` and ``end`` offsets of packet.
 
-        # Compute each line and fill a dictionary.
-        for line in packet.decode("utf-8").strip().splitlines():
-            try:
-                key, value = self.compute_line(line)
-                data[key] = value
-            except (LinkyPyChecksumError, LinkyPyPacketError) as lpe:
-                logger.error(lpe)
-                return data.copy()
-            except Exception as e:
-                logger.error(e, exc_info=True)
-                return data.copy()
+        Separators are found by byte offsets and checksum is computed over the same buffer,
+        only label and value are decoded. Value is None (not decoded) when label is not in ``labels``.
+        See :meth:`compute_line` for checksum details.
+        """
+        if view is None:
+            view = memoryview(packet)
+
+        # Checksum is the last byte, preceded by a separator giving TIC mode.
+        if end - start < 4:
+            raise LinkyPyPacketError("Invalid line received: [%s]" % self.format_line(packet, start, end))
+
+        checksum = packet[end - 1]
+        separator = packet[end - 2]
+        if separator == self.HT:
+            # Standard mode: separator before checksum is part of the sum.
+            checksum_end = end - 1
+        elif separator == self.SP:
+            # Historic mode: separator before checksum is not part of the sum.
+            checksum_end = end - 2
+        else:
+            raise LinkyPyPacketError("Invalid line received: [%s]" % self.format_line(packet, start, end))
+
+        label_end = packet.find(self.DELIMITERS[separator], start, end - 2)
+        if label_end <= start:
+            raise LinkyPyPacketError("Invalid line received: [%s]" % self.format_line(packet, start, end))
+
+        # Standard mode lines may carry a timestamp field between label and value.
+        value_start = label_end + 1
+        if separator == self.HT:
+            date_end = packet.find(self.DELIMITERS[separator], value_start, end - 2)
+            if date_end >= 0:
+                value_start = date_end + 1
+
+        # Compute checksum following Enedis specifications.
+        computed_checksum = (sum(view[start:checksum_end]) & 0x3F) + 0x20
+
+        valid = computed_checksum == checksum
+        try:
+            label = self.decode_label(view[start:label_end], cache=valid)
+            if labels is not None and label not in labels and valid:
+                return label, None
+            value = str(view[value_start:end - 2], 'ascii')
+        except UnicodeDecodeError:
+            raise LinkyPyPacketError("Invalid line received: [%s]" % self.format_line(packet, start, end))
 
-        # Compute data through each declared callback
-        for callback in self.callbacks:
-            try:
-                callback.compute(data.copy(), timestamp)
-            except LinkyPyChecksumError:
-                logger.error("An error occured.", exc_info=True)
+        # If checksum is incorrect, raise error.
+        if not valid:
+            raise LinkyPyChecksumError("%12s = %-15s [invalid checksum '%s' != '%s']" % (label, value, chr(checksum), chr(computed_checksum)), label)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%12s = %-15s [checksum '%s' is OK]" % (label, value, chr(checksum)))
 
-        return data.copy()
+        return label, value
+
+    def decode_label(self, raw_label, cache=True):
+        """
+        Decode a label, known labels are only decoded once.
+
+        Labels of lines with an invalid checksum are not cached: line noise would grow the cache forever.
+        """
+        raw_label = bytes(raw_label)
+        try:
+            return self.labels[raw_label]
+        except KeyError:
+            label = str(raw_label, 'ascii')
+            if cache:
+                self.labels[raw_label] = label
+            return label
+
+    def format_line(self, packet, start, end):
+        return str(bytes(packet[start:end]), 'ascii', 'replace')
 
     def compute_line(self, line):
         """
@@ -91,23 +321,35 @@ class LinkyPyPacketReader(serial.threaded.Packetizer):
             en généralisation par Enedis <https://www.enedis.fr/sites/default/files/Enedis-NOI-CPT_54E.pdf>`_
 
         """
-        # Split line with spaces.
-        try:
-            key, value, checksum = re.split(' +', line)
-
-            # Fix checksum if it was a space. Not nice, will see later how to do better.
-            checksum = ' ' if checksum == '' else checksum
-
-            # Compute checksum following Enedis specifications.
-            computed_checksum = (sum(bytearray(key + ' ' + value, encoding='ascii')) & 0x3F) + 0x20
-        except Exception:
-            raise LinkyPyPacketError("Invalid line received: [%s]" % line)
-
-        # If checksum is incorrect, raise error.
-        if chr(computed_checksum) != checksum:
-            raise LinkyPyChecksumError("%12s = %-15s [invalid checksum '%s' != '%s']" % (key, value, checksum, chr(computed_checksum)))
-
-        logger.debug("%12s = %-15s [checksum '%s' is OK]" % (key, value, checksum))
-
-        # Return key and value if checksum is correct.
-        return key, value
+        if isinstance(line, str):
+            line = line.encode('ascii', 'replace')
+
+        return self.parse_line(line, 0, len(line))
+
+
+def run_threaded(port, protocol_factory=LinkyPyPacketReader):
+    """
+    Read ``port`` from a reader thread until it fails, or SIGTERM / SIGINT is received.
+
+    Reader thread is then closed, so that callbacks are stopped (and closed) by ``connection_lost``, and
+    sinks are closed: pending packets, points and rollups are written before exiting.
+    """
+    from linkypy.sinks import get_sinks
+
+    reader_thread = serial.threaded.ReaderThread(port, protocol_factory)
+
+    def stop(signum, frame):
+        logger.info("Received signal %d, stopping" % signum)
+        reader_thread.close()
+
+    handlers = dict((signum, signal.signal(signum, stop)) for signum in (signal.SIGTERM, signal.SIGINT))
+    try:
+        reader_thread.start()
+        # Signals are only handled by main thread, between joins.
+        while reader_thread.is_alive():
+            reader_thread.join(0.5)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        for sink in get_sinks():
+            sink.close()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import bz2
+import datetime
+import gzip
+import logging
+import lzma
+import mmap
+import os
+import tempfile
+import time
+
+from linkypy import CONF
+from linkypy.callbacks import get_callbacks
+from linkypy.reader.dispatcher import OVERFLOW_BLOCK, CallbackDispatcher
+from linkypy.reader.packet_reader import LinkyPyPacketReader
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+class CaptureReader(object):
+    """
+    Frames of a raw TIC capture: bytes as received on the serial port, each frame between STX and ETX.
+
+    A frame may be preceded by its reception time, as ``@<ISO 8601 timestamp>`` right before STX
+    (naive timestamps are UTC). Plain captures are memory-mapped, compressed ones (``.gz``, ``.bz2``,
+    ``.xz``) are decompressed by chunks.
+
+    Iterating yields ``(buffer, start, end, timestamp)`` tuples, where ``buffer[start:end]`` is a
+    frame as handled by :meth:`LinkyPyPacketReader.handle_packet`. Buffer is only valid until next frame.
+    """
+
+    STX = b'\x02'
+    ETX = b'\x03'
+    TIMESTAMP_MARK = b'@'
+
+    def __init__(self, path, chunk_size=1 << 20):
+
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        opener = COMPRESSIONS.get(os.path.splitext(self.path)[1].lower())
+        if opener is not None:
+            return self.read_compressed(opener)
+        return self.read_mapped()
+
+    def read_mapped(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield from self.split(buffer, 0)
+
+    def read_compressed(self, opener):
+        buffer = bytearray()
+        with opener(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    return
+                buffer.extend(chunk)
+                position = yield from self.split(buffer, 0)
+                del buffer[:position]
+
+    def split(self, buffer, position):
+        """
+        Yield complete frames of buffer from ``position``, return position of the first incomplete one.
+        """
+        while True:
+            end = buffer.find(self.ETX, position)
+            if end < 0:
+                return position
+
+            # Data before first STX is either a timestamp, or the end of a truncated frame.
+            start = buffer.find(self.STX, position, end)
+            if start >= 0:
+                yield buffer, start + 1, end, self.parse_timestamp(buffer[position:start])
+            position = end + 1
+
+    def parse_timestamp(self, prefix):
+        prefix = bytes(prefix).strip()
+        if not prefix.startswith(self.TIMESTAMP_MARK):
+            return None
+        try:
+            timestamp = datetime.datetime.fromisoformat(prefix[1:].decode('ascii'))
+        except ValueError:
+            logger.warning("Ignoring invalid frame timestamp: %r" % prefix)
+            return None
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return timestamp.isoformat()
+
+
+class Pacer(object):
+    """
+    Sleeps between frames to replay them at ``speed`` times their original pace: from their
+    timestamps when available, or from their transmission time at ``baudrate`` (7E1, 10 bits per byte).
+    """
+
+    def __init__(self, speed=1.0, baudrate=1200):
+
+        self.speed = float(speed)
+        self.baudrate = int(baudrate)
+        self.start = None
+        self.first = None
+        self.elapsed = 0.
+
+    def wait(self, size, timestamp):
+        if timestamp is not None:
+            current = datetime.datetime.fromisoformat(timestamp)
+            if self.first is None:
+                self.first = current
+            self.elapsed = (current - self.first).total_seconds()
+        else:
+            self.elapsed += size * 10. / self.baudrate
+
+        if self.start is None:
+            self.start = time.monotonic() - self.elapsed / self.speed
+        delay = self.start + self.elapsed / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Replay(object):
+    """
+    Pushes frames of a capture through packet reader and callbacks, as fast as possible or paced.
+
+    Every callback uses the 'block' overflow policy, so that no frame is dropped, and frames are
+    only read once every callback warmed up.
+
+    Callbacks keep their state (month start indexes, rollups in progress) in ``state_dir``, a temporary
+    directory by default: replayed frames must not overwrite state files of the running reader.
+    """
+
+    def __init__(self, path, realtime=False, speed=1.0, baudrate=1200, state_dir=None):
+
+        self.path = path
+        self.pacer = Pacer(speed, baudrate) if realtime else None
+        self.state_dir = state_dir
+
+    def dispatch_options(self):
+        options = dict(CONF.linkypy.get('dispatch', {}))
+        options['overflow'] = OVERFLOW_BLOCK
+        options['callbacks'] = dict((name, dict(overrides, overflow=OVERFLOW_BLOCK))
+                                    for name, overrides in (options.get('callbacks') or {}).items())
+        return options
+
+    def load_callbacks(self, state_dir):
+        # Callbacks read state directory when they are built.
+        previous = CONF.linkypy.get('state_dir')
+        CONF.linkypy['state_dir'] = state_dir
+        try:
+            return get_callbacks()
+        finally:
+            if previous is None:
+                CONF.linkypy.pop('state_dir', None)
+            else:
+                CONF.linkypy['state_dir'] = previous
+
+    def run(self):
+        if self.state_dir is not None:
+            return self.replay(self.state_dir)
+        with tempfile.TemporaryDirectory(prefix='linkypy-replay-') as state_dir:
+            return self.replay(state_dir)
+
+    def replay(self, state_dir):
+        from linkypy.sinks import get_sinks
+
+        reader = LinkyPyPacketReader()
+        reader.dispatcher = CallbackDispatcher(self.load_callbacks(state_dir), **self.dispatch_options())
+        reader.dispatcher.start()
+        reader.dispatcher.wait_ready()
+
+        logger.info("Replaying %s" % self.path)
+        start = time.monotonic()
+        count = 0
+        for buffer, frame_start, frame_end, timestamp in CaptureReader(self.path):
+            if self.pacer is not None:
+                self.pacer.wait(frame_end - frame_start + 2, timestamp)
+            reader.handle_packet(buffer, frame_start, frame_end, timestamp=timestamp)
+            count += 1
+
+        reader.dispatcher.join()
+        reader.dispatcher.stop()
+        for sink in get_sinks():
+            sink.close()
+
+        elapsed = time.monotonic() - start
+        logger.info("Replayed %d frames in %.1fs (%.0f frames/s)" % (count, elapsed, count / elapsed if elapsed else 0))
+        return count
@@ -0,0 +1,45 @@
+import logging
+import os
+import threading
+
+from linkypy import CONF
+
+logger = logging.getLogger(__name__)
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def get_sink(name='influxdb'):
+    """
+    Get the sink with given name, sinks are shared by every callback of the process.
+
+    Connection settings come from ``INFLUXDB_*`` environment variables, and may be overridden
+    in the ``sinks.<name>`` section of configuration file.
+    """
+    with _sinks_lock:
+        if name not in _sinks:
+            from linkypy.sinks.influxdb_sink import InfluxDBSink
+
+            options = {
+                'host': os.getenv('INFLUXDB_SERVICE_HOST', 'influxdb.local'),
+                'port': int(os.getenv('INFLUXDB_SERVICE_PORT', 8086)),
+                'database': os.getenv('INFLUXDB_DATABASE', 'linky'),
+                'username': os.getenv('INFLUXDB_USERNAME', 'admin'),
+                'password': os.getenv('INFLUXDB_PASSWORD', 'password'),
+                'writer': CONF.linkypy.get('influxdb', {}),
+            }
+            options.update(CONF.linkypy.get('sinks', {}).get(name, {}))
+
+            logger.info("Creating sink '%s' (InfluxDB %s:%s)" % (name, options['host'], options['port']))
+            _sinks[name] = InfluxDBSink(**options)
+
+        return _sinks[name]
+
+
+def get_sinks():
+    """
+    Get every sink created so far.
+    """
+    with _sinks_lock:
+        return list(_sinks.values())
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import gzip
+import json
+import logging
+from urllib.parse import urlencode
+
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from influxdb.line_protocol import make_lines
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncInfluxDBClient(object):
+    """
+    Minimal InfluxDB HTTP client for the asyncio engine: writes points over a single kept-alive
+    HTTP/1.1 connection, without blocking the event loop.
+    """
+
+    def __init__(self, host, port, database, username, password, use_gzip=True, timeout=30):
+
+        self.host = host
+        self.port = int(port)
+        self.database = database
+        self.username = username
+        self.password = password
+        self.use_gzip = use_gzip
+        self.timeout = timeout
+
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        return self.reader, self.writer
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+
+    async def read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by InfluxDB")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            content = b''.join(chunks)
+        else:
+            content = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        keep_alive = status_line.startswith(b'HTTP/1.1') or headers.get('connection', '').lower() == 'keep-alive'
+        if not keep_alive or headers.get('connection', '').lower() == 'close':
+            await self.close()
+
+        return status, content
+
+    async def request(self, method, path, params=None, body=b'', headers=None, expected=204):
+
+        target = path + ('?' + urlencode(params) if params else '')
+        head = ["%s %s HTTP/1.1" % (method, target),
+                "Host: %s:%d" % (self.host, self.port),
+                "Content-Length: %d" % len(body),
+                "Connection: keep-alive"]
+        head.extend("%s: %s" % item for item in (headers or {}).items())
+        data = ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+        async with self.lock:
+            # A kept-alive connection may have been closed by server meanwhile: retry once on a new one.
+            for attempt in range(2):
+                reader, writer = await self.connect()
+                try:
+                    writer.write(data)
+                    await writer.drain()
+                    status, content = await asyncio.wait_for(self.read_response(reader), self.timeout)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    await self.close()
+                    if attempt:
+                        raise
+                    logger.debug("InfluxDB connection was lost (%s), reconnecting" % e)
+                except Exception:
+                    await self.close()
+                    raise
+
+        if status == expected:
+            return content
+
+        error = content.decode('utf-8', 'replace')
+        try:
+            error = json.loads(error).get('error', error)
+        except ValueError:
+            pass
+        if 500 <= status < 600:
+            raise InfluxDBServerError(error)
+        raise InfluxDBClientError(error, status)
+
+    async def write_points(self, points, time_precision=None, retention_policy=None):
+        """
+        Write points, same as :meth:`influxdb.InfluxDBClient.write_points`.
+        """
+        params = {'db': self.database, 'u': self.username, 'p': self.password}
+        if time_precision:
+            params['precision'] = time_precision
+        if retention_policy:
+            params['rp'] = retention_policy
+
+        headers = {'Content-Type': 'application/octet-stream'}
+        body = make_lines({'points': points}, time_precision).encode('utf-8')
+        if self.use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            body = gzip.compress(body)
+
+        await self.request('POST', '/write', params, body, headers)
+        return True
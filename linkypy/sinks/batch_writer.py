@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from linkypy import metrics
+from linkypy.profiling import PROFILER
+from linkypy.sinks.spool import get_spool, is_rejected
+
+logger = logging.getLogger(__name__)
+
+BATCH_POINTS = metrics.histogram('linkypy_influxdb_batch_points', "Points of InfluxDB write requests.", buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+WRITE_DURATION = metrics.histogram('linkypy_influxdb_write_duration_seconds', "Duration of InfluxDB write requests.")
+WRITE_FAILURES = metrics.counter('linkypy_influxdb_write_failures_total', "Failed InfluxDB write requests.")
+POINTS_SPOOLED = metrics.counter('linkypy_influxdb_points_spooled_total', "Points stored in spool after a failed write.")
+POINTS_REJECTED = metrics.counter('linkypy_influxdb_points_rejected_total', "Points dropped as InfluxDB rejected them as invalid (400, 422).")
+
+
+class InfluxDBBatchWriter(object):
+    """
+    Buffers InfluxDB points and writes them in bulk from a background thread.
+
+    Points are flushed as soon as ``batch_size`` points are pending or ``flush_interval`` seconds
+    after the oldest pending point, whichever comes first. Remaining points are flushed on close.
+
+    When ``spool`` options are given, points that cannot be written are stored on disk and
+    replayed once InfluxDB is reachable again (see :class:`linkypy.sinks.spool.InfluxDBSpool`).
+    """
+
+    def __init__(self, client, batch_size=500, flush_interval=10, time_precision='s', spool=None):
+
+        self.client = client
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.time_precision = time_precision
+
+        self.spool = get_spool(**spool) if spool else None
+        if self.spool is not None:
+            self.spool.start(client, time_precision)
+
+        # Pending points by retention policy
+        self.batches = {}
+        self.pending = 0
+        self.deadline = None
+        self.closed = False
+        self.detached = False
+
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="InfluxDBBatchWriter", daemon=True)
+        self.thread.start()
+
+        atexit.register(self.close)
+
+    def write(self, points, retention_policy=None):
+        """
+        Queue points to be written into given retention policy.
+        """
+        if not points:
+            return
+
+        with self.condition:
+            self.batches.setdefault(retention_policy, []).extend(points)
+            self.pending += len(points)
+            # Writer thread sleeps without timeout until a deadline is set: wake it up to wait for it.
+            if self.deadline is None:
+                self.deadline = time.monotonic() + self.flush_interval
+                self.condition.notify()
+            elif self.pending >= self.batch_size:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self.detached and self.pending < self.batch_size:
+                    timeout = None if self.deadline is None else self.deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+                if self.closed or self.detached:
+                    return
+                batches = self.swap()
+            PROFILER.tick()
+            self.send(batches)
+
+    def due(self):
+        return self.pending >= self.batch_size or (self.deadline is not None and self.deadline <= time.monotonic())
+
+    def swap(self):
+        batches = self.batches
+        self.batches = {}
+        self.pending = 0
+        self.deadline = None
+        return batches
+
+    def send(self, batches):
+        for retention_policy, points in batches.items():
+            try:
+                logger.info("Writing %d InfluxDB points" % len(points))
+                start = time.perf_counter()
+                self.client.write_points(points, time_precision=self.time_precision, retention_policy=retention_policy)
+                self.written(points, start)
+            except Exception as e:
+                self.failed(points, retention_policy, e)
+
+    def written(self, points, start):
+        WRITE_DURATION.observe(time.perf_counter() - start)
+        BATCH_POINTS.observe(len(points))
+
+    def failed(self, points, retention_policy, error):
+        logger.error("An error occured while writing %d InfluxDB points: %s" % (len(points), error))
+        WRITE_FAILURES.inc()
+        if is_rejected(error):
+            # Points are invalid: retrying them would block the spool.
+            logger.error("InfluxDB rejected %d invalid points, they are dropped" % len(points))
+            POINTS_REJECTED.inc(amount=len(points))
+        elif self.spool is not None:
+            self.spool.append(points, retention_policy)
+            POINTS_SPOOLED.inc(amount=len(points))
+
+    def detach(self):
+        """
+        Stop background thread, pending points are kept to be flushed by :meth:`run_async`.
+        """
+        with self.condition:
+            self.detached = True
+            self.condition.notify()
+        self.thread.join()
+
+    async def run_async(self, write_points, poll_interval=0.5):
+        """
+        Flush points from an asyncio event loop, through given ``write_points`` coroutine function.
+        Background thread must have been stopped with :meth:`detach`.
+        """
+        while not self.closed:
+            await asyncio.sleep(min(poll_interval, self.flush_interval))
+            with self.condition:
+                batches = self.swap() if self.due() else {}
+
+            for retention_policy, points in batches.items():
+                try:
+                    logger.info("Writing %d InfluxDB points" % len(points))
+                    start = time.perf_counter()
+                    await write_points(points, time_precision=self.time_precision, retention_policy=retention_policy)
+                    self.written(points, start)
+                except Exception as e:
+                    self.failed(points, retention_policy, e)
+
+    def flush(self):
+        """
+        Write every pending point now.
+        """
+        with self.condition:
+            batches = self.swap()
+        self.send(batches)
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
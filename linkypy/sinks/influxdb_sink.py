@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import threading
+
+from influxdb import InfluxDBClient
+from linkypy.sinks.batch_writer import InfluxDBBatchWriter
+from linkypy.sinks.schema import InfluxDBSchema
+
+logger = logging.getLogger(__name__)
+
+
+class InfluxDBSink(object):
+    """
+    InfluxDB connection shared by every callback: a single pooled HTTP client, a single batch
+    writer (so that points of every callback are written in the same requests) and a single schema manager.
+    """
+
+    def __init__(self, host, port, database, username, password, pool_size=4, writer=None):
+
+        self.address = "%s:%s" % (host, port)
+        self.database = database
+        self.settings = (host, int(port), database, username, password)
+        self.client = InfluxDBClient(host, int(port), username, password, database,
+                                     retries=0, gzip=True, pool_size=int(pool_size))
+        self.writer = InfluxDBBatchWriter(self.client, **(writer or {}))
+        self.schema = InfluxDBSchema(self.client, database)
+
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def warm_up(self):
+        """
+        Connects to InfluxDB and creates database and retention policy, once.
+        """
+        with self.lock:
+            if self.ready:
+                return
+
+            logger.info("Connecting to InfluxDB %s ..." % self.address)
+            logger.info("Successfully connected to InfluxDB: " + self.client.ping())
+
+            self.schema.ensure_database()
+
+            # Retention policy
+            self.schema.ensure_retention_policy('linky_rp', '1w', 1, default=False)
+
+            self.ready = True
+
+    def write(self, points, retention_policy=None):
+        self.writer.write(points, retention_policy=retention_policy)
+
+    async def run_async(self):
+        """
+        Flush batches from the asyncio engine event loop, instead of batch writer thread.
+        """
+        from linkypy.sinks.async_http import AsyncInfluxDBClient
+
+        await asyncio.get_event_loop().run_in_executor(None, self.writer.detach)
+        client = AsyncInfluxDBClient(*self.settings)
+        try:
+            await self.writer.run_async(client.write_points)
+        finally:
+            await client.close()
+
+    def query(self, query):
+        return self.client.query(query)
+
+    def close(self):
+        self.writer.close()
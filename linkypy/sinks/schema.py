@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from influxdb.exceptions import InfluxDBClientError
+
+logger = logging.getLogger(__name__)
+
+
+class InfluxDBSchema(object):
+    """
+    Creates InfluxDB database, retention policies and continuous queries (or drops them), once per process.
+
+    Every statement is idempotent: existing objects are kept as is, and only replaced when
+    their definition changed.
+    """
+
+    def __init__(self, client, database):
+
+        self.client = client
+        self.database = database
+        self.done = set()
+        self.lock = threading.Lock()
+
+    def once(self, key, func):
+        with self.lock:
+            if key in self.done:
+                return
+            func()
+            self.done.add(key)
+
+    def ensure_database(self):
+        self.once(('database', self.database), lambda: self.client.create_database(self.database))
+
+    def ensure_retention_policy(self, name, duration, replication=1, default=False):
+
+        def create():
+            try:
+                self.client.create_retention_policy(name, duration, replication, database=self.database, default=default)
+            except InfluxDBClientError as e:
+                if 'already exists' not in str(e):
+                    raise
+                logger.info("Updating retention policy '%s' on database '%s'" % (name, self.database))
+                self.client.alter_retention_policy(name, database=self.database, duration=duration, replication=replication, default=default)
+
+        self.once(('retention_policy', name), create)
+
+    def ensure_continuous_query(self, name, select_clause, resample_opts=None):
+
+        def create():
+            try:
+                self.client.create_continuous_query(name, select_clause, self.database, resample_opts)
+            except InfluxDBClientError as e:
+                if 'already exists' not in str(e):
+                    raise
+                logger.info("Updating continuous query '%s' on database '%s'" % (name, self.database))
+                self.client.drop_continuous_query(name, self.database)
+                self.client.create_continuous_query(name, select_clause, self.database, resample_opts)
+
+        self.once(('continuous_query', name), create)
+
+    def drop_continuous_query(self, name):
+
+        def drop():
+            try:
+                self.client.drop_continuous_query(name, self.database)
+                logger.info("Dropped continuous query '%s' on database '%s'" % (name, self.database))
+            except InfluxDBClientError as e:
+                if 'not found' not in str(e):
+                    raise
+
+        self.once(('continuous_query', name), drop)
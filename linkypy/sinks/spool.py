@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from influxdb.exceptions import InfluxDBClientError
+
+logger = logging.getLogger(__name__)
+
+_spools = {}
+_spools_lock = threading.Lock()
+
+
+# Statuses of invalid points (bad line protocol, field type conflict...): writing them again would fail the same way.
+# Other client errors (missing database, authentication...) may be fixed on InfluxDB side, points are retried.
+REJECTED_STATUSES = (400, 422)
+
+
+def is_rejected(error):
+    """
+    Whether InfluxDB rejected written points as invalid.
+    """
+    return isinstance(error, InfluxDBClientError) and error.code is not None and int(error.code) in REJECTED_STATUSES
+
+
+def get_spool(path, **options):
+    """
+    Get the spool stored in given file, spools are shared by every writer of the process.
+    None when spool cannot be created: points are then written without spooling.
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    with _spools_lock:
+        if path not in _spools:
+            try:
+                _spools[path] = InfluxDBSpool(path, **options)
+            except (OSError, sqlite3.Error) as e:
+                logger.error("Cannot open InfluxDB spool %s, failed writes will not be spooled: %s" % (path, e))
+                return None
+        return _spools[path]
+
+
+class InfluxDBSpool(object):
+    """
+    On-disk SQLite (WAL) spool of InfluxDB points that could not be written.
+
+    Spooled points are replayed by chunks of ``replay_batch_size`` points, at most one chunk every
+    ``replay_interval`` seconds, and only ``retry_interval`` seconds after a failed write.
+    At most ``max_points`` points are kept, oldest ones are dropped first. Chunks rejected by InfluxDB
+    as invalid (400, 422) are moved to the ``rejected`` table instead of blocking the replay, it keeps
+    at most ``max_points`` points too.
+    """
+
+    def __init__(self, path, max_points=1000000, replay_batch_size=5000, replay_interval=1, retry_interval=30):
+
+        self.path = path
+        self.max_points = int(max_points)
+        self.replay_batch_size = int(replay_batch_size)
+        self.replay_interval = float(replay_interval)
+        self.retry_interval = float(retry_interval)
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS points (id INTEGER PRIMARY KEY AUTOINCREMENT, retention_policy TEXT, point TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS rejected (id INTEGER PRIMARY KEY AUTOINCREMENT, retention_policy TEXT, point TEXT NOT NULL, error TEXT)")
+
+        self.stopped = threading.Event()
+        self.thread = None
+        self.dropped = 0
+        self.replayed = 0
+        self.rejected = 0
+
+        count = len(self)
+        if count:
+            logger.warning("%d InfluxDB points waiting in spool %s" % (count, path))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM points").fetchone()[0]
+
+    def append(self, points, retention_policy=None):
+        """
+        Store points to be replayed later.
+        """
+        rows = [(retention_policy, json.dumps(point, separators=(',', ':'))) for point in points]
+        with self.lock:
+            with self.db:
+                self.db.executemany("INSERT INTO points (retention_policy, point) VALUES (?, ?)", rows)
+                count = self.db.execute("SELECT COUNT(*) FROM points").fetchone()[0]
+                overflow = count - self.max_points
+                if overflow > 0:
+                    self.db.execute("DELETE FROM points WHERE id IN (SELECT id FROM points ORDER BY id LIMIT ?)", (overflow,))
+                    self.dropped += overflow
+                    logger.warning("InfluxDB spool is full, %d oldest point(s) dropped" % overflow)
+
+        logger.warning("%d InfluxDB points spooled to %s" % (len(rows), self.path))
+
+    def peek(self, limit):
+        """
+        Return ``(last_id, {retention_policy: points})`` for the oldest spooled points.
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT id, retention_policy, point FROM points ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+        batches = {}
+        for _, retention_policy, point in rows:
+            batches.setdefault(retention_policy, []).append(json.loads(point))
+        return (rows[-1][0] if rows else None), batches
+
+    def remove(self, last_id):
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM points WHERE id <= ?", (last_id,))
+
+    def quarantine(self, points, retention_policy, error):
+        """
+        Keep points InfluxDB rejected aside, for inspection.
+        """
+        rows = [(retention_policy, json.dumps(point, separators=(',', ':')), str(error)) for point in points]
+        with self.lock:
+            with self.db:
+                self.db.executemany("INSERT INTO rejected (retention_policy, point, error) VALUES (?, ?, ?)", rows)
+                count = self.db.execute("SELECT COUNT(*) FROM rejected").fetchone()[0]
+                overflow = count - self.max_points
+                if overflow > 0:
+                    self.db.execute("DELETE FROM rejected WHERE id IN (SELECT id FROM rejected ORDER BY id LIMIT ?)", (overflow,))
+        self.rejected += len(rows)
+        logger.error("InfluxDB rejected %d spooled points, moved to rejected table of %s: %s" % (len(rows), self.path, error))
+
+    def start(self, client, time_precision='s'):
+        """
+        Start replaying spooled points in the background.
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, args=(client, time_precision), name="InfluxDBSpool", daemon=True)
+        self.thread.start()
+
+    def replay(self, client, time_precision='s'):
+        """
+        Replay one chunk of spooled points, returns number of points written.
+        """
+        last_id, batches = self.peek(self.replay_batch_size)
+        if last_id is None:
+            return 0
+
+        count = 0
+        for retention_policy, points in batches.items():
+            try:
+                client.write_points(points, time_precision=time_precision, retention_policy=retention_policy)
+                count += len(points)
+            except Exception as e:
+                if not is_rejected(e):
+                    raise
+                self.quarantine(points, retention_policy, e)
+
+        self.remove(last_id)
+        self.replayed += count
+        logger.info("Replayed %d spooled InfluxDB points" % count)
+        return count
+
+    def run(self, client, time_precision):
+        wait = self.replay_interval
+        while not self.stopped.wait(wait):
+            try:
+                self.replay(client, time_precision)
+                wait = self.replay_interval
+            except Exception as e:
+                logger.warning("InfluxDB is still unreachable, retrying spool replay in %ds: %s" % (self.retry_interval, e))
+                wait = self.retry_interval
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
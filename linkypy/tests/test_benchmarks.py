@@ -0,0 +1,48 @@
+import unittest
+
+from linkypy.benchmarks import runner
+from linkypy.benchmarks.frames import FrameGenerator
+from linkypy.reader.packet_reader import LinkyPyPacketReader
+
+
+class TestBenchmarks(unittest.TestCase):
+    """
+    Benchmark suite unittests.
+    """
+
+    def test_001_frame_generator(self):
+        """
+        Testing synthetic frames of both TIC modes have valid checksums
+        """
+        for mode, labels in (('historic', 11), ('standard', 23)):
+            reader = LinkyPyPacketReader()
+            for frame in FrameGenerator(mode).frames(5):
+                for start, end in reader.iter_lines(frame, 1, len(frame) - 1):
+                    reader.parse_line(frame, start, end)
+                self.assertEqual(len(reader.handle_packet(bytearray(frame), 1, len(frame) - 1)), labels)
+
+    def test_002_end_to_end(self):
+        """
+        Testing end-to-end benchmark writes a point per frame to InfluxDB stand-in
+        """
+        result = runner.bench_end_to_end(20)
+        self.assertEqual(result['points'], 20)
+        self.assertEqual(set(result['latency_ms']), {'parse', 'dispatch', 'compute', 'flush'})
+
+    def test_003_compare(self):
+        """
+        Testing regressions against baseline
+        """
+        baseline = {'handle_packet.historic': {'frames_per_s': 1000, 'peak_rss_kb': 1000, 'latency_ms': {}}}
+        self.assertEqual(runner.compare({'handle_packet.historic': {'frames_per_s': 800, 'peak_rss_kb': 1200}}, baseline), [])
+        regressions = runner.compare({'handle_packet.historic': {'frames_per_s': 700, 'peak_rss_kb': 1300}}, baseline)
+        self.assertEqual(len(regressions), 2)
+
+    def test_004_isolated_benchmarks(self):
+        """
+        Testing benchmarks run in child processes, each reporting its own peak RSS
+        """
+        results = runner.run_benchmarks(20, ('historic',))
+        self.assertEqual(set(results), {'compute_line.historic', 'handle_packet.historic', 'end_to_end.historic'})
+        for result in results.values():
+            self.assertGreater(result['peak_rss_kb'], 0)
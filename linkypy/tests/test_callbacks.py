@@ -0,0 +1,232 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pytz
+from linkypy.callbacks.month_start import MonthStartIndex, MonthWindow
+from linkypy.callbacks.price_matrix import PriceMatrix
+from linkypy.callbacks.prices_callback import PricesCallback
+from linkypy.callbacks.rollups import Rollup
+
+
+class TestMonthStartIndex(unittest.TestCase):
+    """
+    Month start indexes unittests.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'month-start.json')
+        self.window = MonthWindow('Europe/Paris')
+        self.queries = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fallback(self, first_of_month):
+        self.queries.append(first_of_month)
+        return 100, 50
+
+    def at(self, *args):
+        return self.window.tz.localize(datetime.datetime(*args))
+
+    def test_001_month_window(self):
+        """
+        Testing month boundaries in local timezone
+        """
+        self.window.update(self.at(2020, 11, 21, 12, 0))
+        self.assertEqual(self.window.key, '2020-11')
+        self.assertEqual(self.window.start_utc, '2020-10-31T23:00:00+00:00')
+        self.assertEqual(self.window.end, self.at(2020, 12, 1))
+
+        # Last hour of month in local time is still the same month.
+        self.window.update(datetime.datetime(2020, 11, 30, 23, 30, tzinfo=pytz.utc))
+        self.assertEqual(self.window.key, '2020-12')
+
+    def test_002_cold_start_and_rollover(self):
+        """
+        Testing InfluxDB is only queried on cold start, then indexes are tracked from packets
+        """
+        index = MonthStartIndex(self.path, fallback=self.fallback)
+        self.window.update(self.at(2020, 11, 21, 12, 0))
+        self.assertEqual(index.get(self.window, 200, 80), (100, 50))
+        self.assertEqual(index.get(self.window, 210, 80), (100, 50))
+        self.assertEqual(len(self.queries), 1)
+
+        self.window.update(self.at(2020, 12, 1, 0, 0, 1))
+        self.assertEqual(index.get(self.window, 300, 90), (300, 90))
+        self.assertEqual(len(self.queries), 1)
+
+        # State file is used on restart.
+        index = MonthStartIndex(self.path, fallback=self.fallback)
+        self.assertEqual(index.get(self.window, 400, 95), (300, 90))
+        self.assertEqual(len(self.queries), 1)
+
+    def test_003_legacy_state_file(self):
+        """
+        Testing state file of versions without meters is used until meter state file exists
+        """
+        self.window.update(self.at(2020, 11, 21, 12, 0))
+        index = MonthStartIndex(self.path, fallback=self.fallback)
+        self.assertEqual(index.get(self.window, 200, 80), (100, 50))
+
+        path = os.path.join(self.directory.name, 'month-start-A.json')
+        index = MonthStartIndex(path, fallback=self.fallback, legacy_path=self.path)
+        self.assertEqual(index.get(self.window, 210, 80), (100, 50))
+        self.assertEqual(len(self.queries), 1)
+        self.assertTrue(os.path.exists(path))
+
+    def test_004_first_hphc_without_meter_tag(self):
+        """
+        Testing first HP/HC are queried without meter filter when no point is tagged with meter
+        """
+        class Results(object):
+
+            def __init__(self, points):
+                self.points = points
+
+            def get_points(self):
+                return iter(self.points)
+
+        queries = []
+
+        def query(query):
+            queries.append(query)
+            return Results([] if 'meter' in query else [{'first_hp': 100, 'first_hc': 50}])
+
+        with mock.patch('linkypy.callbacks.prices_callback.get_sink') as get_sink:
+            get_sink.return_value.query.side_effect = query
+            callback = PricesCallback()
+            self.assertEqual(callback.get_first_hphc('2020-10-31T23:00:00+00:00', meter='A'), (100, 50))
+            self.assertEqual(len(queries), 2)
+
+            get_sink.return_value.query.side_effect = lambda query: Results([])
+            self.assertEqual(callback.get_first_hphc('2020-10-31T23:00:00+00:00', meter='A'), (None, None))
+
+
+class FakePriceExtractor(object):
+
+    provider_name = "Fake"
+
+    def get_available_offers_names(self):
+        return ['fake']
+
+    def get_available_offers_types(self):
+        return ('BASE', 'HPHC')
+
+    def get_prices(self, offer_name, offer_type, power):
+        if offer_type == 'BASE':
+            return {'MONTHLY_SUBSCRIPTION_PRICE': 10., 'HP_KWH_PRICE': 0.2, 'HC_KWH_PRICE': 0.}
+        return {'MONTHLY_SUBSCRIPTION_PRICE': 12., 'HP_KWH_PRICE': 0.25, 'HC_KWH_PRICE': 0.1}
+
+
+class TestPriceMatrix(unittest.TestCase):
+    """
+    Price matrix unittests.
+    """
+
+    def test_001_costs(self):
+        """
+        Testing costs of BASE and HPHC offers
+        """
+        matrix = PriceMatrix.build([FakePriceExtractor()], 9)
+        self.assertEqual([offer['offer_type'] for offer in matrix.offers], ['BASE', 'HPHC'])
+
+        # 10 days elapsed, 20 days remaining
+        current, estimated = matrix.costs(100., 50., 10., 20.)
+        self.assertEqual(current.tolist(), [40., 42.])
+        self.assertEqual(estimated.tolist(), [100., 102.])
+
+        # Start of month
+        current, estimated = matrix.costs(0., 0., 0., 30.)
+        self.assertEqual(estimated.tolist(), [10., 12.])
+
+
+class TestRollup(unittest.TestCase):
+    """
+    In-process rollups unittests.
+    """
+
+    def test_001_closed_buckets(self):
+        """
+        Testing buckets are aggregated incrementally, and written once closed
+        """
+        rollup = Rollup('linky_mean', [('PAPP', 'mean', 'PAPP'), ('PAPP_MAX', 'max', 'PAPP'), ('HCHP_FIRST', 'first', 'HCHP'), ('HCHP', 'last', 'HCHP')])
+        start = 1605960000
+        self.assertEqual(rollup.add(start, {'PAPP': 500, 'HCHP': 10}, {'meter': 'A'}), [])
+        self.assertEqual(rollup.add(start + 30, {'PAPP': 700, 'HCHP': 12}, {'meter': 'A'}), [])
+        self.assertEqual(rollup.add(start + 30, {'PAPP': 100, 'HCHP': 1}, {'meter': 'B'}), [])
+
+        # Every bucket of previous minute is closed, including the one of meter B.
+        points = rollup.add(start + 60, {'PAPP': 300, 'HCHP': 13}, {'meter': 'A'})
+        self.assertEqual(points, [{
+            'measurement': 'linky_mean_1m',
+            'tags': {'meter': 'A'},
+            'time': '2020-11-21T12:00:00',
+            'fields': {'PAPP': 600., 'PAPP_MAX': 700, 'HCHP_FIRST': 10, 'HCHP': 12},
+        }, {
+            'measurement': 'linky_mean_1m',
+            'tags': {'meter': 'B'},
+            'time': '2020-11-21T12:00:00',
+            'fields': {'PAPP': 100., 'PAPP_MAX': 100, 'HCHP_FIRST': 1, 'HCHP': 1},
+        }])
+
+        # Late packet of a closed bucket is not rolled up.
+        self.assertEqual(rollup.add(start + 59, {'PAPP': 100, 'HCHP': 1}, {'meter': 'B'}), [])
+
+        points = rollup.add(start + 3600, {'PAPP': 400}, {'meter': 'A'})
+        self.assertEqual([(point['measurement'], point['tags']['meter']) for point in points], [('linky_mean_1m', 'A'), ('linky_mean', 'A'), ('linky_mean', 'B')])
+        self.assertEqual(points[1]['fields'], {'PAPP': 500., 'PAPP_MAX': 700, 'HCHP_FIRST': 10, 'HCHP': 13})
+
+        with self.assertRaises(ValueError):
+            Rollup('linky_mean', [('PAPP', 'median', 'PAPP')])
+
+    def test_002_series_tags(self):
+        """
+        Testing buckets are kept by series tags only, values changing within series are rolled up as fields
+        """
+        rollup = Rollup('prices_mean', [('CURRENT_COST', 'last', 'CURRENT_COST'), ('month_number', 'last', 'month_number')], resolutions=((60, '_1m'),), tags=('meter', 'offer_name'))
+        start = 1606780740
+        rollup.add(start, {'CURRENT_COST': 10., 'month_number': 11}, {'meter': 'A', 'offer_name': 'fake', 'month_number': 11})
+        rollup.add(start + 30, {'CURRENT_COST': 0.1, 'month_number': 12}, {'meter': 'A', 'offer_name': 'fake', 'month_number': 12})
+        self.assertEqual(len(rollup.buckets), 1)
+
+        points = rollup.add(start + 60, {'CURRENT_COST': 0.2, 'month_number': 12}, {'meter': 'A', 'offer_name': 'fake', 'month_number': 12})
+        self.assertEqual(points, [{
+            'measurement': 'prices_mean_1m',
+            'tags': {'meter': 'A', 'offer_name': 'fake'},
+            'time': '2020-11-30T23:59:00',
+            'fields': {'CURRENT_COST': 0.1, 'month_number': 12},
+        }])
+
+    def test_003_local_days(self):
+        """
+        Testing daily buckets start at local midnight
+        """
+        rollup = Rollup('linky_mean', [('PAPP', 'mean', 'PAPP')], resolutions=((86400, '_1d'),), timezone='Europe/Paris')
+        # 2020-11-21 23:30 and 2020-11-22 00:30 in Paris.
+        rollup.add(1605997800, {'PAPP': 100}, {})
+        points = rollup.add(1606001400, {'PAPP': 300}, {})
+        self.assertEqual(points, [{'measurement': 'linky_mean_1d', 'tags': {}, 'time': '2020-11-20T23:00:00', 'fields': {'PAPP': 100.}}])
+
+    def test_004_flush_and_resume(self):
+        """
+        Testing open buckets are written on flush, and resumed on restart
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rollup-linky_mean.json')
+            aggregations = [('PAPP', 'mean', 'PAPP')]
+            start = 1605960000
+
+            rollup = Rollup('linky_mean', aggregations, resolutions=((60, '_1m'),), tags=('meter',), path=path)
+            rollup.add(start, {'PAPP': 100}, {'meter': 'A'})
+            self.assertEqual(rollup.flush(), [{'measurement': 'linky_mean_1m', 'tags': {'meter': 'A'}, 'time': '2020-11-21T12:00:00', 'fields': {'PAPP': 100.}}])
+            self.assertEqual(rollup.buckets, {})
+
+            # Bucket written on flush is completed, instead of being overwritten by a partial one.
+            rollup = Rollup('linky_mean', aggregations, resolutions=((60, '_1m'),), tags=('meter',), path=path)
+            rollup.add(start + 30, {'PAPP': 300}, {'meter': 'A'})
+            points = rollup.add(start + 60, {'PAPP': 500}, {'meter': 'A'})
+            self.assertEqual(points, [{'measurement': 'linky_mean_1m', 'tags': {'meter': 'A'}, 'time': '2020-11-21T12:00:00', 'fields': {'PAPP': 200.}}])
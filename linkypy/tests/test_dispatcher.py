@@ -0,0 +1,354 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from linkypy import sinks
+from linkypy.profiling import PROFILER
+from linkypy.reader.dispatcher import CallbackDispatcher, callback_name
+from linkypy.tracing import TRACER
+
+
+class BlockedCallback(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.started = threading.Event()
+        self.received = []
+
+    def compute(self, data, timestamp):
+        self.started.set()
+        self.event.wait(5)
+        self.received.append(data['HCHP'])
+
+
+class MeterCallback(BlockedCallback):
+
+    def __init__(self):
+        super(MeterCallback, self).__init__()
+        self.meters = []
+
+    def compute(self, data, timestamp, meter=None):
+        self.meters.append(meter)
+        super(MeterCallback, self).compute(data, timestamp)
+
+
+class TestCallbackDispatcher(unittest.TestCase):
+    """
+    Callback dispatcher unittests.
+    """
+
+    def dispatch(self, overflow):
+        callback = BlockedCallback()
+        dispatcher = CallbackDispatcher([callback], queue_size=2, overflow=overflow)
+        dispatcher.start()
+
+        # First packet keeps the worker busy, next ones overflow the queue.
+        dispatcher.dispatch({'HCHP': 0}, None)
+        callback.started.wait(5)
+        for i in range(1, 6):
+            dispatcher.dispatch({'HCHP': i}, None)
+
+        callback.event.set()
+        dispatcher.join()
+        dispatcher.stop()
+        return callback.received, dispatcher.stats()
+
+    def test_001_drop_oldest(self):
+        """
+        Testing oldest packets are dropped on overflow
+        """
+        received, stats = self.dispatch('drop_oldest')
+        self.assertEqual(received, [0, 4, 5])
+        self.assertEqual(list(stats.values())[0]['dropped'], 3)
+
+    def test_002_coalesce(self):
+        """
+        Testing only latest packet is kept on overflow
+        """
+        received, stats = self.dispatch('coalesce')
+        self.assertEqual(received, [0, 5])
+
+    def test_003_unknown_policy(self):
+        """
+        Testing unknown overflow policy
+        """
+        with self.assertRaises(ValueError):
+            CallbackDispatcher([BlockedCallback()], overflow='unknown')
+
+    def test_004_warm_up(self):
+        """
+        Testing packets are buffered until callback warm-up succeeds
+        """
+        callback = BlockedCallback()
+        callback.event.set()
+        attempts = []
+
+        def warm_up():
+            attempts.append(callback.received[:])
+            if len(attempts) == 1:
+                raise Exception("InfluxDB is not reachable")
+
+        callback.warm_up = warm_up
+        dispatcher = CallbackDispatcher([callback], queue_size=4)
+        dispatcher.dispatch({'HCHP': 1}, None)
+        dispatcher.start()
+        dispatcher.dispatch({'HCHP': 2}, None)
+        dispatcher.join()
+        dispatcher.stop()
+
+        self.assertEqual(attempts, [[], []])
+        self.assertEqual(callback.received, [1, 2])
+
+    def test_005_coalesce_meters(self):
+        """
+        Testing latest packet of each meter is kept when coalescing
+        """
+        callback = MeterCallback()
+        dispatcher = CallbackDispatcher([callback], queue_size=4, overflow='coalesce')
+        dispatcher.start()
+
+        dispatcher.dispatch({'HCHP': 0}, None, 'A')
+        callback.started.wait(5)
+        for i in range(1, 7):
+            dispatcher.dispatch({'HCHP': i}, None, 'AB'[i % 2])
+
+        callback.event.set()
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(list(zip(callback.meters, callback.received)), [('A', 0), ('B', 5), ('A', 6)])
+
+    def test_006_declared_labels(self):
+        """
+        Testing only declared labels are decoded, and packets without changes are skipped
+        """
+        from linkypy.reader.packet_reader import LinkyPyPacketReader
+        from linkypy.tests.test_pylinky import GOOD_PACKET
+
+        callback = MeterCallback()
+        callback.LABELS = ('HCHP',)
+        callback.event.set()
+        dispatcher = CallbackDispatcher([callback], overflow='block')
+        dispatcher.start()
+        for data, meter in (({'HCHP': 1}, 'A'), ({'HCHP': 1}, 'A'), ({'HCHP': 1}, 'B'), ({'PAPP': 3}, 'A'), ({'HCHP': 2, 'PAPP': 3}, 'A')):
+            dispatcher.dispatch(data, None, meter)
+
+        reader = LinkyPyPacketReader()
+        reader.dispatcher = dispatcher
+        frame = reader.handle_packet(GOOD_PACKET)
+        dispatcher.join()
+        dispatcher.stop()
+
+        self.assertEqual(dict(frame), {'ADCO': '012345678901', 'HCHP': 1262798})
+        self.assertEqual(list(zip(callback.meters, callback.received)), [('A', 1), ('B', 1), ('A', 2), ('012345678901', 1262798)])
+        self.assertEqual(dispatcher.stats()[callback_name(callback)]['skipped'], 2)
+
+    def test_007_unchanged_after_drop(self):
+        """
+        Testing a dropped packet does not count as received when skipping unchanged packets
+        """
+        callback = MeterCallback()
+        callback.LABELS = ('HCHP',)
+        dispatcher = CallbackDispatcher([callback], queue_size=1, overflow='drop_oldest')
+        dispatcher.start()
+        dispatcher.dispatch({'HCHP': 0}, None, 'A')
+        callback.started.wait(5)
+        # Packet of meter A is dropped for packet of meter B, same packet of meter A is then still handed to callback.
+        for data, meter in (({'HCHP': 1}, 'A'), ({'HCHP': 5}, 'B'), ({'HCHP': 1}, 'A')):
+            dispatcher.dispatch(data, None, meter)
+        callback.event.set()
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(list(zip(callback.meters, callback.received)), [('A', 0), ('A', 1)])
+
+    def test_008_stop_hanging_callback(self):
+        """
+        Testing stop returns within timeout overall when callbacks hang with a full queue, without closing them
+        """
+        callbacks = [BlockedCallback() for _ in range(3)]
+        closed = []
+        for callback in callbacks:
+            callback.close = lambda: closed.append(True)
+        dispatcher = CallbackDispatcher(callbacks, queue_size=1, overflow='block')
+        dispatcher.start()
+        dispatcher.dispatch({'HCHP': 0}, None)
+        for callback in callbacks:
+            callback.started.wait(5)
+        dispatcher.dispatch({'HCHP': 1}, None)
+
+        start = time.monotonic()
+        dispatcher.stop(timeout=0.5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(closed, [])
+        for callback in callbacks:
+            callback.event.set()
+
+    def test_009_thread_safety(self):
+        """
+        Testing several workers are only allowed for thread-safe callbacks
+        """
+        with self.assertRaises(ValueError):
+            CallbackDispatcher([BlockedCallback()], workers=2)
+
+        callback = BlockedCallback()
+        callback.THREAD_SAFE = True
+        self.assertEqual(CallbackDispatcher([callback], workers=2).workers[0].workers, 2)
+
+    def test_010_close(self):
+        """
+        Testing callback is closed once pending packets are computed
+        """
+        callback = BlockedCallback()
+        callback.close = lambda: callback.received.append('closed')
+        callback.event.set()
+        dispatcher = CallbackDispatcher([callback])
+        dispatcher.start()
+        dispatcher.dispatch({'HCHP': 0}, None)
+        dispatcher.stop()
+        self.assertEqual(callback.received, [0, 'closed'])
+
+
+class TestAsyncEngine(unittest.TestCase):
+    """
+    Asyncio engine unittests.
+    """
+
+    def test_001_read_loop(self):
+        """
+        Testing packets read from a loop:// port reach synchronous and asynchronous callbacks
+        """
+        from linkypy.prices_extractors import registry
+        from linkypy.reader.async_engine import AsyncEngine
+        from linkypy.reader.packet_reader import open_serial
+        from linkypy.tests.test_pylinky import GOOD_PACKET
+
+        received = []
+
+        class SyncCallback(object):
+
+            def compute(self, data, timestamp, meter=None):
+                received.append(('sync', meter, threading.current_thread() is not threading.main_thread()))
+
+        class AsyncCallback(object):
+
+            async def compute_async(self, data, timestamp):
+                received.append(('async', data['HCHP'], threading.current_thread() is threading.main_thread()))
+
+        class LoopEngine(AsyncEngine):
+
+            def open(self, url):
+                port = open_serial(url, timeout=0)
+                port.write(b"\x02\n" + bytes(GOOD_PACKET) + b"\x03\x02\n" + bytes(GOOD_PACKET) + b"\x03\x02")
+                return port
+
+        engine = LoopEngine(['loop://'], poll_interval=0.01)
+
+        async def stop_when_done():
+            while len(received) < 4:
+                await asyncio.sleep(0.01)
+            engine.stop()
+
+        async def main():
+            asyncio.ensure_future(stop_when_done())
+            await asyncio.wait_for(engine.main(), 5)
+
+        with mock.patch('linkypy.reader.async_engine.get_callbacks', return_value=[SyncCallback(), AsyncCallback()]), \
+                mock.patch.object(registry, '_registry', registry.PriceRegistry()), mock.patch.object(sinks, '_sinks', {}):
+            asyncio.run(main())
+
+        self.assertEqual(sorted(received), [('async', 1262798, True)] * 2 + [('sync', '012345678901', True)] * 2)
+
+
+class TestTracing(unittest.TestCase):
+    """
+    Frames tracing and watchdog unittests.
+    """
+
+    def tearDown(self):
+        TRACER.configure()
+
+    def test_001_slowest_frames(self):
+        """
+        Testing frames are traced through parsing and callbacks
+        """
+        from linkypy.reader.packet_reader import LinkyPyPacketReader
+        from linkypy.tests.test_pylinky import GOOD_PACKET
+
+        TRACER.configure(enabled=True, slowest=2)
+        callbacks = [BlockedCallback(), MeterCallback()]
+        for callback in callbacks:
+            callback.event.set()
+        reader = LinkyPyPacketReader()
+        reader.dispatcher = CallbackDispatcher(callbacks, queue_size=1, overflow='coalesce')
+        reader.dispatcher.start()
+        for _ in range(3):
+            reader.handle_packet(GOOD_PACKET)
+        reader.dispatcher.join()
+        reader.dispatcher.stop()
+
+        self.assertEqual(len(TRACER.recent), 3)
+        self.assertEqual(len(TRACER.slowest_frames()), 2)
+        names = set(name for trace in TRACER.recent for name, _, _ in trace.spans)
+        self.assertTrue({'parse', 'linkypy.tests.test_dispatcher.BlockedCallback', 'wait:linkypy.tests.test_dispatcher.MeterCallback'} <= names)
+        self.assertIn("meter=012345678901", TRACER.format())
+
+    def test_002_watchdog(self):
+        """
+        Testing watchdog logs stack of callbacks over budget, once
+        """
+        TRACER.configure(budget=0.01)
+        callback = BlockedCallback()
+        dispatcher = CallbackDispatcher([callback])
+        dispatcher.start()
+        dispatcher.dispatch({'HCHP': 0}, None)
+        callback.started.wait(5)
+        time.sleep(0.05)
+
+        with self.assertLogs('linkypy.tracing', 'WARNING') as logs:
+            TRACER.check()
+            TRACER.check()
+        callback.event.set()
+        dispatcher.join()
+        dispatcher.stop()
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("in compute", logs.output[0])
+
+
+class TestProfiling(unittest.TestCase):
+    """
+    Reader loop profiling unittests.
+    """
+
+    def tearDown(self):
+        PROFILER.stop()
+        PROFILER.enabled = False
+
+    def test_001_frames_window(self):
+        """
+        Testing reader and callback threads write their profile once window is closed
+        """
+        from linkypy.reader.packet_reader import LinkyPyPacketReader
+        from linkypy.tests.test_pylinky import GOOD_PACKET
+
+        with tempfile.TemporaryDirectory() as directory:
+            PROFILER.configure(directory, frames=3)
+            PROFILER.start()
+            callback = MeterCallback()
+            callback.event.set()
+            reader = LinkyPyPacketReader()
+            reader.dispatcher = CallbackDispatcher([callback], overflow='block')
+            reader.dispatcher.start()
+            for _ in range(4):
+                reader.handle_packet(GOOD_PACKET)
+                reader.dispatcher.join()
+            reader.dispatcher.stop()
+
+            self.assertFalse(PROFILER.active)
+            prefix = os.path.join(directory, "linkypy-%04d" % PROFILER.session)
+            self.assertTrue(os.path.exists(prefix + '.snapshot'))
+            self.assertTrue(os.path.exists("%s-%s.prof" % (prefix, threading.current_thread().name)))
+            self.assertTrue(os.path.exists(prefix + '-MeterCallback-0.prof'))
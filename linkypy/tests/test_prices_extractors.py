@@ -0,0 +1,133 @@
+import hashlib
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from linkypy.benchmarks.http_stub import HTTPStub
+from linkypy.prices_extractors import base, cache, registry
+from linkypy.prices_extractors.base import BasePriceExtractor
+from linkypy.prices_extractors.isolation import LinkyPyExtractionError, LinkyPyExtractionTimeout, run_isolated
+
+
+class PDFStub(HTTPStub):
+
+    content = b'%PDF-1.4 prices'
+
+    def respond(self, handler):
+        etag = '"%s"' % hashlib.md5(self.content).hexdigest()
+        if handler.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'Content-Type': 'application/pdf', 'ETag': etag}, self.content
+
+
+class FakePriceExtractor(BasePriceExtractor):
+
+    provider_name = "Fake"
+    parsed = []
+
+    def parse_pdf(self, path):
+        with open(path, 'rb') as f:
+            self.parsed.append(f.read())
+        return {'BASE': {9: [10., 0.2, 0.2]}, 'HPHC': {9: [12., 0.25, 0.1]}}
+
+
+class TestPricesCache(unittest.TestCase):
+    """
+    Prices extractors cache unittests.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'prices-cache.json')
+        FakePriceExtractor.parsed = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def extractor(self):
+        with mock.patch.object(cache, '_cache', cache.PricesCache(self.path)), mock.patch.object(registry, '_registry', registry.PriceRegistry()):
+            return FakePriceExtractor()
+
+    def refresh(self, extractor):
+        # Parse in this process to record parsed PDFs.
+        with mock.patch.object(base, 'run_isolated', lambda func, args, **kwargs: func(*args)):
+            extractor.registry.refresh()
+
+    def test_001_parsed_once(self):
+        """
+        Testing PDF is only downloaded and parsed again when changed
+        """
+        with PDFStub() as stub:
+            FakePriceExtractor.PDFS = {'fake': 'http://127.0.0.1:%d/prices.pdf' % stub.port}
+
+            # Fallback prices are used until prices are loaded.
+            extractor = self.extractor()
+            self.assertEqual(extractor.get_prices('fake', 'HPHC', 9), extractor.fallback_prices)
+            self.refresh(extractor)
+            self.assertEqual(extractor.get_prices('fake', 'HPHC', 9)['HC_KWH_PRICE'], 0.1)
+            self.assertEqual(FakePriceExtractor.parsed, [stub.content])
+
+            # Cached prices are served from disk without any download.
+            extractor = self.extractor()
+            self.assertEqual(extractor.get_prices('fake', 'BASE', 9)['MONTHLY_SUBSCRIPTION_PRICE'], 10.)
+            self.assertEqual(len(stub.requests), 1)
+
+            # Unmodified PDF is neither downloaded nor parsed again.
+            self.refresh(extractor)
+            self.assertEqual(len(stub.requests), 2)
+            self.assertIn('If-None-Match', stub.requests[1][2])
+            self.assertEqual(len(FakePriceExtractor.parsed), 1)
+
+            stub.content = b'%PDF-1.4 new prices'
+            self.refresh(extractor)
+            self.assertEqual(FakePriceExtractor.parsed, [PDFStub.content, stub.content])
+
+    def test_002_refresh_failure(self):
+        """
+        Testing last known prices are kept when refresh fails
+        """
+        with PDFStub() as stub:
+            FakePriceExtractor.PDFS = {'fake': 'http://127.0.0.1:%d/prices.pdf' % stub.port}
+            extractor = self.extractor()
+            self.refresh(extractor)
+
+        # Server is gone
+        self.refresh(extractor)
+        self.assertEqual(extractor.get_prices('fake', 'HPHC', 9)['HC_KWH_PRICE'], 0.1)
+        status = extractor.registry.status()[0]
+        self.assertEqual(status['status'], 'error')
+        self.assertGreater(status['next_refresh'], status['updated'])
+
+
+def slow_job(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def crashing_job():
+    os._exit(3)
+
+
+class TestIsolation(unittest.TestCase):
+    """
+    Process isolated extraction unittests.
+    """
+
+    def test_001_result(self):
+        """
+        Testing result and errors are returned from child process
+        """
+        self.assertEqual(run_isolated(slow_job, (0,)), 0)
+        with self.assertRaises(LinkyPyExtractionError):
+            run_isolated(slow_job, ('not a number',))
+
+    def test_002_timeout_and_crash(self):
+        """
+        Testing hanging or crashing child process
+        """
+        with self.assertRaises(LinkyPyExtractionTimeout):
+            run_isolated(slow_job, (30,), timeout=1)
+        with self.assertRaises(LinkyPyExtractionError):
+            run_isolated(crashing_job)
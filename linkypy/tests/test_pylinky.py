@@ -1,7 +1,16 @@
+import gzip
+import os
+import tempfile
 import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
 
-from linkypy.reader.packet_reader import LinkyPyChecksumError, LinkyPyPacketReader
-from linkypy import CONF
+from linkypy.history import HISTORY
+from linkypy.reader.changes import ChangeDetector
+from linkypy.reader.packet_reader import CHECKSUM_ERRORS, FRAMES_REJECTED, LinkyPyChecksumError, LinkyPyPacketReader
+from linkypy.reader.replay import CaptureReader, Replay
+from linkypy import CONF, history, metrics, sinks
 
 GOOD_PACKET = bytearray(b"ADCO 012345678901 E\r\n\
 OPTARIF HC.. <\r\n\
@@ -46,3 +55,282 @@ class TestLinkyPy(unittest.TestCase):
         lpr = LinkyPyPacketReader()
         data = lpr.handle_packet(GOOD_PACKET)
         self.assertEqual(len(data.keys()), 11, "Should find keys in Linky packet.")
+
+    def test_004_compute_line_standard(self):
+        """
+        Testing standard mode lines (with and without timestamp field)
+        """
+        lpr = LinkyPyPacketReader()
+        self.assertEqual(lpr.compute_line("ADSC\t041876097470\tB"), ("ADSC", "041876097470"))
+        self.assertEqual(lpr.compute_line(b"DATE\tE201121124511\t\t3"), ("DATE", ""))
+        with self.assertRaises(LinkyPyChecksumError):
+            lpr.compute_line("SINSTS\t00510\tM")
+
+    def test_005_data_received(self):
+        """
+        Testing packets split across serial reads
+        """
+        lpr = LinkyPyPacketReader()
+        packets = []
+        lpr.handle_packet = lambda packet, start, end: packets.append(bytes(packet[start:end]))
+        stream = b"\x02\n" + bytes(GOOD_PACKET) + b"\x03\x02\n" + bytes(GOOD_PACKET) + b"\x03\x02\nADCO"
+        for i in range(0, len(stream), 7):
+            lpr.data_received(stream[i:i + 7])
+        self.assertEqual(len(packets), 2)
+        self.assertEqual(packets[1], b"\n" + bytes(GOOD_PACKET))
+        self.assertEqual(bytes(lpr.buffer), b"\nADCO")
+
+    def test_006_typed_frame(self):
+        """
+        Testing frame values are decoded once, in a read-only frame
+        """
+        from linkypy.reader.frame import Ptec
+
+        frame = LinkyPyPacketReader().handle_packet(GOOD_PACKET, timestamp='2020-11-21T12:45:11')
+        self.assertEqual((frame['HCHP'], frame['PAPP'], frame['IINST']), (1262798, 510, 2))
+        self.assertIs(frame['PTEC'], Ptec.PEAK)
+        self.assertEqual(str(frame['PTEC']), 'HP..')
+        self.assertEqual((frame['ADCO'], frame['OPTARIF']), ('012345678901', 'HC..'))
+        self.assertEqual((frame.meter, frame.timestamp), ('012345678901', '2020-11-21T12:45:11'))
+        with self.assertRaises(TypeError):
+            frame['PAPP'] = 0
+
+    def test_007_label_cache(self):
+        """
+        Testing labels of lines with an invalid checksum are not cached
+        """
+        lpr = LinkyPyPacketReader()
+        with self.assertRaises(LinkyPyChecksumError):
+            lpr.compute_line("ADCX 012345678901 E")
+        self.assertEqual(lpr.labels, {})
+        lpr.compute_line("ADCO 012345678901 E")
+        self.assertEqual(lpr.labels, {b'ADCO': 'ADCO'})
+
+
+class TestThreadedReader(unittest.TestCase):
+    """
+    Threaded reader shutdown unittests.
+    """
+
+    def test_001_stop_on_sigterm(self):
+        """
+        Testing pending points and rollups are written when reader is stopped by SIGTERM
+        """
+        import signal
+        import threading
+        import time
+        from linkypy.benchmarks.http_stub import InfluxDBStub
+        from linkypy.callbacks.influxdb_callback import InfluxDBCallback
+        from linkypy.reader.packet_reader import open_serial, run_threaded
+
+        with tempfile.TemporaryDirectory() as directory, InfluxDBStub() as stub, \
+                mock.patch.dict(os.environ, {'INFLUXDB_SERVICE_HOST': '127.0.0.1', 'INFLUXDB_SERVICE_PORT': str(stub.port)}), \
+                mock.patch.object(sinks, '_sinks', {}), mock.patch.dict(CONF.linkypy, {'influxdb': {'flush_interval': 3600}, 'state_dir': directory}):
+            callback = InfluxDBCallback()
+            port = open_serial('loop://')
+            port.write(b"\x02\n" + bytes(GOOD_PACKET) + b"\x03\x02\n" + bytes(GOOD_PACKET) + b"\x03\x02")
+
+            def kill_when_computed():
+                deadline = time.monotonic() + 5
+                while not [q for q in stub.queries() if q.startswith('CREATE RETENTION POLICY')] and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                # Frames are computed once callback warmed up.
+                time.sleep(0.5)
+                os.kill(os.getpid(), signal.SIGTERM)
+
+            threading.Thread(target=kill_when_computed, daemon=True).start()
+            with mock.patch('linkypy.reader.packet_reader.get_callbacks', return_value=[callback]):
+                run_threaded(port)
+
+            written = b''.join(stub.writes())
+            self.assertIn(b'linky,meter=012345678901', written)
+            self.assertIn(b'linky_mean_1m,', written)
+            self.assertTrue(os.path.exists(os.path.join(directory, 'rollup-linky_mean.json')))
+
+
+class TestChangeDetector(unittest.TestCase):
+    """
+    Change detection unittests.
+    """
+
+    def test_001_deadbands_and_heartbeat(self):
+        """
+        Testing only changed fields are emitted, outside deadbands, with a full snapshot on heartbeat
+        """
+        detector = ChangeDetector(heartbeat=60, deadbands={'PAPP': 50})
+        first = {'ADCO': '012345678901', 'HCHP': 1000, 'PAPP': 500}
+        self.assertEqual(detector.changes(first, 'A', 0), first)
+        self.assertEqual(detector.changes({'ADCO': '012345678901', 'HCHP': 1000, 'PAPP': 530}, 'A', 10), {})
+        self.assertEqual(detector.changes({'ADCO': '012345678901', 'HCHP': 1001, 'PAPP': 540}, 'A', 20), {'HCHP': 1001})
+        self.assertEqual(detector.changes({'ADCO': '012345678901', 'HCHP': 1001, 'PAPP': 560}, 'A', 30), {'PAPP': 560})
+        self.assertEqual(detector.changes(first, 'B', 30), first)
+        self.assertEqual(len(detector.changes({'ADCO': '012345678901', 'HCHP': 1001, 'PAPP': 560}, 'A', 80)), 3)
+
+    def test_002_frame_changes(self):
+        """
+        Testing reader frames carry changes, and InfluxDB callback only writes changed fields
+        """
+        from linkypy.callbacks.influxdb_callback import InfluxDBCallback
+
+        reader = LinkyPyPacketReader()
+        reader.detector = ChangeDetector(heartbeat=300)
+        first = reader.handle_packet(GOOD_PACKET, timestamp='2020-11-21T12:45:11')
+        second = reader.handle_packet(GOOD_PACKET.replace(b"PAPP 00510 \'", b"PAPP 00520 ("), timestamp='2020-11-21T12:45:12')
+        self.assertEqual(len(first.changes), 11)
+        self.assertEqual(second.changes, {'PAPP': 520})
+
+        with mock.patch('linkypy.callbacks.influxdb_callback.get_sink'):
+            callback = InfluxDBCallback()
+        callback.compute(second, second.timestamp, second.meter)
+        self.assertEqual(callback.sink.write.call_args[0][0][0]['fields'], {'PAPP': 520})
+
+
+class TestReplay(unittest.TestCase):
+    """
+    Capture replay unittests.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        frame = b"\x02\n" + bytes(GOOD_PACKET) + b"\x03"
+        # Truncated first frame, a frame without timestamp and two timestamped ones.
+        self.capture = b"E 0\r\x03" + frame + b"@2020-11-21T12:45:11\n" + frame + b"@2020-11-21T13:45:12+01:00" + frame + b"\x02\nADCO"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, filename, opener=open):
+        path = os.path.join(self.directory.name, filename)
+        with opener(path, 'wb') as f:
+            f.write(self.capture)
+        return path
+
+    def test_001_capture_reader(self):
+        """
+        Testing frames and timestamps are read from plain and compressed captures
+        """
+        for path in (self.write('capture.tic'), self.write('capture.tic.gz', gzip.open)):
+            frames = [(bytes(buffer[start:end]), timestamp) for buffer, start, end, timestamp in CaptureReader(path, chunk_size=64)]
+            self.assertEqual([timestamp for _, timestamp in frames], [None, '2020-11-21T12:45:11', '2020-11-21T12:45:12'])
+            self.assertEqual(set(frame for frame, _ in frames), {b"\n" + bytes(GOOD_PACKET)})
+
+    def test_002_replay(self):
+        """
+        Testing frames are replayed through callbacks, keeping their timestamps
+        """
+        received = []
+        state_dirs = []
+
+        class Callback(object):
+
+            def __init__(self):
+                state_dirs.append(CONF.linkypy.get('state_dir'))
+
+            def compute(self, data, timestamp, meter=None):
+                received.append((timestamp, meter, data['PAPP']))
+
+        live_state_dir = CONF.linkypy.get('state_dir')
+        with mock.patch('linkypy.reader.replay.get_callbacks', side_effect=lambda: [Callback()]), mock.patch.object(sinks, '_sinks', {}):
+            self.assertEqual(Replay(self.write('capture.tic')).run(), 3)
+            self.assertEqual(Replay(self.write('capture.tic'), state_dir=self.directory.name).run(), 3)
+
+        # Replays never share state files of running reader.
+        self.assertNotEqual(state_dirs[0], live_state_dir)
+        self.assertEqual(state_dirs[1], self.directory.name)
+        self.assertEqual(CONF.linkypy.get('state_dir'), live_state_dir)
+        received = received[:3]
+
+        self.assertEqual([meter for _, meter, _ in received], ['012345678901'] * 3)
+        self.assertEqual([timestamp for timestamp, _, _ in received][1:], ['2020-11-21T12:45:11', '2020-11-21T12:45:12'])
+
+
+class TestHistory(unittest.TestCase):
+    """
+    Local query API unittests.
+    """
+
+    def setUp(self):
+        HISTORY.configure(enabled=True, capacity=3)
+
+    def tearDown(self):
+        HISTORY.configure()
+        HISTORY.buffers.clear()
+
+    def get(self, server, path):
+        import json
+
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:%d%s" % (server.server_address[1], path)) as response:
+                return response.status, json.loads(response.read().decode())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read().decode())
+
+    def test_001_ring_buffer_queries(self):
+        """
+        Testing latest frame, history and aggregates are served from the ring buffer, oldest frames overwritten
+        """
+        reader = LinkyPyPacketReader()
+        for i, papp in enumerate((b"00510 '", b"00520 (", b"00530 )", b"00540 *")):
+            reader.handle_packet(GOOD_PACKET.replace(b"PAPP 00510 '", b"PAPP " + papp), timestamp='2020-11-21T12:45:1%d' % i)
+
+        server = history.serve(0)
+        try:
+            status, latest = self.get(server, '/latest')
+            _, frames = self.get(server, '/history?since=2020-11-21T12:45:12')
+            _, aggregate = self.get(server, '/aggregate?meter=012345678901&since=2020-11-21T12:00:00')
+            unknown, _ = self.get(server, '/aggregate?meter=0')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(status, 200)
+        self.assertEqual(latest, {'meter': '012345678901', 'time': '2020-11-21T12:45:13', 'PAPP': 540, 'HCHC': 835358, 'HCHP': 1262798, 'IINST': 2})
+        self.assertEqual(frames['PAPP'], [530, 540])
+        self.assertEqual(frames['time'], ['2020-11-21T12:45:12', '2020-11-21T12:45:13'])
+        self.assertEqual((aggregate['count'], aggregate['PAPP']), (3, {'mean': 530, 'min': 520, 'max': 540}))
+        self.assertEqual(aggregate['HCHP']['delta'], 0)
+        self.assertEqual(unknown, 404)
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Metrics unittests.
+    """
+
+    def test_001_exposition(self):
+        """
+        Testing metrics are exposed in Prometheus text format over HTTP
+        """
+        registry = metrics.MetricsRegistry()
+        errors = registry.register(metrics.Counter, 'test_errors_total', "Errors.", ['label'])
+        duration = registry.register(metrics.Histogram, 'test_duration_seconds', "Duration.", buckets=(0.1, 1))
+        registry.register(metrics.Gauge, 'test_depth', "Depth.", ['queue'], collect=lambda: [(('a"b',), 3)])
+
+        errors.inc('PAPP')
+        errors.inc('PAPP', amount=2)
+        duration.observe(0.05)
+        duration.observe(0.5)
+
+        with mock.patch.object(metrics, 'REGISTRY', registry):
+            server = metrics.serve(0)
+            try:
+                with urllib.request.urlopen("http://127.0.0.1:%d/metrics" % server.server_address[1]) as response:
+                    body = response.read().decode()
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        self.assertIn('# TYPE test_errors_total counter\ntest_errors_total{label="PAPP"} 3\n', body)
+        self.assertIn('test_duration_seconds_bucket{le="0.1"} 1\ntest_duration_seconds_bucket{le="1"} 2\ntest_duration_seconds_bucket{le="+Inf"} 2\n', body)
+        self.assertIn('test_duration_seconds_count 2\n', body)
+        self.assertIn('test_depth{queue="a\\"b"} 3\n', body)
+
+    def test_002_checksum_errors(self):
+        """
+        Testing checksum errors are counted by label
+        """
+        before = CHECKSUM_ERRORS.get('PAPP'), FRAMES_REJECTED.get('checksum')
+        lpr = LinkyPyPacketReader()
+        lpr.handle_packet(GOOD_PACKET)
+        lpr.handle_packet(GOOD_PACKET.replace(b"PAPP 00510", b"PAPP 00511"))
+        self.assertEqual((CHECKSUM_ERRORS.get('PAPP'), FRAMES_REJECTED.get('checksum')), (before[0] + 1, before[1] + 1))
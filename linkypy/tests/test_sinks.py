@@ -0,0 +1,200 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+from linkypy import CONF, sinks
+from linkypy.benchmarks.http_stub import HTTPStub, InfluxDBStub
+from linkypy.callbacks.influxdb_callback import InfluxDBCallback
+from linkypy.sinks.batch_writer import InfluxDBBatchWriter
+from linkypy.sinks.spool import InfluxDBSpool
+
+
+class FakeInfluxDBClient(object):
+
+    def __init__(self):
+        self.writes = []
+
+    def write_points(self, points, time_precision=None, retention_policy=None):
+        self.writes.append((retention_policy, list(points)))
+
+
+class TestInfluxDBBatchWriter(unittest.TestCase):
+    """
+    InfluxDB batch writer unittests.
+    """
+
+    def test_001_flush_on_size(self):
+        """
+        Testing points are written once batch size is reached
+        """
+        client = FakeInfluxDBClient()
+        writer = InfluxDBBatchWriter(client, batch_size=3, flush_interval=3600)
+        writer.write([{'fields': {'PAPP': 1}}, {'fields': {'PAPP': 2}}], retention_policy='linky_rp')
+        writer.write([{'fields': {'PAPP': 3}}], retention_policy='linky_rp')
+        writer.close()
+        self.assertEqual(len(client.writes), 1)
+        self.assertEqual(len(client.writes[0][1]), 3)
+
+    def test_002_flush_on_close(self):
+        """
+        Testing pending points are written by retention policy on close
+        """
+        client = FakeInfluxDBClient()
+        writer = InfluxDBBatchWriter(client, batch_size=100, flush_interval=3600)
+        writer.write([{'fields': {'PAPP': 1}}], retention_policy='linky_rp')
+        writer.write([{'fields': {'PAPP': 1}}])
+        writer.close()
+        self.assertEqual(sorted(rp or '' for rp, _ in client.writes), ['', 'linky_rp'])
+
+    def test_003_flush_on_interval(self):
+        """
+        Testing points are written flush interval after the oldest one, with less than batch size pending
+        """
+        client = FakeInfluxDBClient()
+        writer = InfluxDBBatchWriter(client, batch_size=500, flush_interval=0.2)
+        writer.write([{'fields': {'PAPP': 1}}], retention_policy='linky_rp')
+        deadline = time.monotonic() + 2
+        while not client.writes and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(client.writes, [('linky_rp', [{'fields': {'PAPP': 1}}])])
+        writer.close()
+
+
+class TestInfluxDBSpool(unittest.TestCase):
+    """
+    InfluxDB spool unittests, against a local InfluxDB stand-in.
+    """
+
+    def test_001_spool_and_replay(self):
+        """
+        Testing points are spooled while InfluxDB fails, then replayed
+        """
+        with tempfile.TemporaryDirectory() as directory, HTTPStub(status=500) as stub:
+            client = InfluxDBClient('127.0.0.1', stub.port, database='linky', retries=0)
+            spool = InfluxDBSpool(os.path.join(directory, 'spool.db'), max_points=3, replay_batch_size=2)
+            writer = InfluxDBBatchWriter(client, batch_size=100, flush_interval=3600)
+            writer.spool = spool
+
+            for i in range(4):
+                writer.write([{'measurement': 'linky', 'time': i, 'fields': {'PAPP': i}}], retention_policy='linky_rp')
+                writer.flush()
+            writer.close()
+
+            # Oldest point was dropped as spool is bounded.
+            self.assertEqual(len(spool), 3)
+            self.assertEqual(spool.dropped, 1)
+
+            with self.assertRaises(Exception):
+                spool.replay(client)
+            self.assertEqual(len(spool), 3)
+
+            stub.status = 204
+            self.assertEqual(spool.replay(client), 2)
+            self.assertEqual(spool.replay(client), 1)
+            self.assertEqual(spool.replay(client), 0)
+            self.assertEqual(len(spool), 0)
+
+            written = b''.join(body for _, path, _, body in stub.requests[-2:])
+            self.assertIn(b'linky PAPP=1i 1', written)
+            self.assertIn(b'linky PAPP=3i 3', written)
+            self.assertNotIn(b'PAPP=0i', written)
+
+    def test_002_rejected_points(self):
+        """
+        Testing invalid points rejected by InfluxDB are not spooled, and do not block spool replay
+        """
+        with tempfile.TemporaryDirectory() as directory, HTTPStub(status=404) as stub:
+            client = InfluxDBClient('127.0.0.1', stub.port, database='linky', retries=0)
+            spool = InfluxDBSpool(os.path.join(directory, 'spool.db'), max_points=2, replay_batch_size=1)
+            writer = InfluxDBBatchWriter(client, batch_size=100, flush_interval=3600)
+            writer.spool = spool
+
+            # Missing database may be created again: points are spooled.
+            writer.write([{'measurement': 'linky', 'time': 1, 'fields': {'PAPP': 1}}], retention_policy='linky_rp')
+            writer.flush()
+            self.assertEqual(len(spool), 1)
+
+            stub.status = 400
+            writer.write([{'measurement': 'linky', 'time': 0, 'fields': {'PAPP': 0}}], retention_policy='linky_rp')
+            writer.close()
+            self.assertEqual(len(spool), 1)
+
+            # Spooled while InfluxDB was unreachable, then rejected.
+            spool.append([{'measurement': 'linky', 'time': 2, 'fields': {'PAPP': 2}}], 'linky_rp')
+            self.assertEqual(spool.replay(client), 0)
+            self.assertEqual(spool.rejected, 1)
+
+            stub.status = 204
+            self.assertEqual(spool.replay(client), 1)
+            self.assertEqual(len(spool), 0)
+            self.assertIn(b'linky PAPP=2i 2', stub.requests[-1][3])
+            self.assertEqual(spool.db.execute("SELECT COUNT(*) FROM rejected").fetchone()[0], 1)
+
+            # Rejected points are bounded too.
+            spool.quarantine([{'measurement': 'linky', 'time': i, 'fields': {'PAPP': i}} for i in range(3)], 'linky_rp', 'invalid')
+            self.assertEqual(spool.db.execute("SELECT COUNT(*) FROM rejected").fetchone()[0], 2)
+
+    def test_003_unavailable_spool(self):
+        """
+        Testing writer works without spool when spool file cannot be created
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Spool directory would have to be created inside a file.
+            path = os.path.join(directory, 'file')
+            open(path, 'w').close()
+            client = FakeInfluxDBClient()
+            with self.assertLogs('linkypy.sinks.spool', 'ERROR'):
+                writer = InfluxDBBatchWriter(client, batch_size=100, flush_interval=3600, spool={'path': os.path.join(path, 'spool.db')})
+            self.assertIsNone(writer.spool)
+            writer.write([{'fields': {'PAPP': 1}}])
+            writer.close()
+            self.assertEqual(len(client.writes), 1)
+
+
+class TestInfluxDBSink(unittest.TestCase):
+    """
+    Shared InfluxDB sink unittests.
+    """
+
+    def test_001_shared_sink(self):
+        """
+        Testing callbacks share connection, schema setup and write requests
+        """
+        with InfluxDBStub() as stub, mock.patch.dict(os.environ, {'INFLUXDB_SERVICE_HOST': '127.0.0.1', 'INFLUXDB_SERVICE_PORT': str(stub.port)}), \
+                mock.patch.object(sinks, '_sinks', {}), mock.patch.dict(CONF.linkypy, {'influxdb': {'flush_interval': 3600}}):
+            callbacks = [InfluxDBCallback(), InfluxDBCallback()]
+            sink = callbacks[0].sink
+            self.assertIs(callbacks[1].sink, sink)
+
+            for callback in callbacks:
+                callback.warm_up()
+            self.assertEqual(len([q for q in stub.queries() if q.startswith('CREATE DATABASE')]), 1)
+            self.assertEqual(len([q for q in stub.queries() if q.startswith('CREATE RETENTION POLICY')]), 1)
+
+            for callback in callbacks:
+                callback.compute({'HCHC': '1', 'HCHP': '2', 'PAPP': '3'}, 0)
+            sink.close()
+            self.assertEqual(len(stub.writes()), 1)
+
+    def test_002_async_client(self):
+        """
+        Testing asyncio client writes points, reconnecting when server closed connection
+        """
+        from linkypy.sinks.async_http import AsyncInfluxDBClient
+
+        async def write(client):
+            for value in (1, 2):
+                await client.write_points([{'measurement': 'linky', 'time': '2020-01-01T00:00:00Z', 'fields': {'PAPP': value}}], time_precision='s')
+            await client.close()
+
+        with InfluxDBStub() as stub:
+            asyncio.run(write(AsyncInfluxDBClient('127.0.0.1', stub.port, 'linky', 'admin', 'password')))
+            self.assertEqual(stub.writes(), [b'linky PAPP=1i 1577836800\n', b'linky PAPP=2i 1577836800\n'])
+
+        with InfluxDBStub(status=400) as stub, self.assertRaises(InfluxDBClientError):
+            asyncio.run(write(AsyncInfluxDBClient('127.0.0.1', stub.port, 'linky', 'admin', 'password')))
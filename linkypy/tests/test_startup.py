@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# Import time budget of command line and reader modules, in seconds.
+IMPORT_BUDGET = float(os.getenv('LINKYPY_IMPORT_BUDGET', 0.5))
+
+HEAVY_MODULES = ('pandas', 'numpy', 'camelot', 'pdfplumber', 'requests', 'influxdb')
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import linkypy.console.cli
+import linkypy.reader.packet_reader
+elapsed = time.perf_counter() - start
+try:
+    linkypy.console.cli.linkypy(['--help'])
+except SystemExit:
+    pass
+print(json.dumps({
+    'elapsed': elapsed,
+    'config_loaded': linkypy.CONF.loaded,
+    'heavy_modules': [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+class TestStartup(unittest.TestCase):
+    """
+    Startup time regression tests.
+    """
+
+    def startup(self):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT])
+        return json.loads(output.decode().strip().splitlines()[-1])
+
+    def test_001_lazy_imports(self):
+        """
+        Testing '--help' neither loads configuration nor heavy libraries
+        """
+        result = self.startup()
+        self.assertFalse(result['config_loaded'])
+        self.assertEqual(result['heavy_modules'], [])
+
+    def test_002_import_time(self):
+        """
+        Testing import time stays under budget (best of 3)
+        """
+        elapsed = min(self.startup()['elapsed'] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET, "Startup imports took %.3fs (budget is %.3fs)" % (elapsed, IMPORT_BUDGET))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import collections
+import datetime
+import heapq
+import logging
+import signal
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class FrameTrace(object):
+    """
+    Spans of a frame: parsing, then waiting in queue and computation of each callback.
+
+    Frame is complete once every callback it was dispatched to computed (or dropped) it.
+    """
+
+    __slots__ = ('tracer', 'meter', 'time', 'start', 'dispatched', 'spans', 'pending', 'lock')
+
+    def __init__(self, tracer):
+
+        self.tracer = tracer
+        self.meter = None
+        self.time = time.time()
+        self.start = time.perf_counter()
+        self.dispatched = None
+        self.spans = []
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def span(self, name, start, end):
+        self.spans.append((name, start, end))
+
+    def dispatch(self, meter, callbacks):
+        self.meter = meter
+        self.dispatched = time.perf_counter()
+        self.pending = callbacks
+        if not callbacks:
+            self.tracer.finish(self)
+
+    def complete(self, *spans):
+        with self.lock:
+            self.spans.extend(spans)
+            self.pending -= 1
+            complete = self.pending == 0
+        if complete:
+            self.tracer.finish(self)
+
+    def computed(self, name, start, end):
+        self.complete(('wait:' + name, self.dispatched, start), (name, start, end))
+
+    def dropped(self, name):
+        self.complete(('dropped:' + name, self.dispatched, time.perf_counter()))
+
+    def skipped(self, name):
+        self.complete(('skipped:' + name, self.dispatched, time.perf_counter()))
+
+    @property
+    def duration(self):
+        return max(end for _, _, end in self.spans) - self.start if self.spans else 0.
+
+    def format(self):
+        spans = " | ".join("%s %.1fms" % (name, (end - start) * 1000.) for name, start, end in self.spans)
+        return "%s meter=%s total=%.1fms: %s" % (datetime.datetime.fromtimestamp(self.time).isoformat(), self.meter, self.duration * 1000., spans)
+
+
+class Tracer(object):
+    """
+    Optional per-frame tracing, keeping the last ``window`` frames to report the ``slowest`` ones,
+    and watchdog logging the stack of callbacks computing a packet for more than ``budget`` seconds.
+
+    Both are disabled by default: hot path then only checks ``enabled`` / ``watching`` flags.
+    """
+
+    def __init__(self):
+
+        self.enabled = False
+        self.watching = False
+        self.slowest = 20
+        self.budget = None
+        self.interval = 1.
+        self.recent = collections.deque(maxlen=1000)
+        self.lock = threading.Lock()
+
+        # Callbacks being computed: thread ident -> (callback name, start, reported)
+        self.computing = {}
+        self.watchdog = None
+
+    def configure(self, enabled=False, slowest=20, window=1000, budget=None, watchdog_interval=1):
+        self.enabled = bool(enabled)
+        self.slowest = int(slowest)
+        self.recent = collections.deque(maxlen=int(window))
+        self.budget = float(budget) if budget else None
+        self.interval = float(watchdog_interval)
+        self.watching = self.budget is not None
+
+    def frame(self):
+        return FrameTrace(self)
+
+    def finish(self, trace):
+        with self.lock:
+            self.recent.append(trace)
+
+    def slowest_frames(self, count=None):
+        with self.lock:
+            recent = list(self.recent)
+        return heapq.nlargest(count or self.slowest, recent, key=lambda trace: trace.duration)
+
+    def format(self):
+        frames = self.slowest_frames()
+        lines = ["Slowest %d of last %d traced frames:" % (len(frames), len(self.recent))]
+        lines.extend("  " + trace.format() for trace in frames)
+        return "\n".join(lines)
+
+    def dump(self, *args):
+        logger.warning(self.format())
+
+    def install(self):
+        """
+        Dump slowest frames on SIGUSR1, and start watchdog when a budget is set. Must be called from main thread.
+        """
+        if self.enabled and hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.dump)
+            logger.info("Frame tracing enabled, send SIGUSR1 to dump the %d slowest recent frames" % self.slowest)
+
+        if self.watching and self.watchdog is None:
+            self.watchdog = threading.Thread(target=self.watch, name="CallbackWatchdog", daemon=True)
+            self.watchdog.start()
+            logger.info("Callback watchdog enabled (budget is %.1fs)" % self.budget)
+
+    def enter(self, name):
+        self.computing[threading.get_ident()] = [name, time.monotonic(), False]
+
+    def exit(self):
+        self.computing.pop(threading.get_ident(), None)
+
+    def check(self):
+        """
+        Log stack of every callback computing for longer than budget, once per computation.
+        """
+        now = time.monotonic()
+        frames = None
+        for ident, state in list(self.computing.items()):
+            name, start, reported = state
+            if reported or now - start < self.budget:
+                continue
+            state[2] = True
+            if frames is None:
+                frames = sys._current_frames()
+            stack = "".join(traceback.format_stack(frames[ident])) if ident in frames else "(stack unavailable)\n"
+            logger.warning("Callback '%s' is computing for %.1fs (budget is %.1fs):\n%s" % (name, now - start, self.budget, stack))
+
+    def watch(self):
+        while self.watching:
+            time.sleep(self.interval)
+            self.check()
+
+
+TRACER = Tracer()